@@ -108,8 +108,8 @@ class TimingSettings(Settings):
 
 # Layouts/Interface --------------------------------------------------------------------------------
 
-def cmd_layout(address_width):
-    return [
+def cmd_layout(address_width, id_width=0):
+    layout = [
         ("valid",            1, DIR_M_TO_S),
         ("ready",            1, DIR_S_TO_M),
         ("we",               1, DIR_M_TO_S),
@@ -119,6 +119,16 @@ def cmd_layout(address_width):
         ("wdata_ready",      1, DIR_S_TO_M),
         ("rdata_valid",      1, DIR_S_TO_M)
     ]
+    if id_width:
+        # Reordering bank machines: commands are tagged with the id of the master, data_id gives
+        # the master of the wdata_ready/rdata_valid access and locks the masters with pending
+        # commands.
+        layout += [
+            ("id",          id_width, DIR_M_TO_S),
+            ("data_id",     id_width, DIR_S_TO_M),
+            ("locks",   2**id_width, DIR_S_TO_M),
+        ]
+    return layout
 
 def data_layout(data_width):
     return [
@@ -167,9 +177,11 @@ class LiteDRAMInterface(Record):
         self.data_width    = settings.phy.dfi_databits*settings.phy.nphases
         self.nbanks   = settings.phy.nranks*(2**settings.geom.bankbits)
         self.nranks   = settings.phy.nranks
+        self.id_width = settings.reordering_id_width if settings.with_reordering else 0
         self.settings = settings
 
-        layout = [("bank"+str(i), cmd_layout(self.address_width)) for i in range(self.nbanks)]
+        layout = [("bank"+str(i), cmd_layout(self.address_width, self.id_width))
+            for i in range(self.nbanks)]
         layout += data_layout(self.data_width)
         Record.__init__(self, layout)
 
@@ -5,6 +5,9 @@
 
 """LiteDRAM Bandwidth."""
 
+from functools import reduce
+from operator import add
+
 from migen import *
 
 from litex.soc.interconnect.csr import *
@@ -53,3 +56,36 @@ class Bandwidth(Module, AutoCSR):
                 self.nwrites.status.eq(nwrites_r)
             )
         ]
+
+# Bandwidth Counters -------------------------------------------------------------------------------
+
+class BandwidthCounters(Module):
+    """Cumulative DFI command/data bus counters
+
+    Counts, while enable is set, the elapsed cycles and the phases carrying a command, a read or a
+    write on the DFI interface. Intended for simulation statistics: command bus utilization is
+    ncmds/(cycles*nphases), data bus utilization is (nreads + nwrites)/(cycles*nphases).
+    """
+    def __init__(self, dfi, counter_bits=32):
+        self.enable  = Signal(reset=1)
+        self.nphases = len(dfi.phases)
+        self.cycles  = Signal(counter_bits)
+        self.ncmds   = Signal(counter_bits)
+        self.nreads  = Signal(counter_bits)
+        self.nwrites = Signal(counter_bits)
+
+        # # #
+
+        cmds   = [Signal() for _ in dfi.phases]
+        reads  = [phase.rddata_en for phase in dfi.phases]
+        writes = [phase.wrdata_en for phase in dfi.phases]
+        for cmd, phase in zip(cmds, dfi.phases):
+            self.comb += cmd.eq((phase.cs_n != (2**len(phase.cs_n) - 1)) &
+                (~phase.cas_n | ~phase.ras_n | ~phase.we_n))
+
+        self.sync += If(self.enable,
+            self.cycles.eq(self.cycles + 1),
+            self.ncmds.eq(self.ncmds + reduce(add, cmds)),
+            self.nreads.eq(self.nreads + reduce(add, reads)),
+            self.nwrites.eq(self.nwrites + reduce(add, writes)),
+        )
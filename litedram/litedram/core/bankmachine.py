@@ -5,6 +5,8 @@
 """LiteDRAM BankMachine (Rows/Columns management)."""
 
 import math
+from functools import reduce
+from operator import or_
 
 from migen import *
 
@@ -28,11 +30,101 @@ class _AddressSlicer:
         split = self.colbits - self.address_align
         return Cat(Replicate(0, self.address_align), address[:split])
 
+# ReorderingCommandBuffer --------------------------------------------------------------------------
+
+class _ReorderingCommandBuffer(Module):
+    """Reordering Command Buffer
+
+    Pending commands of a BankMachine, ordered by age (entry 0 is the oldest). The first command
+    hitting the opened row is presented first (FR-FCFS), the oldest one otherwise. A command never
+    bypasses an older command from the same master (preserving the data ordering of the ports)
+    nor an older command to the same address when one of them is a write. The oldest command is
+    forced once it has been bypassed max_age times to avoid starvation.
+    """
+    def __init__(self, address_width, id_width, rowbits, depth, max_age, slicer):
+        layout = [("we", 1), ("addr", address_width), ("id", id_width)]
+        self.sink        = sink   = stream.Endpoint(layout)
+        self.source      = source = stream.Endpoint(layout)
+        self.row         = row         = Signal(rowbits)
+        self.row_opened  = row_opened  = Signal()
+        self.locks       = locks       = Signal(2**id_width)
+        self.pending     = pending     = Signal() # Other commands than source are pending
+        self.pending_hit = pending_hit = Signal() # One of them hits the row of source
+
+        # # #
+
+        valids  = [Signal() for k in range(depth)]
+        entries = [Record(layout) for k in range(depth)]
+        level   = Signal(max=depth + 1)
+        sel     = Signal(max=depth)
+        bypass  = Signal(max=max_age + 1)
+
+        # Selection --------------------------------------------------------------------------------
+        hits = []
+        for k in range(depth):
+            hazard = 0
+            for j in range(k):
+                hazard = hazard | (valids[j] & (
+                    (entries[j].id == entries[k].id) |
+                    ((entries[j].addr == entries[k].addr) & (entries[j].we | entries[k].we))))
+            hit = Signal()
+            self.comb += hit.eq(valids[k] & ~hazard & row_opened &
+                (slicer.row(entries[k].addr) == row))
+            hits.append(hit)
+        self.comb += If(bypass != max_age, *[If(hits[k], sel.eq(k)) for k in reversed(range(depth))])
+
+        self.comb += [
+            source.valid.eq(Array(valids)[sel]),
+            source.we.eq(Array(e.we for e in entries)[sel]),
+            source.addr.eq(Array(e.addr for e in entries)[sel]),
+            source.id.eq(Array(e.id for e in entries)[sel]),
+            pending.eq(reduce(or_, [valids[k] & (sel != k) for k in range(depth)])),
+            pending_hit.eq(reduce(or_, [valids[k] & (sel != k) &
+                (slicer.row(entries[k].addr) == slicer.row(source.addr)) for k in range(depth)])),
+        ]
+        for m in range(2**id_width):
+            self.comb += locks[m].eq(reduce(or_, [v & (e.id == m) for v, e in zip(valids, entries)]))
+
+        # Update -----------------------------------------------------------------------------------
+        push   = Signal()
+        pop    = Signal()
+        wr_idx = Signal(max=depth + 1)
+        self.comb += [
+            sink.ready.eq(level != depth),
+            push.eq(sink.valid & sink.ready),
+            pop.eq(source.valid & source.ready),
+            wr_idx.eq(level - pop),
+        ]
+        self.sync += level.eq(level + push - pop)
+        for k in range(depth):
+            # Entries above the issued one move down, new command is appended after the last one
+            if k + 1 < depth:
+                shift = [valids[k].eq(valids[k + 1])]
+                shift += [getattr(entries[k], f).eq(getattr(entries[k + 1], f)) for f, _ in layout]
+            else:
+                shift = [valids[k].eq(0)]
+            self.sync += [
+                If(pop & (sel <= k), *shift),
+                If(push & (wr_idx == k),
+                    valids[k].eq(1),
+                    *[getattr(entries[k], f).eq(getattr(sink, f)) for f, _ in layout]
+                )
+            ]
+        self.sync += \
+            If(pop,
+                If(sel == 0,
+                    bypass.eq(0)
+                ).Else(
+                    bypass.eq(bypass + 1)
+                )
+            )
+
 # BankMachine --------------------------------------------------------------------------------------
 
 class BankMachine(Module):
     def __init__(self, n, address_width, address_align, nranks, settings):
-        self.req = req = Record(cmd_layout(address_width))
+        id_width = settings.reordering_id_width if settings.with_reordering else 0
+        self.req = req = Record(cmd_layout(address_width, id_width))
         self.refresh_req = refresh_req = Signal()
         self.refresh_gnt = refresh_gnt = Signal()
 
@@ -44,20 +136,6 @@ class BankMachine(Module):
 
         auto_precharge = Signal()
 
-        # Command buffer ---------------------------------------------------------------------------
-        cmd_buffer_layout    = [("we", 1), ("addr", len(req.addr))]
-        cmd_buffer_lookahead = stream.SyncFIFO(
-            cmd_buffer_layout, settings.cmd_buffer_depth,
-            buffered=settings.cmd_buffer_buffered)
-        cmd_buffer = stream.Buffer(cmd_buffer_layout) # 1 depth buffer to detect row change
-        self.submodules += cmd_buffer_lookahead, cmd_buffer
-        self.comb += [
-            req.connect(cmd_buffer_lookahead.sink, keep={"valid", "ready", "we", "addr"}),
-            cmd_buffer_lookahead.source.connect(cmd_buffer.sink),
-            cmd_buffer.source.ready.eq(req.wdata_ready | req.rdata_valid),
-            req.lock.eq(cmd_buffer_lookahead.source.valid | cmd_buffer.source.valid),
-        ]
-
         slicer = _AddressSlicer(settings.geom.colbits, address_align)
 
         # Row tracking -----------------------------------------------------------------------------
@@ -66,6 +144,40 @@ class BankMachine(Module):
         row_hit    = Signal()
         row_open   = Signal()
         row_close  = Signal()
+
+        # Command buffer ---------------------------------------------------------------------------
+        if settings.with_reordering:
+            cmd_buffer = _ReorderingCommandBuffer(
+                address_width = len(req.addr),
+                id_width      = len(req.id),
+                rowbits       = settings.geom.rowbits,
+                depth         = settings.cmd_buffer_depth,
+                max_age       = settings.reordering_max_age,
+                slicer        = slicer)
+            self.submodules += cmd_buffer
+            self.comb += [
+                req.connect(cmd_buffer.sink, keep={"valid", "ready", "we", "addr", "id"}),
+                cmd_buffer.source.ready.eq(req.wdata_ready | req.rdata_valid),
+                cmd_buffer.row.eq(row),
+                cmd_buffer.row_opened.eq(row_opened),
+                req.data_id.eq(cmd_buffer.source.id),
+                req.locks.eq(cmd_buffer.locks),
+                req.lock.eq(cmd_buffer.locks != 0),
+            ]
+        else:
+            cmd_buffer_layout    = [("we", 1), ("addr", len(req.addr))]
+            cmd_buffer_lookahead = stream.SyncFIFO(
+                cmd_buffer_layout, settings.cmd_buffer_depth,
+                buffered=settings.cmd_buffer_buffered)
+            cmd_buffer = stream.Buffer(cmd_buffer_layout) # 1 depth buffer to detect row change
+            self.submodules += cmd_buffer_lookahead, cmd_buffer
+            self.comb += [
+                req.connect(cmd_buffer_lookahead.sink, keep={"valid", "ready", "we", "addr"}),
+                cmd_buffer_lookahead.source.connect(cmd_buffer.sink),
+                cmd_buffer.source.ready.eq(req.wdata_ready | req.rdata_valid),
+                req.lock.eq(cmd_buffer_lookahead.source.valid | cmd_buffer.source.valid),
+            ]
+
         self.comb += row_hit.eq(row == slicer.row(cmd_buffer.source.addr))
         self.sync += \
             If(row_close,
@@ -75,6 +187,14 @@ class BankMachine(Module):
                 row.eq(slicer.row(cmd_buffer.source.addr))
             )
 
+        # Pending reads/writes (accepted but not issued yet) ---------------------------------------
+        self.pending_reads  = pending_reads  = Signal(max=settings.cmd_buffer_depth + 2)
+        self.pending_writes = pending_writes = Signal(max=settings.cmd_buffer_depth + 2)
+        self.sync += [
+            pending_reads.eq(pending_reads + (req.valid & req.ready & ~req.we) - req.rdata_valid),
+            pending_writes.eq(pending_writes + (req.valid & req.ready & req.we) - req.wdata_ready),
+        ]
+
         # Address generation -----------------------------------------------------------------------
         row_col_n_addr_sel = Signal()
         self.comb += [
@@ -102,13 +222,20 @@ class BankMachine(Module):
 
         # Auto Precharge generation ----------------------------------------------------------------
         if settings.with_auto_precharge:
-            self.comb += \
-                If(cmd_buffer_lookahead.source.valid & cmd_buffer.source.valid,
-                    If(slicer.row(cmd_buffer_lookahead.source.addr) !=
-                       slicer.row(cmd_buffer.source.addr),
+            if settings.with_reordering:
+                # Only close the row when none of the other pending commands hits it
+                self.comb += \
+                    If(cmd_buffer.source.valid & cmd_buffer.pending & ~cmd_buffer.pending_hit,
                         auto_precharge.eq(row_close == 0)
                     )
-                )
+            else:
+                self.comb += \
+                    If(cmd_buffer_lookahead.source.valid & cmd_buffer.source.valid,
+                        If(slicer.row(cmd_buffer_lookahead.source.addr) !=
+                           slicer.row(cmd_buffer.source.addr),
+                            auto_precharge.eq(row_close == 0)
+                        )
+                    )
 
         # Control and command generation FSM -------------------------------------------------------
         # Note: tRRD, tFAW, tCCD, tWTR timings are enforced by the multiplexer
@@ -4,6 +4,9 @@
 
 """LiteDRAM Controller."""
 
+from functools import reduce
+from operator import and_
+
 from migen import *
 
 from litedram.common import *
@@ -24,6 +27,10 @@ class ControllerSettings(Settings):
         read_time           = 32,
         write_time          = 16,
 
+        # Read/Write batching: writes are drained from high to low watermark (queued writes)
+        with_rw_batching    = False,
+        write_watermarks    = None, # None: (cmd_buffer_depth//4, cmd_buffer_depth)
+
         # Bandwidth
         with_bandwidth      = False,
 
@@ -32,11 +39,18 @@ class ControllerSettings(Settings):
         refresh_cls         = Refresher,
         refresh_zqcs_freq   = 1e0,
         refresh_postponing  = 1,
+        refresh_pull_in     = 0, # > 0: opportunistic refresh (pulled in when idle)
 
         # Auto-Precharge
         with_auto_precharge = True,
 
-        # Address mapping
+        # Reordering (row hits first, across masters)
+        with_reordering     = False,
+        reordering_max_age  = 16,
+        reordering_id_width = 4,
+
+        # Address mapping: ROW_BANK_COL, ROW_BANK_COL_XOR (bank xored with row), ROW_COL_BANK or
+        # BANK_ROW_COL (from MSBs to LSBs of the port addresses)
         address_mapping     = "ROW_BANK_COL"):
         self.set_attributes(locals())
 
@@ -70,10 +84,15 @@ class LiteDRAMController(Module):
         # # #
 
         # Refresher --------------------------------------------------------------------------------
+        # pull_in is only passed when enabled, custom refresh_cls may not support it
+        refresh_kwargs = {}
+        if self.settings.refresh_pull_in:
+            refresh_kwargs["pull_in"] = self.settings.refresh_pull_in
         self.submodules.refresher = self.settings.refresh_cls(self.settings,
             clk_freq   = clk_freq,
             zqcs_freq  = self.settings.refresh_zqcs_freq,
-            postponing = self.settings.refresh_postponing)
+            postponing = self.settings.refresh_postponing,
+            **refresh_kwargs)
 
         # Bank Machines ----------------------------------------------------------------------------
         bank_machines = []
@@ -86,6 +105,12 @@ class LiteDRAMController(Module):
             bank_machines.append(bank_machine)
             self.submodules += bank_machine
             self.comb += getattr(interface, "bank"+str(n)).connect(bank_machine.req)
+        self.bank_machines = bank_machines
+
+        # Opportunistic refresh: pull refreshes in when no command is pending
+        if self.settings.refresh_pull_in:
+            self.comb += self.refresher.idle.eq(reduce(and_,
+                [(bm.pending_reads == 0) & (bm.pending_writes == 0) for bm in bank_machines]))
 
         # Multiplexer ------------------------------------------------------------------------------
         self.submodules.multiplexer = Multiplexer(
@@ -33,6 +33,9 @@ class LiteDRAMCrossbar(Module):
         self.bank_bits = log2_int(self.nbanks, False)
         self.rank_bits = log2_int(self.nranks, False)
 
+        self.reordering = controller.settings.with_reordering
+        self.id_width   = controller.id_width
+
         self.masters = []
 
     def get_port(self, mode="both", data_width=None, clock_domain="sys", reverse=False, **kwargs):
@@ -92,12 +95,33 @@ class LiteDRAMCrossbar(Module):
     def do_finalize(self):
         controller = self.controller
         nmasters   = len(self.masters)
+        if self.reordering and nmasters > 2**self.id_width:
+            raise ValueError("{} masters but reordering is limited to {} (reordering_id_width={})".format(
+                nmasters, 2**self.id_width, self.id_width))
 
         # Address mapping --------------------------------------------------------------------------
-        cba_shifts = {"ROW_BANK_COL": controller.settings.geom.colbits - controller.address_align}
-        cba_shift = cba_shifts[controller.settings.address_mapping]
+        address_mapping = controller.settings.address_mapping
+        cba_shifts = {
+            "ROW_BANK_COL":     controller.settings.geom.colbits - controller.address_align,
+            "ROW_BANK_COL_XOR": controller.settings.geom.colbits - controller.address_align,
+            "ROW_COL_BANK":     0,
+            "BANK_ROW_COL":     self.rca_bits - self.rank_bits,
+        }
+        if address_mapping not in cba_shifts:
+            raise ValueError("Unsupported address mapping {}, supported: {}".format(
+                address_mapping, ", ".join(cba_shifts.keys())))
+        cba_shift = cba_shifts[address_mapping]
         m_ba      = [m.get_bank_address(self.bank_bits, cba_shift)for m in self.masters]
         m_rca     = [m.get_row_column_address(self.bank_bits, self.rca_bits, cba_shift) for m in self.masters]
+        if address_mapping == "ROW_BANK_COL_XOR":
+            # Permutation-based interleaving: the bank is xored with the low bits of the row, rows
+            # conflicting in a bank under ROW_BANK_COL are spread over the banks.
+            row_shift = cba_shift + self.bank_bits
+            m_ba = [ba ^ m.cmd.addr[row_shift:row_shift + self.bank_bits]
+                for ba, m in zip(m_ba, self.masters)]
+
+        # Row of the row/column addresses, as sliced by the bank machines
+        row_shift = controller.settings.geom.colbits - controller.address_align
 
         master_readys       = [0]*nmasters
         master_wdata_readys = [0]*nmasters
@@ -118,16 +142,44 @@ class LiteDRAMCrossbar(Module):
                 for other_nb, other_arbiter in enumerate(arbiters):
                     if other_nb != nb:
                         other_bank = getattr(controller, "bank"+str(other_nb))
-                        locked = locked | (other_bank.lock & (other_arbiter.grant == nm))
+                        if self.reordering:
+                            locked = locked | other_bank.locks[nm]
+                        else:
+                            locked = locked | (other_bank.lock & (other_arbiter.grant == nm))
                 master_locked.append(locked)
 
             # Arbitrate ----------------------------------------------------------------------------
             bank_selected  = [(ba == nb) & ~locked for ba, locked in zip(m_ba, master_locked)]
             bank_requested = [bs & master.cmd.valid for bs, master in zip(bank_selected, self.masters)]
-            self.comb += [
-                arbiter.request.eq(Cat(*bank_requested)),
-                arbiter.ce.eq(~bank.valid & ~bank.lock)
-            ]
+            bank_granted   = Signal()
+            self.comb += arbiter.request.eq(Cat(*bank_requested))
+            if self.reordering:
+                # Commands of all the masters are queued in the bank machine: the grant is kept
+                # while the granted master stays on the row of the last accepted command and is
+                # handed over on a row miss (the command then waits for the re-arbitration), so
+                # row hits of a master are not interleaved with row misses of the others.
+                rca          = Signal(self.rca_bits)
+                row          = Signal(len(rca) - row_shift)
+                last_row     = Signal(len(row))
+                rearbitrated = Signal(reset=1)
+                self.comb += [
+                    rca.eq(Array(m_rca)[arbiter.grant]),
+                    row.eq(rca[row_shift:]),
+                    bank_granted.eq(rearbitrated | (row == last_row)),
+                    arbiter.ce.eq(~bank.valid),
+                ]
+                self.sync += \
+                    If(arbiter.ce,
+                        rearbitrated.eq(1)
+                    ).Elif(bank.ready,
+                        rearbitrated.eq(0),
+                        last_row.eq(row)
+                    )
+            else:
+                self.comb += [
+                    bank_granted.eq(1),
+                    arbiter.ce.eq(~bank.valid & ~bank.lock),
+                ]
 
             # Get rdata source bank ----------------------------------------------------------------
             self.sync += If((arbiter.grant == nm) & bank.rdata_valid, rbank.eq(nb))
@@ -142,13 +194,18 @@ class LiteDRAMCrossbar(Module):
             self.comb += [
                 bank.addr.eq(Array(m_rca)[arbiter.grant]),
                 bank.we.eq(Array(self.masters)[arbiter.grant].cmd.we),
-                bank.valid.eq(Array(bank_requested)[arbiter.grant])
+                bank.valid.eq(Array(bank_requested)[arbiter.grant] & bank_granted)
             ]
-            master_readys = [master_ready | ((arbiter.grant == nm) & bank_selected[nm] & bank.ready)
-                for nm, master_ready in enumerate(master_readys)]
-            master_wdata_readys = [master_wdata_ready | ((arbiter.grant == nm) & bank.wdata_ready)
+            if self.reordering:
+                self.comb += bank.id.eq(arbiter.grant)
+                data_id = bank.data_id
+            else:
+                data_id = arbiter.grant
+            master_readys = [master_ready | ((arbiter.grant == nm) & bank_selected[nm] & bank.ready &
+                bank_granted) for nm, master_ready in enumerate(master_readys)]
+            master_wdata_readys = [master_wdata_ready | ((data_id == nm) & bank.wdata_ready)
                 for nm, master_wdata_ready in enumerate(master_wdata_readys)]
-            master_rdata_valids = [master_rdata_valid | ((arbiter.grant == nm) & bank.rdata_valid)
+            master_rdata_valids = [master_rdata_valid | ((data_id == nm) & bank.rdata_valid)
                 for nm, master_rdata_valid in enumerate(master_rdata_valids)]
 
         for nm, master_wdata_ready in enumerate(master_wdata_readys):
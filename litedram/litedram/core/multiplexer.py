@@ -7,14 +7,14 @@
 
 import math
 from functools import reduce
-from operator import or_, and_
+from operator import or_, and_, add
 
 from migen import *
 from migen.genlib.roundrobin import *
 from migen.genlib.coding import Decoder
 
 from litex.soc.interconnect import stream
-from litex.soc.interconnect.csr import AutoCSR
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRStatus
 
 from litedram.common import *
 from litedram.core.bandwidth import Bandwidth
@@ -143,6 +143,67 @@ class _Steerer(Module):
                 phase.wrdata_en.eq(wrdata_ens[sel])
             ]
 
+# _ReadWriteBatching -------------------------------------------------------------------------------
+
+class _ReadWriteBatching(Module, AutoCSR):
+    """Read/Write batching
+
+    Decides when the Multiplexer switches direction from the commands queued in the bank machines
+    instead of only from the commands presented to it: reads are served until writes reach the
+    high watermark (or no read can make progress), writes are then drained down to the low
+    watermark (or until no write can make progress). Watermarks are runtime-tunable, the direction
+    switches and the cycles spent in turnarounds are counted.
+    """
+    def __init__(self, bank_machines, write_watermarks, counter_bits=32):
+        queued_bits = bits_for(sum(2**len(bm.pending_writes) - 1 for bm in bank_machines))
+        self.write_low         = CSRStorage(queued_bits, reset=write_watermarks[0])
+        self.write_high        = CSRStorage(queued_bits, reset=write_watermarks[1])
+        self.switches          = CSRStatus(counter_bits)
+        self.turnaround_cycles = CSRStatus(counter_bits)
+
+        self.reading     = Signal() # Multiplexer is in READ state
+        self.writing     = Signal() # Multiplexer is in WRITE state
+        self.turnaround  = Signal() # Multiplexer is in a read/write turnaround
+        self.reads_done  = Signal() # Reads can be left for writes
+        self.writes_done = Signal() # Writes can be left for reads
+
+        # # #
+
+        queued_writes = Signal(queued_bits)
+        self.comb += queued_writes.eq(reduce(add, [bm.pending_writes for bm in bank_machines]))
+
+        # Reads/writes can make progress in a bank unless its next command is of the other direction
+        reads_waiting  = reduce(or_, [(bm.pending_reads  != 0) & ~(bm.cmd.valid & bm.cmd.is_write)
+            for bm in bank_machines])
+        writes_waiting = reduce(or_, [(bm.pending_writes != 0) & ~(bm.cmd.valid & bm.cmd.is_read)
+            for bm in bank_machines])
+        self.comb += [
+            self.reads_done.eq(~reads_waiting | (queued_writes >= self.write_high.storage)),
+            self.writes_done.eq(~writes_waiting | (queued_writes <= self.write_low.storage)),
+        ]
+
+        # Statistics -------------------------------------------------------------------------------
+        last_write = Signal()
+        switches   = Signal(counter_bits)
+        cycles     = Signal(counter_bits)
+        self.sync += [
+            If(self.reading,
+                last_write.eq(0)
+            ).Elif(self.writing,
+                last_write.eq(1)
+            ),
+            If((self.reading & last_write) | (self.writing & ~last_write),
+                switches.eq(switches + 1)
+            ),
+            If(self.turnaround,
+                cycles.eq(cycles + 1)
+            )
+        ]
+        self.comb += [
+            self.switches.status.eq(switches),
+            self.turnaround_cycles.status.eq(cycles)
+        ]
+
 # Multiplexe ---------------------------------------------------------------------------------------
 
 class Multiplexer(Module, AutoCSR):
@@ -211,6 +272,22 @@ class Multiplexer(Module, AutoCSR):
             write_available.eq(reduce(or_, writes))
         ]
 
+        # Read/write batching ----------------------------------------------------------------------
+        reads_done  = ~read_available
+        writes_done = ~write_available
+        if settings.with_rw_batching:
+            # Default high watermark is reached by a single writer filling the buffer of one bank
+            write_watermarks = settings.write_watermarks
+            if write_watermarks is None:
+                write_watermarks = (settings.cmd_buffer_depth//4, settings.cmd_buffer_depth)
+            # Each BankMachine queues at most cmd_buffer_depth + 1 commands
+            write_low, write_high = write_watermarks
+            assert 0 <= write_low < write_high <= len(bank_machines)*(settings.cmd_buffer_depth + 1)
+            self.submodules.batching = batching = _ReadWriteBatching(bank_machines,
+                write_watermarks = write_watermarks)
+            reads_done  = batching.reads_done
+            writes_done = batching.writes_done
+
         # Anti Starvation --------------------------------------------------------------------------
 
         def anti_starvation(timeout):
@@ -282,7 +359,7 @@ class Multiplexer(Module, AutoCSR):
             steerer_sel(steerer, "read"),
             If(write_available,
                 # TODO: switch only after several cycles of ~read_available?
-                If(~read_available | max_read_time,
+                If(reads_done | max_read_time,
                     NextState("RTW")
                 )
             ),
@@ -302,7 +379,7 @@ class Multiplexer(Module, AutoCSR):
             ),
             steerer_sel(steerer, "write"),
             If(read_available,
-                If(~write_available | max_write_time,
+                If(writes_done | max_write_time,
                     NextState("WTR")
                 )
             ),
@@ -325,6 +402,14 @@ class Multiplexer(Module, AutoCSR):
         # TODO: reduce this, actual limit is around (cl+1)/nphases
         fsm.delayed_enter("RTW", "WRITE", settings.phy.read_latency-1)
 
+        if settings.with_rw_batching:
+            self.comb += [
+                batching.reading.eq(fsm.ongoing("READ")),
+                batching.writing.eq(fsm.ongoing("WRITE")),
+                batching.turnaround.eq(~fsm.ongoing("READ") & ~fsm.ongoing("WRITE") &
+                    ~fsm.ongoing("REFRESH")),
+            ]
+
         if settings.with_bandwidth:
             data_width = settings.phy.dfi_databits*settings.phy.nphases
             self.submodules.bandwidth = Bandwidth(self.choose_req.cmd, data_width)
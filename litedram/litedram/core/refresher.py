@@ -214,12 +214,17 @@ class Refresher(Module):
     this allows the Controller to finish the current transaction and block next transactions. Once all
     transactions are done, the Refresher can execute the refresh Sequence and release the Controller.
 
+    By default, N (postponing) refreshes are executed every N tREFI. With pull_in, refreshes are
+    instead opportunistic: they are pulled in (up to pull_in refreshes ahead) while the Controller is
+    idle and postponed (up to postponing refreshes late) while it is busy.
     """
-    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1):
+    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1, pull_in=0):
         assert postponing <= 8
+        assert pull_in <= 8
         abits  = settings.geom.addressbits
         babits = settings.geom.bankbits + log2_int(settings.phy.nranks)
-        self.cmd = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        self.cmd  = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        self.idle = Signal() # Controller has no pending command (opportunistic refresh)
 
         # # #
 
@@ -231,16 +236,24 @@ class Refresher(Module):
         self.submodules.timer = timer
         self.comb += timer.wait.eq(~timer.done)
 
-        # Refresh Postponer ------------------------------------------------------------------------
-        postponer = RefreshPostponer(postponing)
-        self.submodules.postponer = postponer
-        self.comb += postponer.req_i.eq(self.timer.done)
-        self.comb += wants_refresh.eq(postponer.req_o)
-
         # Refresh Sequencer ------------------------------------------------------------------------
-        sequencer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC, postponing)
+        sequencer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC,
+            postponing = 1 if pull_in else postponing)
         self.submodules.sequencer = sequencer
 
+        if pull_in:
+            # Refresh Credit -----------------------------------------------------------------------
+            # Number of refreshes owed (> 0: postponed, < 0: pulled in)
+            owed = Signal(min=-pull_in, max=postponing + 2)
+            self.sync += owed.eq(owed + timer.done - sequencer.start)
+            self.comb += wants_refresh.eq((owed >= postponing) | (self.idle & (owed > -pull_in)))
+        else:
+            # Refresh Postponer --------------------------------------------------------------------
+            postponer = RefreshPostponer(postponing)
+            self.submodules.postponer = postponer
+            self.comb += postponer.req_i.eq(self.timer.done)
+            self.comb += wants_refresh.eq(postponer.req_o)
+
         if settings.timing.tZQCS is not None:
             # ZQCS Timer ---------------------------------------------------------------------------
             zqcs_timer = RefreshTimer(int(clk_freq/zqcs_freq))
@@ -11,10 +11,12 @@ Features:
 - Write/Read data buffers (configurable depth).
 - Burst support (FIXED/INCR/WRAP).
 - ID support (configurable width).
+- Multiple outstanding bursts (write data accepted independently of write addresses).
+- Optional ID interleaving over multiple Native ports with per-ID ordered responses.
 
 Limitations:
 - Response always okay.
-- No reordering.
+- No reordering within a Native port (only between ports).
 """
 
 from migen import *
@@ -51,9 +53,32 @@ class LiteDRAMAXI2NativeW(Module):
         self.submodules.aw_burst2beat = aw_burst2beat
 
         # Write Buffer -----------------------------------------------------------------------------
+        # Write data is accepted as soon as there is room for it, independently of the write
+        # addresses: masters are allowed to send write data ahead of (or behind) the addresses.
         w_buffer = stream.SyncFIFO(w_description(axi.data_width, axi.id_width),
             buffer_depth, buffered=True)
         self.submodules.w_buffer = w_buffer
+        self.comb += axi.w.connect(w_buffer.sink)
+
+        # Write Buffer availability ----------------------------------------------------------------
+        # - Incremented when data is queued
+        # - Decremented when a command consuming this data is sent to the controller
+        can_write        = Signal()
+        w_buffer_queue   = Signal()
+        w_buffer_dequeue = Signal()
+        w_buffer_level   = Signal(max=buffer_depth + 1)
+        self.comb += [
+            w_buffer_queue.eq(w_buffer.sink.valid & w_buffer.sink.ready),
+            w_buffer_dequeue.eq(port.cmd.valid & port.cmd.ready & port.cmd.we)
+        ]
+        self.sync += [
+            If(w_buffer_queue,
+                If(~w_buffer_dequeue, w_buffer_level.eq(w_buffer_level + 1))
+            ).Elif(w_buffer_dequeue,
+                w_buffer_level.eq(w_buffer_level - 1)
+            )
+        ]
+        self.comb += can_write.eq(w_buffer_level != 0)
 
         # Write ID Buffer & Response ---------------------------------------------------------------
         id_buffer   = stream.SyncFIFO([("id", axi.id_width)], buffer_depth)
@@ -74,21 +99,15 @@ class LiteDRAMAXI2NativeW(Module):
         ]
 
         # Command ----------------------------------------------------------------------------------
-        # Accept and send command to the controller only if:
-        # - Address & Data request are *both* valid.
-        # - Data buffer is not full.
+        # Send command to the controller only when its data is already buffered: the controller
+        # expects write data to be available when it requests it.
         self.comb += [
-            self.cmd_request.eq(aw.valid & axi.w.valid & w_buffer.sink.ready),
-            If(self.cmd_request & self.cmd_grant,
-                port.cmd.valid.eq(1),
+            self.cmd_request.eq(aw.valid & can_write),
+            If(self.cmd_grant,
+                port.cmd.valid.eq(aw.valid & can_write),
+                aw.ready.eq(port.cmd.ready & can_write),
                 port.cmd.we.eq(1),
-                port.cmd.addr.eq((aw.addr - base_address) >> ashift),
-                aw.ready.eq(port.cmd.ready),
-                axi.w.connect(w_buffer.sink, omit={"valid", "ready"}),
-                If(port.cmd.ready,
-                    w_buffer.sink.valid.eq(1),
-                    axi.w.ready.eq(1)
-                )
+                port.cmd.addr.eq((aw.addr - base_address) >> ashift)
             )
         ]
 
@@ -174,23 +193,116 @@ class LiteDRAMAXI2NativeR(Module):
             axi.r.resp.eq(RESP_OKAY)
         ]
 
+# LiteDRAMAXIInterleaver --------------------------------------------------------------------------
+
+class LiteDRAMAXIInterleaver(Module):
+    """Spread AXI transactions over AXI lanes by ID
+
+    Transactions are dispatched to lane ``id % len(lanes)``: transactions with the same ID always
+    use the same lane and complete in order, transactions with different IDs can use different
+    lanes and complete out of order. Write data follows its write address (AXI4 write data order)
+    and responses are merged back burst by burst, the lanes' buffers acting as reorder buffers.
+    """
+    def __init__(self, axi, lanes, buffer_depth=16):
+        nlanes    = len(lanes)
+        lane_bits = log2_int(nlanes)
+        assert axi.id_width >= lane_bits
+
+        # # #
+
+        # Read Address -----------------------------------------------------------------------------
+        ar_lane = Signal(lane_bits)
+        self.comb += ar_lane.eq(axi.ar.id)
+        for i, lane in enumerate(lanes):
+            self.comb += [
+                axi.ar.connect(lane.ar, omit={"valid", "ready"}),
+                lane.ar.valid.eq(axi.ar.valid & (ar_lane == i))
+            ]
+        self.comb += axi.ar.ready.eq(Array(lane.ar.ready for lane in lanes)[ar_lane])
+
+        # Write Address ----------------------------------------------------------------------------
+        # Lane of each accepted write burst, used to route the write data.
+        w_route = stream.SyncFIFO([("lane", lane_bits)], buffer_depth)
+        self.submodules += w_route
+        aw_lane = Signal(lane_bits)
+        self.comb += aw_lane.eq(axi.aw.id)
+        for i, lane in enumerate(lanes):
+            self.comb += [
+                axi.aw.connect(lane.aw, omit={"valid", "ready"}),
+                lane.aw.valid.eq(axi.aw.valid & w_route.sink.ready & (aw_lane == i))
+            ]
+        self.comb += [
+            axi.aw.ready.eq(Array(lane.aw.ready for lane in lanes)[aw_lane] & w_route.sink.ready),
+            w_route.sink.valid.eq(axi.aw.valid & axi.aw.ready),
+            w_route.sink.lane.eq(aw_lane)
+        ]
+
+        # Write Data -------------------------------------------------------------------------------
+        w_lane = w_route.source.lane
+        for i, lane in enumerate(lanes):
+            self.comb += [
+                axi.w.connect(lane.w, omit={"valid", "ready"}),
+                lane.w.valid.eq(axi.w.valid & w_route.source.valid & (w_lane == i))
+            ]
+        self.comb += [
+            axi.w.ready.eq(Array(lane.w.ready for lane in lanes)[w_lane] & w_route.source.valid),
+            w_route.source.ready.eq(axi.w.valid & axi.w.ready & axi.w.last)
+        ]
+
+        # Write Response ---------------------------------------------------------------------------
+        b_arbiter = RoundRobin(nlanes, SP_CE)
+        self.submodules += b_arbiter
+        self.comb += b_arbiter.ce.eq(~axi.b.valid | axi.b.ready)
+        for i, lane in enumerate(lanes):
+            self.comb += [
+                b_arbiter.request[i].eq(lane.b.valid),
+                If(b_arbiter.grant == i, lane.b.connect(axi.b))
+            ]
+
+        # Read Data --------------------------------------------------------------------------------
+        # Granted lane keeps the arbiter until the last beat of its burst is accepted: bursts are
+        # not interleaved.
+        r_idle    = Signal(reset=1)
+        r_arbiter = RoundRobin(nlanes, SP_CE)
+        self.submodules += r_arbiter
+        self.sync += If(axi.r.valid & axi.r.ready, r_idle.eq(axi.r.last))
+        self.comb += r_arbiter.ce.eq((r_idle & ~axi.r.valid) |
+                                     (axi.r.valid & axi.r.ready & axi.r.last))
+        for i, lane in enumerate(lanes):
+            self.comb += [
+                r_arbiter.request[i].eq(lane.r.valid),
+                If(r_arbiter.grant == i, lane.r.connect(axi.r))
+            ]
+
 # LiteDRAMAXI2Native -------------------------------------------------------------------------------
 
 class LiteDRAMAXI2Native(Module):
     def __init__(self, axi, port, w_buffer_depth=16, r_buffer_depth=16, base_address=0x00000000):
+        ports = port if isinstance(port, (list, tuple)) else [port]
 
         # # #
 
-        # Write path -------------------------------------------------------------------------------
-        self.submodules.write = LiteDRAMAXI2NativeW(axi, port, w_buffer_depth, base_address)
-
-        # Read path --------------------------------------------------------------------------------
-        self.submodules.read = LiteDRAMAXI2NativeR(axi, port, r_buffer_depth, base_address)
-
-        # Write / Read arbitration -----------------------------------------------------------------
-        arbiter = RoundRobin(2, SP_CE)
-        self.submodules += arbiter
-        self.comb += arbiter.ce.eq(~port.cmd.valid | port.cmd.ready)
-        for i, master in enumerate([self.write, self.read]):
-            self.comb += arbiter.request[i].eq(master.cmd_request)
-            self.comb += master.cmd_grant.eq(arbiter.grant == i)
+        # ID interleaving --------------------------------------------------------------------------
+        # With multiple Native ports, transactions are spread over the ports by ID so that different
+        # IDs can be serviced in parallel (and complete out of order) by the controller.
+        if len(ports) > 1:
+            lanes = [LiteDRAMAXIPort(axi.data_width, axi.address_width, axi.id_width) for _ in ports]
+            self.submodules.interleaver = LiteDRAMAXIInterleaver(axi, lanes,
+                buffer_depth=w_buffer_depth)
+        else:
+            lanes = [axi]
+
+        for lane, lane_port in zip(lanes, ports):
+            # Write path ---------------------------------------------------------------------------
+            write = LiteDRAMAXI2NativeW(lane, lane_port, w_buffer_depth, base_address)
+
+            # Read path ----------------------------------------------------------------------------
+            read = LiteDRAMAXI2NativeR(lane, lane_port, r_buffer_depth, base_address)
+
+            # Write / Read arbitration -------------------------------------------------------------
+            arbiter = RoundRobin(2, SP_CE)
+            self.submodules += write, read, arbiter
+            self.comb += arbiter.ce.eq(~lane_port.cmd.valid | lane_port.cmd.ready)
+            for i, master in enumerate([write, read]):
+                self.comb += arbiter.request[i].eq(master.cmd_request)
+                self.comb += master.cmd_grant.eq(arbiter.grant == i)
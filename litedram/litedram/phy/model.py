@@ -7,6 +7,10 @@
 # - add multirank support.
 
 from migen import *
+from migen.fhdl.specials import Special, SPECIAL_INPUT, SPECIAL_OUTPUT
+from migen.fhdl.verilog import _printexpr as verilog_printexpr
+
+from litex.soc.integration.common import mem_data_to_bytes, mem_data_from_bytes
 
 from litedram.common import burst_lengths
 from litedram.phy.dfi import *
@@ -15,17 +19,281 @@ from litedram.modules import _speedgrade_timings, _technology_timings
 from functools import reduce
 from operator import or_
 
-import struct
+import os
+import mmap
 
 
 SDRAM_VERBOSE_OFF = 0
 SDRAM_VERBOSE_STD = 1
 SDRAM_VERBOSE_DBG = 2
 
+# Sparse Memory ------------------------------------------------------------------------------------
+
+class SparseMemoryImage:
+    """Init image of SparseMemories: raw file (mmap-ed) or bytes-like data"""
+    def __init__(self, filename=None, data=None):
+        assert (filename is None) != (data is None)
+        self.filename = filename
+        self._data    = data
+
+    @property
+    def data(self):
+        if self._data is None:
+            with open(self.filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._data = b""
+                else:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def get_filename(self, name):
+        # C++ models read the image from a file: dump in-memory data (once) to the build directory
+        if self.filename is None:
+            self.filename = os.path.abspath(name + ".bin")
+            with open(self.filename, "wb") as f:
+                f.write(self._data)
+        return self.filename
+
+
+class SparseMemoryInit:
+    """Mapping of a SparseMemory on a SparseMemoryImage
+
+    Word `adr` of the memory is the little-endian image word
+    `n*stride + (offset ^ (n & xor_mask)*chunk) + adr%chunk` with `n = adr//chunk` (words of the
+    memory width), words outside of the image are 0. xor_mask permutes the chunks (bank hashing).
+    """
+    def __init__(self, image, offset=0, chunk=2**32, stride=2**32, xor_mask=0):
+        self.image    = image
+        self.offset   = offset
+        self.chunk    = chunk
+        self.stride   = stride
+        self.xor_mask = xor_mask
+
+    def word(self, adr, word_bytes):
+        n     = adr//self.chunk
+        start = (n*self.stride + (self.offset ^ (n & self.xor_mask)*self.chunk) + adr%self.chunk)*word_bytes
+        return int.from_bytes(self.image.data[start:start + word_bytes], "little")
+
+
+_sparse_memory_cpp = """\
+// Sparse memory model of {name}: pages are allocated on first write.
+#include <stdint.h>
+#include <stdio.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unordered_map>
+#include <vector>
+#include "svdpi.h"
+
+namespace {{
+
+const uint64_t word_bytes = {word_bytes};
+const uint64_t page_words = {page_words};
+
+class SparseMemory {{
+public:
+    SparseMemory(const char *filename, uint64_t offset, uint64_t chunk, uint64_t stride, uint64_t xor_mask)
+        : image(NULL), image_size(0), offset(offset), chunk(chunk), stride(stride), xor_mask(xor_mask) {{
+        struct stat st;
+        int fd;
+        if (filename == NULL)
+            return;
+        fd = open(filename, O_RDONLY);
+        if ((fd < 0) || (fstat(fd, &st) < 0)) {{
+            fprintf(stderr, "[{name}] can't open init file %s\\n", filename);
+            return;
+        }}
+        if (st.st_size > 0) {{
+            image = (const uint8_t *) mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+            if (image == MAP_FAILED)
+                image = NULL;
+            else
+                image_size = st.st_size;
+        }}
+        close(fd);
+    }}
+
+    // returns the word, allocating its page if required
+    uint8_t *word(uint64_t adr) {{
+        uint64_t page = adr / page_words;
+        auto it = pages.find(page);
+        if (it == pages.end()) {{
+            std::vector<uint8_t> data(page_words*word_bytes);
+            for (uint64_t i = 0; i < page_words; i++)
+                init_word(page*page_words + i, &data[i*word_bytes]);
+            it = pages.emplace(page, std::move(data)).first;
+        }}
+        return &it->second[(adr % page_words)*word_bytes];
+    }}
+
+    // reads the word without allocating a page
+    void read(uint64_t adr, uint8_t *dst) {{
+        auto it = pages.find(adr / page_words);
+        if (it == pages.end()) {{
+            init_word(adr, dst);
+        }} else {{
+            const uint8_t *src = &it->second[(adr % page_words)*word_bytes];
+            for (uint64_t i = 0; i < word_bytes; i++)
+                dst[i] = src[i];
+        }}
+    }}
+
+private:
+    void init_word(uint64_t adr, uint8_t *dst) {{
+        uint64_t n     = adr/chunk;
+        uint64_t start = (n*stride + (offset ^ (n & xor_mask)*chunk) + adr%chunk)*word_bytes;
+        for (uint64_t i = 0; i < word_bytes; i++)
+            dst[i] = (start + i < image_size) ? image[start + i] : 0;
+    }}
+
+    std::unordered_map<uint64_t, std::vector<uint8_t>> pages;
+    const uint8_t *image;
+    uint64_t image_size;
+    uint64_t offset;
+    uint64_t chunk;
+    uint64_t stride;
+    uint64_t xor_mask;
+}};
+
+SparseMemory memory({filename}, {offset}ULL, {chunk}ULL, {stride}ULL, {xor_mask}ULL);
+
+}}
+
+extern "C" void {name}_write(unsigned int adr, const svBitVecVal *dat, const svBitVecVal *we)
+{{
+    uint8_t *word = memory.word(adr);
+    for (uint64_t i = 0; i < word_bytes; i++)
+        if ((we[i/32] >> (i%32)) & 1)
+            word[i] = (dat[i/4] >> (8*(i%4))) & 0xff;
+}}
+
+extern "C" void {name}_read(unsigned int adr, svBitVecVal *dat)
+{{
+    uint8_t word[word_bytes];
+    memory.read(adr, word);
+    for (uint64_t i = 0; i < (word_bytes + 3)/4; i++)
+        dat[i] = 0;
+    for (uint64_t i = 0; i < word_bytes; i++)
+        dat[i/4] |= ((svBitVecVal) word[i]) << (8*(i%4));
+}}
+"""
+
+
+class SparseMemory(Special):
+    """Sparse memory with lazily allocated pages
+
+    Replaces a Memory for very large simulation models: only the pages that are written are
+    allocated, the others are read from the (lazily loaded) init image. Write (with byte enables)
+    and read are synchronous: dat_r is updated on the clock edge following re.
+
+    In the LiteX simulator (litex.gen.sim.run_simulation) it is simulated natively (dict of
+    pages), in Verilog it is a C++ model called through DPI-C, generated as a data file of the
+    design. The Migen simulator (migen.sim) can't simulate it and fails with "Could not lower all
+    specials": designs using it (e.g. SDRAMPHYModel with backend="sparse") have to be simulated
+    with litex.gen.sim.
+    """
+    def __init__(self, width, depth, init=None, clock_domain="sys", page_words=256):
+        Special.__init__(self)
+        assert width%8 == 0
+        self.width      = width
+        self.depth      = depth
+        self.init       = init
+        self.page_words = page_words
+        self.clock      = ClockSignal(clock_domain)
+
+        self.we     = Signal(width//8)
+        self.wr_adr = Signal(max=depth)
+        self.dat_w  = Signal(width)
+        self.re     = Signal()
+        self.rd_adr = Signal(max=depth)
+        self.dat_r  = Signal(width)
+
+    def iter_expressions(self):
+        for attr, target_context in [
+          ("clock",  SPECIAL_INPUT),
+          ("we",     SPECIAL_INPUT),
+          ("wr_adr", SPECIAL_INPUT),
+          ("dat_w",  SPECIAL_INPUT),
+          ("re",     SPECIAL_INPUT),
+          ("rd_adr", SPECIAL_INPUT),
+          ("dat_r",  SPECIAL_OUTPUT)]:
+            yield self, attr, target_context
+
+    def init_word(self, adr):
+        if self.init is None:
+            return 0
+        return self.init.word(adr, self.width//8)
+
+    def sim_generator(self):
+        pages      = {}
+        page_words = self.page_words
+        byte_masks = [0xff << 8*i for i in range(self.width//8)]
+        yield "passive"
+        while True:
+            we, re = yield [self.we, self.re]
+            if we:
+                adr, dat = yield [self.wr_adr, self.dat_w]
+                page_adr, offset = divmod(adr, page_words)
+                page = pages.get(page_adr)
+                if page is None:
+                    page = [self.init_word(page_adr*page_words + i) for i in range(page_words)]
+                    pages[page_adr] = page
+                mask = 0
+                for i, byte_mask in enumerate(byte_masks):
+                    if (we >> i) & 1:
+                        mask |= byte_mask
+                page[offset] = (page[offset] & ~mask) | (dat & mask)
+            if re:
+                adr = yield self.rd_adr
+                page_adr, offset = divmod(adr, page_words)
+                page = pages.get(page_adr)
+                yield self.dat_r.eq(self.init_word(adr) if page is None else page[offset])
+            yield
+
+    @staticmethod
+    def emit_verilog(memory, ns, add_data_file):
+        def gn(e):
+            return verilog_printexpr(ns, e)[0]
+
+        name     = ns.get_name(memory.dat_r)
+        filename = "NULL"
+        offset, chunk, stride, xor_mask = 0, 2**32, 2**32, 0
+        if memory.init is not None:
+            filename = "\"{}\"".format(memory.init.image.get_filename(name + "_init"))
+            offset   = memory.init.offset
+            chunk    = memory.init.chunk
+            stride   = memory.init.stride
+            xor_mask = memory.init.xor_mask
+        add_data_file(name + ".cpp", _sparse_memory_cpp.format(
+            name       = name,
+            word_bytes = memory.width//8,
+            page_words = memory.page_words,
+            filename   = filename,
+            offset     = offset,
+            chunk      = chunk,
+            stride     = stride,
+            xor_mask   = xor_mask))
+
+        r  = "import \"DPI-C\" function void {}_write(input int unsigned adr, ".format(name)
+        r += "input bit [{}:0] dat, input bit [{}:0] we);\n".format(memory.width - 1, memory.width//8 - 1)
+        r += "import \"DPI-C\" function void {}_read(input int unsigned adr, ".format(name)
+        r += "output bit [{}:0] dat);\n".format(memory.width - 1)
+        r += "reg [{}:0] {}_reg;\n".format(memory.width - 1, name)
+        r += "always @(posedge {}) begin\n".format(gn(memory.clock))
+        r += "\tif ({} != 0)\n".format(gn(memory.we))
+        r += "\t\t{}_write({}, {}, {});\n".format(name, gn(memory.wr_adr), gn(memory.dat_w), gn(memory.we))
+        r += "\tif ({})\n".format(gn(memory.re))
+        r += "\t\t{}_read({}, {}_reg);\n".format(name, gn(memory.rd_adr), name)
+        r += "end\n"
+        r += "assign {} = {}_reg;\n\n".format(name, name)
+        return r
+
 # Bank Model ---------------------------------------------------------------------------------------
 
 class BankModel(Module):
-    def __init__(self, data_width, nrows, ncols, burst_length, nphases, we_granularity, init):
+    def __init__(self, data_width, nrows, ncols, burst_length, nphases, we_granularity, init, sparse=False):
         self.activate     = Signal()
         self.activate_row = Signal(max=nrows)
         self.precharge    = Signal()
@@ -53,11 +321,6 @@ class BankModel(Module):
             )
 
         bank_mem_len   = nrows*ncols//(burst_length*nphases)
-        mem            = Memory(data_width, bank_mem_len, init=init)
-        write_port     = mem.get_port(write_capable=True, we_granularity=we_granularity)
-        read_port      = mem.get_port(async_read=True)
-        self.specials += mem, read_port, write_port
-
         wraddr         = Signal(max=bank_mem_len)
         rdaddr         = Signal(max=bank_mem_len)
 
@@ -66,6 +329,35 @@ class BankModel(Module):
             rdaddr.eq((row*ncols | self.read_col)[log2_int(burst_length*nphases):]),
         ]
 
+        if sparse:
+            # init is a SparseMemoryInit, read_data is available one cycle after read
+            mem = SparseMemory(data_width, bank_mem_len, init=init)
+            self.specials += mem
+            read = Signal()
+            self.sync += read.eq(active & self.read)
+            self.comb += [
+                If(active,
+                    mem.wr_adr.eq(wraddr),
+                    mem.dat_w.eq(self.write_data),
+                    If(we_granularity,
+                        mem.we.eq(Replicate(self.write, data_width//8) & ~self.write_mask),
+                    ).Else(
+                        mem.we.eq(Replicate(self.write, data_width//8)),
+                    ),
+                    mem.re.eq(self.read),
+                    mem.rd_adr.eq(rdaddr),
+                ),
+                If(read,
+                    self.read_data.eq(mem.dat_r)
+                )
+            ]
+            return
+
+        mem            = Memory(data_width, bank_mem_len, init=init)
+        write_port     = mem.get_port(write_capable=True, we_granularity=we_granularity)
+        read_port      = mem.get_port(async_read=True)
+        self.specials += mem, read_port, write_port
+
         self.comb += [
             If(active,
                 write_port.adr.eq(wraddr),
@@ -153,6 +445,7 @@ class DFITimingsChecker(Module):
         # tRFC
         ("REF",  "PRE", "tRFC"),
         ("REF",  "ACT", "tRFC"),
+        ("REF",  "REF", "tRFC"),
         # tCCD
         ("WR",   "RD",  "tCCD"),
         ("WR",   "WR",  "tCCD"),
@@ -328,75 +621,98 @@ class DFITimingsChecker(Module):
             self.sync += If((curr_diff > 0) & ref_done & (ref_issued == 0),
                 Display("[%016dps] tREFI violation", ps), ref_done.eq(0))
 
-        # There is a maximum delay between refreshes on >=DDR
+        # There is a maximum number of postponed/pulled-in refreshes on >=DDR
         if memtype != "SDR":
             refresh_mode = "1x" if refresh_mode is None else refresh_mode
-            ref_done = Signal()
+            ref_limit_ps = ref_limit[refresh_mode] * self.timings['tREFI']
+            ref_done     = Signal()
+            # Refreshes issued (in tREFI) minus elapsed time since the first refresh
+            ref_credit   = Signal(min=-2**63, max=2**63)
             self.sync += If(ref_issued != 0, ref_done.eq(1))
-            self.sync += If((ref_issued == 0) & ref_done & (ref_ps > (ps + ref_limit[refresh_mode] * self.timings['tREFI'])),
-                Display("[%016dps] tREFI violation (too many postponed refreshes)", ps), ref_done.eq(0))
+            self.sync += If(ref_done | (ref_issued != 0),
+                ref_credit.eq(ref_credit - nphases * self.timings["tCK"] +
+                    Mux(ref_issued != 0, self.timings["tREFI"], 0)))
+            self.sync += If(ref_done & (ref_credit < -ref_limit_ps),
+                Display("[%016dps] tREFI violation (too many postponed refreshes)", ps),
+                ref_credit.eq(0))
+            self.sync += If(ref_done & (ref_credit > ref_limit_ps),
+                Display("[%016dps] tREFI violation (too many pulled-in refreshes)", ps),
+                ref_credit.eq(0))
 
 # SDRAM PHY Model ----------------------------------------------------------------------------------
 
 class SDRAMPHYModel(Module):
-    def __prepare_bank_init_data(self, init, nbanks, nrows, ncols, data_width, address_mapping):
-        mem_size          = (self.settings.databits//8)*(nrows*ncols*nbanks)
-        bank_size         = mem_size // nbanks
-        column_size       = bank_size // nrows
-        model_bank_size   = bank_size // (data_width//8)
-        model_column_size = model_bank_size // nrows
-        model_data_ratio  = data_width // 32
-        data_width_bytes  = data_width // 8
-        bank_init         = [[] for i in range(nbanks)]
-
-        # Pad init if too short
-        if len(init)%data_width_bytes != 0:
-            init.extend([0]*(data_width_bytes-len(init)%data_width_bytes))
-
-
-        # Convert init data width from 32-bit to data_width if needed
-        if model_data_ratio > 1:
-            new_init = [0]*(len(init)//model_data_ratio)
-            for i in range(0, len(init), model_data_ratio):
-                ints = init[i:i+model_data_ratio]
-                strs = "".join("{:08x}".format(x) for x in reversed(ints))
-                new_init[i//model_data_ratio] = int(strs, 16)
-            init = new_init
-        elif model_data_ratio == 0:
-            assert data_width_bytes in [1, 2]
-            model_data_ratio = 4 // data_width_bytes
-            struct_unpack_patterns = {1: "4B", 2: "2H"}
-            new_init = [0]*int(len(init)*model_data_ratio)
-            for i in range(len(init)):
-                new_init[model_data_ratio*i:model_data_ratio*(i+1)] = struct.unpack(
-                    struct_unpack_patterns[data_width_bytes],
-                    struct.pack("I", init[i])
-                )[0:model_data_ratio]
-            init = new_init
-
+    def __bank_mappings(self, nbanks, nrows, ncols, data_width, address_mapping):
+        # Position of each bank in the memory image, as SparseMemoryInit parameters
+        # (offset, chunk, stride, xor_mask) in words of data_width.
+        bank_words = (self.settings.databits//8)*nrows*ncols // (data_width//8)
+        row_words  = bank_words // nrows
         if address_mapping == "ROW_BANK_COL":
-            for row in range(nrows):
-                for bank in range(nbanks):
-                    start = (row*nbanks*model_column_size + bank*model_column_size)
-                    end   = min(start + model_column_size, len(init))
-                    if start > len(init):
-                        break
-                    bank_init[bank].extend(init[start:end])
+            return [(bank*row_words, row_words, nbanks*row_words, 0) for bank in range(nbanks)]
+        elif address_mapping == "ROW_BANK_COL_XOR":
+            # Bank is xored with the low bits of the row
+            return [(bank*row_words, row_words, nbanks*row_words, nbanks - 1) for bank in range(nbanks)]
+        elif address_mapping == "ROW_COL_BANK":
+            return [(bank, 1, nbanks, 0) for bank in range(nbanks)]
         elif address_mapping == "BANK_ROW_COL":
-            for bank in range(nbanks):
-                start = bank*model_bank_size
-                end   = min(start + model_bank_size, len(init))
-                if start > len(init):
-                    break
-                bank_init[bank] = init[start:end]
+            return [(bank*bank_words, bank_words, nbanks*bank_words, 0) for bank in range(nbanks)]
+        else:
+            raise ValueError(address_mapping)
 
-        return bank_init
+    def __prepare_bank_init_data(self, init, nbanks, nrows, ncols, data_width, address_mapping):
+        mem_size         = (self.settings.databits//8)*(nrows*ncols*nbanks)
+        data_width_bytes = data_width // 8
+
+        # Interleave/convert as bytes: (32-bit words) -> bytes -> bank bytes -> (data_width words)
+        init = mem_data_to_bytes(init)[:mem_size]
+        init += bytes(-len(init) % data_width_bytes)
+
+        bank_data = []
+        bank_size = mem_size // nbanks
+        mappings  = self.__bank_mappings(nbanks, nrows, ncols, data_width, address_mapping)
+        for offset, chunk, stride, xor_mask in mappings:
+            offset, chunk, stride = [v*data_width_bytes for v in (offset, chunk, stride)]
+            nchunks = min(bank_size//chunk, -(-len(init)//stride))
+            if xor_mask == 0 and chunk < nchunks:
+                # Many small chunks: copy them as byte lanes with extended slices
+                data = bytearray(nchunks*chunk)
+                for i in range(chunk):
+                    lane = init[offset + i::stride][:nchunks]
+                    data[i:i + chunk*len(lane):chunk] = lane
+            else:
+                data = b"".join(init[start:start + chunk].ljust(chunk, b"\0")
+                    for start in (n*stride + (offset ^ (n & xor_mask)*chunk) for n in range(nchunks)))
+            bank_data.append(bytes(data))
+
+        return [mem_data_from_bytes(data, data_width) for data in bank_data]
+
+    def __prepare_sparse_bank_init(self, init, init_file, nbanks, nrows, ncols, data_width, address_mapping):
+        # Banks share the image, only their mapping on it differs (no copy)
+        if init_file is not None:
+            image = SparseMemoryImage(filename=init_file)
+        else:
+            image = SparseMemoryImage(data=mem_data_to_bytes(init))
+        mappings = self.__bank_mappings(nbanks, nrows, ncols, data_width, address_mapping)
+        return [SparseMemoryInit(image, offset, chunk, stride, xor_mask)
+            for offset, chunk, stride, xor_mask in mappings]
 
     def __init__(self, module, settings, clk_freq=100e6,
         we_granularity         = 8,
         init                   = [],
+        init_file              = None,
         address_mapping        = "ROW_BANK_COL",
+        backend                = "memory",
         verbosity              = SDRAM_VERBOSE_OFF):
+        """SDRAM PHY Model
+
+        backend selects the storage of the banks: "memory" (Migen Memory, full-size) or "sparse"
+        (SparseMemory, pages allocated on write, init image loaded lazily, only simulated by
+        litex.gen.sim), required for large modules. init is a list of 32-bit words, the sparse backend also accepts a raw
+        (little-endian) init_file which is mmap-ed instead of being loaded. address_mapping gives
+        the layout of the init data in the banks and must match the controller's address_mapping.
+        """
+        assert backend in ["memory", "sparse"]
+        assert init_file is None or backend == "sparse"
 
         # Parameters -------------------------------------------------------------------------------
         burst_length = {
@@ -457,7 +773,19 @@ class SDRAMPHYModel(Module):
         # Bank init data ---------------------------------------------------------------------------
         bank_init  = [[] for i in range(nbanks)]
 
-        if init:
+        if backend == "sparse":
+            bank_init = [None for i in range(nbanks)]
+            if init or init_file is not None:
+                bank_init = self.__prepare_sparse_bank_init(
+                    init            = init,
+                    init_file       = init_file,
+                    nbanks          = nbanks,
+                    nrows           = nrows,
+                    ncols           = ncols,
+                    data_width      = data_width,
+                    address_mapping = address_mapping
+                )
+        elif init:
             bank_init = self.__prepare_bank_init_data(
                 init            = init,
                 nbanks          = nbanks,
@@ -475,7 +803,8 @@ class SDRAMPHYModel(Module):
             burst_length   = burst_length,
             nphases        = nphases,
             we_granularity = we_granularity,
-            init           = bank_init[i]) for i in range(nbanks)]
+            init           = bank_init[i],
+            sparse         = backend == "sparse") for i in range(nbanks)]
         self.submodules += banks
 
         # Connect DFI phases to Banks (CMDs, Write datapath) ---------------------------------------
@@ -554,13 +883,17 @@ class SDRAMPHYModel(Module):
         ]
 
         # Simulate read latency --------------------------------------------------------------------
+        # (sparse banks already provide the read data one cycle after the read)
+        if backend == "sparse":
+            assert self.settings.read_latency >= 1
         for i in range(self.settings.read_latency):
             new_banks_read      = Signal()
             new_banks_read_data = Signal(data_width)
-            self.sync += [
-                new_banks_read.eq(banks_read),
-                new_banks_read_data.eq(banks_read_data)
-            ]
+            self.sync += new_banks_read.eq(banks_read)
+            if i == 0 and backend == "sparse":
+                self.comb += new_banks_read_data.eq(banks_read_data)
+            else:
+                self.sync += new_banks_read_data.eq(banks_read_data)
             banks_read      = new_banks_read
             banks_read_data = new_banks_read_data
 
@@ -11,7 +11,10 @@ from functools import reduce
 from itertools import zip_longest
 
 from migen import *
+from migen.fhdl.structure import wrap
+from migen.fhdl.specials import Special, SPECIAL_OUTPUT
 from migen.genlib.misc import WaitTimer
+from migen.genlib.fifo import SyncFIFO
 
 from litex.build.sim.config import SimConfig
 
@@ -21,12 +24,143 @@ from litex.soc.integration.builder import *
 
 from litex.tools.litex_sim import SimSoC
 
+from litedram.core.bandwidth import BandwidthCounters
+from litedram.core.controller import ControllerSettings
 from litedram.frontend.bist import _LiteDRAMBISTGenerator, _LiteDRAMBISTChecker, \
     _LiteDRAMPatternGenerator, _LiteDRAMPatternChecker
 
+# Simulation Run-Time Arguments --------------------------------------------------------------------
+
+class SimPlusArg(Special):
+    """Drive a signal from a simulator `+name=value` plusarg
+
+    Lets a single compiled Verilator binary be reused with different run-time parameters: the
+    value is read with `$value$plusargs` at initialization, `default` is used when the plusarg
+    is not given on the command line.
+    """
+    def __init__(self, target, name, default=0):
+        Special.__init__(self)
+        self.target  = wrap(target)
+        self.name    = name
+        self.default = int(default)
+
+    def iter_expressions(self):
+        yield self, "target", SPECIAL_OUTPUT
+
+    @staticmethod
+    def emit_verilog(plusarg, ns, add_data_file):
+        target = ns.get_name(plusarg.target)
+        reg    = target + "_plusarg"
+        r  = "reg [{}:0] {} = {};\n".format(len(plusarg.target) - 1, reg, plusarg.default)
+        r += "initial begin\n"
+        r += "\tif (!$value$plusargs(\"{}=%d\", {}))\n".format(plusarg.name, reg)
+        r += "\t\t{} = {};\n".format(reg, plusarg.default)
+        r += "end\n"
+        r += "assign {} = {};\n\n".format(target, reg)
+        return r
+
+
+def bist_plusargs(bist_base=0x0000000, bist_length=1024, bist_random=False, bist_alternating=False):
+    """Run-time parameters of LiteDRAMBenchmarkSoC as simulator plusargs"""
+    assert not (bist_random and not bist_alternating), \
+        'Write to random address may overwrite previously written data before reading!'
+    return [
+        "+bist_base=%d"        % bist_base,
+        "+bist_length=%d"      % bist_length,
+        "+bist_random=%d"      % bist_random,
+        "+bist_alternating=%d" % bist_alternating,
+    ]
+
+
+def check_pattern_init(pattern_init, bist_alternating):
+    if not bist_alternating:
+        address_set = set()
+        for addr, _ in pattern_init:
+            assert addr not in address_set, \
+                'Duplicate address 0x%08x in pattern_init, write will overwrite previous value!' % addr
+            address_set.add(addr)
+
+# Statistics ---------------------------------------------------------------------------------------
+
+class _PortLatency(Module):
+    """Read/write latency histograms of a LiteDRAM native port
+
+    Latency is measured in sys_clk cycles from the command acceptance to the data transfer (wdata
+    for writes, rdata for reads). Bin i counts latencies in [2**i, 2**(i+1)), bin 0 also counts
+    null latencies and the last bin all the latencies above.
+    """
+    def __init__(self, port, nbins=16, fifo_depth=64):
+        self.read_histogram  = [Signal(32) for _ in range(nbins)]
+        self.write_histogram = [Signal(32) for _ in range(nbins)]
+
+        # # #
+
+        timestamp = Signal(32)
+        self.sync += timestamp.eq(timestamp + 1)
+
+        # commands are answered in order, so timestamps of pending commands are kept in fifos
+        for we, histogram, data in [(0, self.read_histogram,  port.rdata),
+                                    (1, self.write_histogram, port.wdata)]:
+            fifo = SyncFIFO(len(timestamp), fifo_depth)
+            self.submodules += fifo
+            self.comb += [
+                fifo.we.eq(port.cmd.valid & port.cmd.ready & (port.cmd.we == we)),
+                fifo.din.eq(timestamp),
+                fifo.re.eq(data.valid & data.ready),
+            ]
+
+            latency = Signal(32)
+            index   = Signal(max=nbins)
+            self.comb += latency.eq(timestamp - fifo.dout)
+            for i in range(1, nbins):
+                self.comb += If(latency >= 2**i, index.eq(i))
+            self.sync += If(fifo.re & fifo.readable,
+                Array(histogram)[index].eq(Array(histogram)[index] + 1)
+            )
+
+
+class _BankStatistics(Module):
+    """Command counters of a BankMachine
+
+    Row hits/misses/conflicts are derived from the counters: every row close (explicit precharge
+    or access with auto-precharge, A10 set) is a row conflict, the other activates are row misses
+    and the accesses not preceded by an activate are row hits.
+    """
+    def __init__(self, cmd):
+        self.enable          = Signal(reset=1)
+        self.accesses        = Signal(32)
+        self.activates       = Signal(32)
+        self.precharges      = Signal(32)
+        self.auto_precharges = Signal(32)
+
+        # # #
+
+        issued = Signal()
+        self.comb += issued.eq(self.enable & cmd.valid & cmd.ready)
+        self.sync += [
+            If(issued & cmd.cas,
+                self.accesses.eq(self.accesses + 1)
+            ),
+            If(issued & cmd.is_cmd & cmd.ras & ~cmd.we,
+                self.activates.eq(self.activates + 1)
+            ),
+            If(issued & cmd.is_cmd & cmd.ras & cmd.we,
+                self.precharges.eq(self.precharges + 1)
+            ),
+            If(issued & cmd.cas & cmd.a[10],
+                self.auto_precharges.eq(self.auto_precharges + 1)
+            ),
+        ]
+
 # LiteDRAM Benchmark SoC ---------------------------------------------------------------------------
 
 class LiteDRAMBenchmarkSoC(SimSoC):
+    """LiteDRAM Benchmark SoC
+
+    SDRAM module/data width, controller reordering, read/write batching and address mapping, number
+    of generators/checkers and custom access pattern are compile-time parameters. bist_base, bist_length, bist_random and bist_alternating only set
+    the defaults of run-time parameters that can be overridden with plusargs (see bist_plusargs).
+    """
     def __init__(self,
         sdram_module     = "MT48LC16M16",
         sdram_data_width = 32,
@@ -38,56 +172,75 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         num_generators   = 1,
         num_checkers     = 1,
         pattern_init     = None,
+        with_reordering  = False,
+        with_rw_batching = False,
+        address_mapping  = "ROW_BANK_COL",
         **kwargs):
 
         # SimSoC -----------------------------------------------------------------------------------
         SimSoC.__init__(self,
-            with_sdram       = True,
-            sdram_module     = sdram_module,
-            sdram_data_width = sdram_data_width,
+            with_sdram          = True,
+            sdram_module        = sdram_module,
+            sdram_data_width    = sdram_data_width,
+            sdram_ctrl_settings = ControllerSettings(
+                with_reordering  = with_reordering,
+                with_rw_batching = with_rw_batching,
+                address_mapping  = address_mapping),
             **kwargs
         )
 
-        # BIST Generator / Checker -----------------------------------------------------------------
+        # Run-Time Parameters ----------------------------------------------------------------------
+        bist_plusargs(bist_base, bist_length, bist_random, bist_alternating)  # check defaults
+        base        = Signal(32)
+        length      = Signal(32)
+        random      = Signal()
+        alternating = Signal()
+        self.specials += [
+            SimPlusArg(base,        "bist_base",        bist_base),
+            SimPlusArg(length,      "bist_length",      bist_length),
+            SimPlusArg(random,      "bist_random",      bist_random),
+            SimPlusArg(alternating, "bist_alternating", bist_alternating),
+        ]
 
         # make sure that we perform at least one access
-        bist_length = max(bist_length, self.sdram.controller.interface.data_width // 8)
+        min_length  = self.sdram.controller.interface.data_width // 8
+        bist_length = Signal(32)
+        self.comb += If(length < min_length,
+            bist_length.eq(min_length)
+        ).Else(
+            bist_length.eq(length)
+        )
 
+        # BIST Generator / Checker -----------------------------------------------------------------
         custom_pattern_mode = pattern_init is not None
 
         if custom_pattern_mode:
-            make_generator = lambda: _LiteDRAMPatternGenerator(self.sdram.crossbar.get_port(), init=pattern_init)
-            make_checker   = lambda: _LiteDRAMPatternChecker(self.sdram.crossbar.get_port(), init=pattern_init)
+            make_generator = lambda port: _LiteDRAMPatternGenerator(port, init=pattern_init)
+            make_checker   = lambda port: _LiteDRAMPatternChecker(port, init=pattern_init)
         else:
-            make_generator = lambda: _LiteDRAMBISTGenerator(self.sdram.crossbar.get_port())
-            make_checker   = lambda: _LiteDRAMBISTChecker(self.sdram.crossbar.get_port())
+            make_generator = lambda port: _LiteDRAMBISTGenerator(port)
+            make_checker   = lambda port: _LiteDRAMBISTChecker(port)
 
-        generators = [make_generator() for _ in range(num_generators)]
-        checkers = [make_checker() for _ in range(num_checkers)]
+        generator_ports = [self.sdram.crossbar.get_port() for _ in range(num_generators)]
+        checker_ports   = [self.sdram.crossbar.get_port() for _ in range(num_checkers)]
+        generators = [make_generator(port) for port in generator_ports]
+        checkers = [make_checker(port) for port in checker_ports]
         self.submodules += generators + checkers
 
         if custom_pattern_mode:
             def bist_config(module):
                 return []
 
-            if not bist_alternating:
-                address_set = set()
-                for addr, _ in pattern_init:
-                    assert addr not in address_set, \
-                        'Duplicate address 0x%08x in pattern_init, write will overwrite previous value!' % addr
-                    address_set.add(addr)
+            check_pattern_init(pattern_init, bist_alternating)
         else:
             def bist_config(module):
                 return [
-                    module.base.eq(bist_base),
+                    module.base.eq(base),
                     module.end.eq(bist_end),
                     module.length.eq(bist_length),
-                    module.random_addr.eq(bist_random),
+                    module.random_addr.eq(random),
                 ]
 
-            assert not (bist_random and not bist_alternating), \
-                'Write to random address may overwrite previously written data before reading!'
-
             # check address correctness
             assert bist_end > bist_base
             assert bist_end <= 2**(len(generators[0].end)) - 1, 'End address outside of range'
@@ -95,16 +248,14 @@ class LiteDRAMBenchmarkSoC(SimSoC):
             assert bist_addr_range > 0 and bist_addr_range & (bist_addr_range - 1) == 0, \
                 'Length of the address range must be a power of 2'
 
+        for module in generators + checkers:
+            self.comb += bist_config(module)
+
         def combined_read(modules, signal, operator):
             sig = Signal()
             self.comb += sig.eq(reduce(operator, (getattr(m, signal) for m in modules)))
             return sig
 
-        def combined_write(modules, signal):
-            sig = Signal()
-            self.comb += [getattr(m, signal).eq(sig) for m in modules]
-            return sig
-
         # Sequencer --------------------------------------------------------------------------------
         class LiteDRAMCoreControl(Module, AutoCSR):
             def __init__(self):
@@ -121,40 +272,54 @@ class LiteDRAMBenchmarkSoC(SimSoC):
                 NextState("BIST-GENERATOR")
             )
         )
-        if bist_alternating:
-            # force generators to wait for checkers and vice versa
-            # connect them in pairs, with each unpaired connected to the first of the others
-            bist_connections = []
-            for generator, checker in zip_longest(generators, checkers):
-                g = generator or generators[0]
-                c = checker or checkers[0]
-                bist_connections += g.run.eq(c.ready), c.run.eq(g.ready)
-
-            fsm.act("BIST-GENERATOR",
-                combined_write(generators + checkers, 'start').eq(1),
-                *bist_connections,
-                *map(bist_config, generators + checkers),
-                If(combined_read(checkers, 'done', and_),
+
+        # in alternating mode force generators to wait for checkers and vice versa:
+        # connect them in pairs, with each unpaired connected to the first of the others
+        alternating_run = {}
+        for generator, checker in zip_longest(generators, checkers):
+            g = generator or generators[0]
+            c = checker or checkers[0]
+            alternating_run[g] = c.ready
+            alternating_run[c] = g.ready
+
+        generators_start = Signal()
+        generators_run   = Signal()
+        checkers_start   = Signal()
+        checkers_run     = Signal()
+        for generator in generators:
+            self.comb += [
+                generator.start.eq(generators_start),
+                generator.run.eq(Mux(alternating, alternating_run[generator], generators_run)),
+            ]
+        for checker in checkers:
+            self.comb += [
+                checker.start.eq(checkers_start),
+                checker.run.eq(Mux(alternating, alternating_run[checker], checkers_run)),
+            ]
+        generators_done = combined_read(generators, 'done', and_)
+        checkers_done   = combined_read(checkers, 'done', and_)
+
+        fsm.act("BIST-GENERATOR",
+            generators_start.eq(1),
+            generators_run.eq(1),
+            If(alternating,
+                checkers_start.eq(1),
+                If(checkers_done,
                     NextState("DISPLAY")
                 )
-            )
-        else:
-            fsm.act("BIST-GENERATOR",
-                combined_write(generators, 'start').eq(1),
-                combined_write(generators, 'run').eq(1),
-                *map(bist_config, generators),
-                If(combined_read(generators, 'done', and_),
+            ).Else(
+                If(generators_done,
                     NextState("BIST-CHECKER")
                 )
             )
-            fsm.act("BIST-CHECKER",
-                combined_write(checkers, 'start').eq(1),
-                combined_write(checkers, 'run').eq(1),
-                *map(bist_config, checkers),
-                If(combined_read(checkers, 'done', and_),
-                    NextState("DISPLAY")
-                )
+        )
+        fsm.act("BIST-CHECKER",
+            checkers_start.eq(1),
+            checkers_run.eq(1),
+            If(checkers_done,
+                NextState("DISPLAY")
             )
+        )
         fsm.act("DISPLAY",
             display.eq(1),
             NextState("FINISH")
@@ -179,11 +344,80 @@ class LiteDRAMBenchmarkSoC(SimSoC):
         checker_errors  = max_signal((c.errors for c in checkers))
         checker_ticks   = max_signal((c.ticks for c in checkers))
 
+        # Controller Statistics --------------------------------------------------------------------
+        benchmark = Signal()
+        self.comb += benchmark.eq(fsm.ongoing("BIST-GENERATOR") | fsm.ongoing("BIST-CHECKER"))
+
+        controller = self.sdram.controller
+        nbanks     = 2**controller.settings.geom.bankbits
+        fifo_depth = nbanks*(controller.settings.cmd_buffer_depth + 2)
+        ports      = [("generator%d" % i, port) for i, port in enumerate(generator_ports)]
+        ports     += [("checker%d" % i, port) for i, port in enumerate(checker_ports)]
+        latencies  = []
+        for name, port in ports:
+            latency = _PortLatency(port, fifo_depth=fifo_depth)
+            self.submodules += latency
+            latencies.append((name, latency))
+
+        bank_stats = [_BankStatistics(bm.cmd) for bm in controller.bank_machines]
+        self.submodules += bank_stats
+        self.comb += [stats.enable.eq(benchmark) for stats in bank_stats]
+
+        self.submodules.bandwidth = bandwidth = BandwidthCounters(controller.dfi)
+        self.comb += bandwidth.enable.eq(benchmark)
+
+        # JSON lines, " have to be escaped in the Verilog $display string
+        def q(s):
+            return '\\"{}\\"'.format(s)
+
+        def sep(i, n):
+            return "," if i < n - 1 else ""
+
+        stats_display = [
+            Display("BENCHMARK-STATS-BEGIN"),
+            Display("{"),
+            Display("  {}: %0d,".format(q("generator_ticks")), generator_ticks),
+            Display("  {}: %0d,".format(q("checker_errors")), checker_errors),
+            Display("  {}: %0d,".format(q("checker_ticks")), checker_ticks),
+            Display("  {}: [".format(q("ports"))),
+        ]
+        for i, (name, latency) in enumerate(latencies):
+            hist_fmt = ", ".join(["%0d"]*len(latency.read_histogram))
+            stats_display += [
+                Display("    {{{}: {}, {}: [{}], {}: [{}]}}{}".format(
+                    q("name"), q(name),
+                    q("read_latency"),  hist_fmt,
+                    q("write_latency"), hist_fmt,
+                    sep(i, len(latencies))),
+                    *latency.read_histogram, *latency.write_histogram),
+            ]
+        stats_display += [
+            Display("  ],"),
+            Display("  {}: [".format(q("banks"))),
+        ]
+        for i, stats in enumerate(bank_stats):
+            stats_display += [
+                Display("    {{{}: %0d, {}: %0d, {}: %0d, {}: %0d}}{}".format(
+                    q("accesses"), q("activates"), q("precharges"), q("auto_precharges"),
+                    sep(i, len(bank_stats))),
+                    stats.accesses, stats.activates, stats.precharges, stats.auto_precharges),
+            ]
+        stats_display += [
+            Display("  ],"),
+            Display("  {}: {{{}: {}, {}: %0d, {}: %0d, {}: %0d, {}: %0d}}".format(
+                q("dfi"), q("nphases"), bandwidth.nphases,
+                q("cycles"), q("commands"), q("reads"), q("writes")),
+                bandwidth.cycles, bandwidth.ncmds, bandwidth.nreads, bandwidth.nwrites),
+            Display("}"),
+            Display("BENCHMARK-STATS-END"),
+        ]
+
         self.sync += [
             If(display,
                 Display("BIST-GENERATOR ticks:  %08d", generator_ticks),
                 Display("BIST-CHECKER errors:   %08d", checker_errors),
                 Display("BIST-CHECKER ticks:    %08d", checker_ticks),
+                *stats_display
             )
         ]
 
@@ -221,6 +455,10 @@ def main():
     parser.add_argument("--num-generators",   default=1,              help="Number of BIST generators")
     parser.add_argument("--num-checkers",     default=1,              help="Number of BIST checkers")
     parser.add_argument("--access-pattern",                           help="Load access pattern (address, data) from CSV (ignores --bist-*)")
+    parser.add_argument("--with-reordering",  action="store_true",    help="Enable row-hit-first reordering in the bank machines")
+    parser.add_argument("--with-rw-batching", action="store_true",    help="Enable read/write batching (adaptive turnaround) in the multiplexer")
+    parser.add_argument("--address-mapping",  default="ROW_BANK_COL", help="Controller address mapping (ROW_BANK_COL, ROW_BANK_COL_XOR, ROW_COL_BANK, BANK_ROW_COL)")
+    parser.add_argument("--no-run",           action="store_true",    help="Build and compile the simulation without running it")
     parser.add_argument("--log-level",        default="info",         help="Set logging verbosity",
                         choices=['critical', 'error', 'warning', 'info', 'debug'])
     args = parser.parse_args()
@@ -244,6 +482,9 @@ def main():
     soc_kwargs["bist_alternating"] = args.bist_alternating
     soc_kwargs["num_generators"]   = int(args.num_generators)
     soc_kwargs["num_checkers"]     = int(args.num_checkers)
+    soc_kwargs["with_reordering"]  = args.with_reordering
+    soc_kwargs["with_rw_batching"] = args.with_rw_batching
+    soc_kwargs["address_mapping"]  = args.address_mapping
 
     if args.access_pattern:
         soc_kwargs["pattern_init"] = load_access_pattern(args.access_pattern)
@@ -260,7 +501,9 @@ def main():
         opt_level   = args.opt_level,
         trace       = args.trace,
         trace_start = int(args.trace_start),
-        trace_end   = int(args.trace_end)
+        trace_end   = int(args.trace_end),
+        run         = builder.compile_gateware and not args.no_run,
+        compile_sim = builder.compile_gateware,
     )
 
 if __name__ == "__main__":
@@ -50,6 +50,9 @@ defaults = {
     '--bist-random':      [True, False],
     '--num-generators':   [1],
     '--num-checkers':     [1],
+    '--with-reordering':  [False],
+    '--with-rw-batching': [False],
+    '--address-mapping':  ['ROW_BANK_COL'],
     '--access-pattern':   ['access_pattern.csv']
 }
 
@@ -88,8 +91,11 @@ def main():
     convert_string_arg(args, 'bist_random',      bool)
     convert_string_arg(args, 'num_generators',   int)
     convert_string_arg(args, 'num_checkers',     int)
+    convert_string_arg(args, 'with_reordering',  bool)
+    convert_string_arg(args, 'with_rw_batching', bool)
 
-    common_args = ('sdram_module', 'sdram_data_width', 'bist_alternating', 'num_generators', 'num_checkers')
+    common_args = ('sdram_module', 'sdram_data_width', 'bist_alternating', 'num_generators', 'num_checkers',
+                   'with_reordering', 'with_rw_batching', 'address_mapping')
     generated_pattern_args = ('bist_length', 'bist_random')
     custom_pattern_args = ('access_pattern', )
 
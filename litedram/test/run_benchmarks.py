@@ -32,7 +32,7 @@ from litedram import modules as litedram_modules
 from litedram.common import Settings as _Settings
 
 from . import benchmark
-from .benchmark import load_access_pattern
+from .benchmark import load_access_pattern, bist_plusargs, check_pattern_init
 
 
 # Benchmark configuration --------------------------------------------------------------------------
@@ -63,6 +63,16 @@ class GeneratedAccess(Settings):
             args.append('--bist-random')
         return args
 
+    def compile_args(self):
+        return []
+
+    def plusargs(self, bist_alternating):
+        return bist_plusargs(
+            bist_length      = self.bist_length,
+            bist_random      = self.bist_random,
+            bist_alternating = bist_alternating,
+        )
+
 
 class CustomAccess(Settings):
     def __init__(self, pattern_file):
@@ -86,10 +96,18 @@ class CustomAccess(Settings):
     def as_args(self):
         return ['--access-pattern=%s' % self.pattern_file]
 
+    def compile_args(self):
+        return self.as_args()
+
+    def plusargs(self, bist_alternating):
+        check_pattern_init(self.pattern, bist_alternating)
+        return ['+bist_alternating=%d' % bist_alternating]
+
 
 class BenchmarkConfiguration(Settings):
     def __init__(self, name, sdram_module, sdram_data_width, bist_alternating,
-                 num_generators, num_checkers, access_pattern):
+                 num_generators, num_checkers, access_pattern, with_reordering=False,
+                 with_rw_batching=False, address_mapping='ROW_BANK_COL'):
         self.set_attributes(locals())
 
     def as_args(self):
@@ -99,11 +117,40 @@ class BenchmarkConfiguration(Settings):
             '--num-generators=%d' % self.num_generators,
             '--num-checkers=%d' % self.num_checkers,
         ]
+        if self.with_reordering:
+            args.append('--with-reordering')
+        if self.with_rw_batching:
+            args.append('--with-rw-batching')
+        args.append('--address-mapping=%s' % self.address_mapping)
         if self.bist_alternating:
             args.append('--bist-alternating')
         args += self.access_pattern.as_args()
         return args
 
+    # Only the compile-time parameters require rebuilding the simulation, the others are passed
+    # to the compiled simulation as plusargs.
+    def compile_args(self):
+        args = [
+            '--sdram-module=%s' % self.sdram_module,
+            '--sdram-data-width=%d' % self.sdram_data_width,
+            '--num-generators=%d' % self.num_generators,
+            '--num-checkers=%d' % self.num_checkers,
+        ]
+        if self.with_reordering:
+            args.append('--with-reordering')
+        if self.with_rw_batching:
+            args.append('--with-rw-batching')
+        args.append('--address-mapping=%s' % self.address_mapping)
+        args += self.access_pattern.compile_args()
+        return args
+
+    @property
+    def compile_key(self):
+        return tuple(self.compile_args())
+
+    def plusargs(self):
+        return self.access_pattern.plusargs(self.bist_alternating)
+
     def __eq__(self, other):
         if not isinstance(other, BenchmarkConfiguration):
             return NotImplemented
@@ -181,10 +228,60 @@ class BenchmarkResult:
             'Could not find pattern "%s" in output' % (pattern)
         return int(result.group('value'))
 
+    stats_pattern = re.compile(r'BENCHMARK-STATS-BEGIN(?P<json>.*)BENCHMARK-STATS-END', re.DOTALL)
+
     def __init__(self, output):
         self._output = output
         for attr, pattern in self.patterns.items():
             setattr(self, attr, self.find(pattern, output))
+        # controller statistics (None for outputs of benchmarks without statistics)
+        result = self.stats_pattern.search(output)
+        self.stats = json.loads(result.group('json')) if result is not None else None
+
+    def latency_histogram(self, kind):
+        # histogram of all ports, kind is 'read' or 'write'
+        histograms = [port[kind + '_latency'] for port in self.stats['ports']]
+        return [sum(bins) for bins in zip(*histograms)]
+
+    def mean_latency(self, kind):
+        # approximate the latencies of bin i, [2**i, 2**(i+1)), by 1.5 * 2**i
+        histogram = self.latency_histogram(kind)
+        count = sum(histogram)
+        if count == 0:
+            return None
+        return sum(1.5 * 2**i * n for i, n in enumerate(histogram)) / count
+
+    @property
+    def row_hits(self):
+        return sum(max(bank['accesses'] - bank['activates'], 0) for bank in self.stats['banks'])
+
+    @staticmethod
+    def _row_closes(bank):
+        # rows closed by explicit precharges or by accesses with auto-precharge
+        return bank['precharges'] + bank.get('auto_precharges', 0)
+
+    @property
+    def row_misses(self):
+        return sum(max(bank['activates'] - self._row_closes(bank), 0) for bank in self.stats['banks'])
+
+    @property
+    def row_conflicts(self):
+        return sum(self._row_closes(bank) for bank in self.stats['banks'])
+
+    @property
+    def row_hit_ratio(self):
+        accesses = sum(bank['accesses'] for bank in self.stats['banks'])
+        return self.row_hits / accesses if accesses else None
+
+    @property
+    def cmd_bus_utilization(self):
+        dfi = self.stats['dfi']
+        return dfi['commands'] / (dfi['cycles'] * dfi['nphases']) if dfi['cycles'] else None
+
+    @property
+    def data_bus_utilization(self):
+        dfi = self.stats['dfi']
+        return (dfi['reads'] + dfi['writes']) / (dfi['cycles'] * dfi['nphases']) if dfi['cycles'] else None
 
     def __repr__(self):
         d = {attr: getattr(self, attr) for attr in self.patterns.keys()}
@@ -239,6 +336,12 @@ class ResultsSummary:
             except:
                 return None
 
+        # controller statistics are not available for failures and older results
+        def stats(d, func):
+            if getattr(d.result, 'stats', None) is None:
+                return None
+            return func(d.result)
+
         # gather results into tabular data
         column_mappings = {
             'name':             lambda d: d.config.name,
@@ -247,6 +350,9 @@ class ResultsSummary:
             'bist_alternating': lambda d: d.config.bist_alternating,
             'num_generators':   lambda d: d.config.num_generators,
             'num_checkers':     lambda d: d.config.num_checkers,
+            'with_reordering':  lambda d: d.config.with_reordering,
+            'with_rw_batching': lambda d: d.config.with_rw_batching,
+            'address_mapping':  lambda d: d.config.address_mapping,
             'bist_length':      lambda d: getattr(d.config.access_pattern, 'bist_length', None),
             'bist_random':      lambda d: getattr(d.config.access_pattern, 'bist_random', None),
             'pattern_file':     lambda d: getattr(d.config.access_pattern, 'pattern_file', None),
@@ -254,11 +360,20 @@ class ResultsSummary:
             'generator_ticks':  lambda d: getattr(d.result, 'generator_ticks', None),  # None means benchmark failure
             'checker_errors':   lambda d: getattr(d.result, 'checker_errors', None),
             'checker_ticks':    lambda d: getattr(d.result, 'checker_ticks', None),
+            'row_hits':         lambda d: stats(d, lambda r: r.row_hits),
+            'row_misses':       lambda d: stats(d, lambda r: r.row_misses),
+            'row_conflicts':    lambda d: stats(d, lambda r: r.row_conflicts),
+            'row_hit_ratio':    lambda d: stats(d, lambda r: r.row_hit_ratio),
+            'cmd_bus_util':     lambda d: stats(d, lambda r: r.cmd_bus_utilization),
+            'data_bus_util':    lambda d: stats(d, lambda r: r.data_bus_utilization),
+            'mean_write_lat':   lambda d: stats(d, lambda r: r.mean_latency('write')),
+            'mean_read_lat':    lambda d: stats(d, lambda r: r.mean_latency('read')),
             'ctrl_data_width':  lambda d: except_none(lambda: d.config.sdram_controller_data_width),
             'sdram_memtype':    lambda d: except_none(lambda: d.config.sdram_memtype),
             'clk_freq':         lambda d: d.config.sdram_clk_freq,
         }
         columns = {name: [mapping(data) for data in run_data] for name, mapping, in column_mappings.items()}
+        self._run_data = run_data
         self._df = df = pd.DataFrame(columns)
 
         # replace None with NaN
@@ -294,6 +409,11 @@ class ResultsSummary:
             'read_efficiency':  efficiency_fmt,
             'write_latency':    clocks_fmt,
             'read_latency':     clocks_fmt,
+            'row_hit_ratio':    efficiency_fmt,
+            'cmd_bus_util':     efficiency_fmt,
+            'data_bus_util':    efficiency_fmt,
+            'mean_write_lat':   clocks_fmt,
+            'mean_read_lat':    clocks_fmt,
         }
 
         # data formatting for plot summary
@@ -304,6 +424,11 @@ class ResultsSummary:
             'read_efficiency':  PercentFormatter(1.0),
             'write_latency':    ScalarFormatter(),
             'read_latency':     ScalarFormatter(),
+            'row_hit_ratio':    PercentFormatter(1.0),
+            'cmd_bus_util':     PercentFormatter(1.0),
+            'data_bus_util':    PercentFormatter(1.0),
+            'mean_write_lat':   ScalarFormatter(),
+            'mean_read_lat':    ScalarFormatter(),
         }
 
     def df(self, ok=True, failures=False):
@@ -383,12 +508,17 @@ class ResultsSummary:
 
         common_columns = [
             'name', 'sdram_module', 'sdram_memtype', 'sdram_data_width',
-            'bist_alternating', 'num_generators', 'num_checkers'
+            'bist_alternating', 'num_generators', 'num_checkers', 'with_reordering', 'with_rw_batching',
+            'address_mapping'
         ]
         latency_columns = ['write_latency', 'read_latency']
         performance_columns = [
             'write_bandwidth', 'read_bandwidth', 'write_efficiency', 'read_efficiency'
         ]
+        controller_columns = [
+            'row_hits', 'row_misses', 'row_conflicts', 'row_hit_ratio',
+            'cmd_bus_util', 'data_bus_util', 'mean_write_lat', 'mean_read_lat'
+        ]
         failure_columns = [
             'bist_length', 'bist_random', 'pattern_file', 'length',
             'generator_ticks', 'checker_errors', 'checker_ticks'
@@ -414,6 +544,23 @@ class ResultsSummary:
             columns=common_columns + ['bist_length'] + performance_columns,
             column_formatting=formatters,
         ),
+        # best address mapping of each workload: highest sum of write and read bandwidths
+        workload_columns = [
+            'sdram_module', 'sdram_data_width', 'bist_alternating', 'num_generators', 'num_checkers',
+            'with_reordering', 'with_rw_batching', 'bist_length', 'bist_random', 'pattern_file'
+        ]
+        sequences = df[df['is_latency'] == False]
+        sequences = sequences.assign(bandwidth=sequences['write_bandwidth'] + sequences['read_bandwidth'])
+        best = sequences.groupby(workload_columns, dropna=False)['bandwidth'].idxmax()
+        yield 'Best address mapping', self.get_summary(sequences.loc[best.dropna()],
+            columns=workload_columns + ['address_mapping'] + performance_columns,
+            column_formatting=formatters,
+        ),
+        yield 'Controller statistics', self.get_summary(df,
+            mask=~pd.isna(df['row_hit_ratio']),
+            columns=common_columns + controller_columns,
+            column_formatting=formatters,
+        ),
         yield 'Failures', self.get_summary(self.df(ok=False, failures=True),
             columns=common_columns + failure_columns,
             column_formatting=None,
@@ -441,9 +588,33 @@ class ResultsSummary:
                 # save figure
                 axis.get_figure().savefig(path, **savefig_kw)
 
+        self.plot_latency_histograms(plots_dir, save_format=save_format, **savefig_kw)
+
         if backend != 'Agg':
             plt.show()
 
+    def plot_latency_histograms(self, plots_dir='plots', save_format='png', **savefig_kw):
+        import matplotlib.pyplot as plt
+
+        for data in self._run_data:
+            if getattr(data.result, 'stats', None) is None:
+                continue
+            fig, axis = plt.subplots()
+            for kind in ['write', 'read']:
+                histogram = data.result.latency_histogram(kind)
+                axis.step(range(len(histogram)), histogram, where='mid', label=kind)
+            axis.set_title('{}: latency histogram'.format(data.config.name))
+            axis.set_xlabel('log2(latency [clk])')
+            axis.set_ylabel('count')
+            axis.grid(True)
+            axis.legend()
+            fig.tight_layout()
+
+            path = os.path.join(plots_dir, 'latency_histograms', '{}.{}'.format(data.config.name, save_format))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fig.savefig(path, **savefig_kw)
+            plt.close(fig)
+
     def plot_df(self, title, df, column, fig_width=6.4, fig_min_height=2.2, save_format='png', save_filename=None):
         if save_filename is None:
             save_filename = os.path.join(self.plots_dir, title.lower().replace(' ', '_'))
@@ -498,15 +669,38 @@ def run_python(script, args, **kwargs):
     return str(proc.stdout)
 
 
+def run_simulation(build_dir, plusargs, **kwargs):
+    # build_dir is relative to benchmark.py directory, as in run_python
+    gateware_dir = os.path.join(os.path.dirname(benchmark.__file__), build_dir, 'gateware')
+    command = [os.path.join('obj_dir', 'Vdut'), *plusargs]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, cwd=gateware_dir, **kwargs)
+    return proc.stdout.decode(errors='replace')
+
+
 BenchmarkArgs = namedtuple('BenchmarkArgs', ['config', 'output_dir', 'ignore_failures', 'timeout'])
 
 
+def build_benchmark(fargs):
+    # generate and compile the simulation once for all configurations sharing fargs.config.compile_key
+    print('  build {}: {}'.format(fargs.output_dir, ' '.join(fargs.config.compile_args())))
+    try:
+        args = fargs.config.compile_args() + ['--no-run', '--output-dir', fargs.output_dir, '--log-level', 'warning']
+        run_python(benchmark.__file__, args, timeout=fargs.timeout, check=True)
+    except Exception as e:
+        if fargs.ignore_failures:
+            print('  build {}: ERROR: {}'.format(fargs.output_dir, e))
+            return False
+        else:
+            raise
+    print('  build {}: ok'.format(fargs.output_dir))
+    return True
+
+
 def run_single_benchmark(fargs):
-    # run as separate process, because else we cannot capture all output from verilator
+    # run the simulation compiled by build_benchmark in fargs.output_dir with run-time parameters
     print('  {}: {}'.format(fargs.config.name, ' '.join(fargs.config.as_args())))
     try:
-        args = fargs.config.as_args() + ['--output-dir', fargs.output_dir, '--log-level', 'warning']
-        output = run_python(benchmark.__file__, args, timeout=fargs.timeout)
+        output = run_simulation(fargs.output_dir, fargs.config.plusargs(), timeout=fargs.timeout)
         result = BenchmarkResult(output)
         # exit if checker had any read error
         if result.checker_errors != 0:
@@ -523,46 +717,41 @@ def run_single_benchmark(fargs):
     return result
 
 
-InQueueItem = namedtuple('InQueueItem', ['index', 'config'])
+InQueueItem = namedtuple('InQueueItem', ['index', 'fargs'])
 OutQueueItem = namedtuple('OutQueueItem', ['index', 'result'])
 
 
-def run_parallel(configurations, output_base_dir, njobs, ignore_failures, timeout):
+def run_parallel(function, fargs_list, njobs):
     from multiprocessing import Process, Queue
     import queue
 
-    def worker(in_queue, out_queue, out_dir):
+    def worker(in_queue, out_queue):
         while True:
             in_item = in_queue.get()
             if in_item is None:
                 return
-            fargs = BenchmarkArgs(in_item.config, out_dir, ignore_failures, timeout)
-            result = run_single_benchmark(fargs)
+            result = function(in_item.fargs)
             out_queue.put(OutQueueItem(in_item.index, result))
 
     if njobs == 0:
         njobs = os.cpu_count()
     print('Using {:d} parallel jobs'.format(njobs))
 
-    # use one directory per worker, as running each benchmark in separate directory
-    # takes too much disk space (~2GB per 100 benchmarks)
-    dir_pool = [os.path.join(output_base_dir, 'worker_%02d' % i) for i in range(njobs)]
-
     in_queue, out_queue = Queue(), Queue()
-    workers = [Process(target=worker, args=(in_queue, out_queue, dir)) for dir in dir_pool]
+    workers = [Process(target=worker, args=(in_queue, out_queue)) for _ in range(njobs)]
     for w in workers:
         w.start()
 
-    # put all benchmark configurations with index to retrieve them in order
-    for i, config in enumerate(configurations):
-        in_queue.put(InQueueItem(i, config))
+    # put all function arguments with index to retrieve them in order
+    for i, fargs in enumerate(fargs_list):
+        in_queue.put(InQueueItem(i, fargs))
 
     # send "finish signal" for each worker
     for _ in workers:
         in_queue.put(None)
 
     # retrieve results in proper order
-    out_items = [out_queue.get() for _ in configurations]
+    out_items = [out_queue.get() for _ in fargs_list]
     results = [out.result for out in sorted(out_items, key=lambda o: o.index)]
 
     for p in workers:
@@ -571,14 +760,38 @@ def run_parallel(configurations, output_base_dir, njobs, ignore_failures, timeou
     return results
 
 
-def run_benchmarks(configurations, output_base_dir, njobs, ignore_failures, timeout):
-    print('Running {:d} benchmarks ...'.format(len(configurations)))
+def run_jobs(function, fargs_list, njobs):
     if njobs == 1:
-        results = [run_single_benchmark(BenchmarkArgs(config, output_base_dir, ignore_failures, timeout))
-                   for config in configurations]
-    else:
-        results = run_parallel(configurations, output_base_dir, njobs, ignore_failures, timeout)
-    run_data = [RunCache.RunData(config, result) for config, result in zip(configurations, results)]
+        return [function(fargs) for fargs in fargs_list]
+    return run_parallel(function, fargs_list, njobs)
+
+
+def run_benchmarks(configurations, output_base_dir, njobs, ignore_failures, timeout):
+    # group configurations by compile-time parameters and build each group only once, in its own
+    # directory (so that the runs of different groups can be done in parallel)
+    groups = defaultdict(list)
+    for config in configurations:
+        groups[config.compile_key].append(config)
+    groups = list(groups.values())
+    build_dirs = [os.path.join(output_base_dir, 'build_%03d' % i) for i in range(len(groups))]
+
+    print('Building {:d} simulations for {:d} benchmarks ...'.format(len(groups), len(configurations)))
+    build_fargs = [BenchmarkArgs(group[0], build_dir, ignore_failures, timeout)
+                   for group, build_dir in zip(groups, build_dirs)]
+    built = run_jobs(build_benchmark, build_fargs, njobs)
+
+    # benchmarks of groups that failed to build have no result
+    build_dir_of = {}
+    for group, build_dir, ok in zip(groups, build_dirs, built):
+        for config in group:
+            build_dir_of[id(config)] = build_dir if ok else None
+    to_run = [config for config in configurations if build_dir_of[id(config)] is not None]
+
+    print('Running {:d} benchmarks ...'.format(len(to_run)))
+    run_fargs = [BenchmarkArgs(config, build_dir_of[id(config)], ignore_failures, timeout) for config in to_run]
+    results = dict(zip(map(id, to_run), run_jobs(run_single_benchmark, run_fargs, njobs)))
+
+    run_data = [RunCache.RunData(config, results.get(id(config))) for config in configurations]
     return run_data
 
 
@@ -28,8 +28,9 @@ class Burst:
                 offset = i*2**(self.size)
                 r += [Beat(self.addr + offset)]
             elif self.type == BURST_WRAP:
-                offset = (i*2**(self.size))%((2**self.size)*(self.len))
-                r += [Beat(self.addr + offset)]
+                wrap   = 2**(self.size)*(self.len + 1)
+                offset = (self.addr + i*2**(self.size))%wrap
+                r += [Beat(self.addr - self.addr%wrap + offset)]
             else:
                 r += [Beat(self.addr)]
         return r
@@ -57,7 +58,7 @@ class Read(Access):
 
 class TestAXI(unittest.TestCase):
     def _test_axi2native(self,
-        naccesses=16, simultaneous_writes_reads=False,
+        naccesses=16, simultaneous_writes_reads=False, nports=1,
         # random: 0: min (no random), 100: max.
         # burst randomness
         id_rand_enable   = False,
@@ -108,11 +109,14 @@ class TestAXI(unittest.TestCase):
                     while (yield axi_port.w.ready) == 0:
                         yield
                     yield axi_port.w.valid.eq(0)
-            axi_port.reads_enable = True
+            if nports == 1:
+                axi_port.reads_enable = True
 
         def writes_response_generator(axi_port, writes):
             prng = random.Random(42)
             self.writes_id_errors = 0
+            # a single port answers in order, with multiple ports responses are only ordered per ID
+            pending = [write.id for write in writes]
             for write in writes:
                 # wait response
                 yield axi_port.b.ready.eq(0)
@@ -123,8 +127,16 @@ class TestAXI(unittest.TestCase):
                     yield
                 yield axi_port.b.ready.eq(1)
                 yield
-                if (yield axi_port.b.id) != write.id:
+                if nports == 1:
+                    if (yield axi_port.b.id) != write.id:
+                        self.writes_id_errors += 1
+                elif (yield axi_port.b.id) not in pending:
                     self.writes_id_errors += 1
+                else:
+                    pending.remove((yield axi_port.b.id))
+            yield axi_port.b.ready.eq(0)
+            # with multiple ports, only reads issued after the write responses see the writes
+            axi_port.reads_enable = True
 
         def reads_cmd_generator(axi_port, reads):
             prng = random.Random(42)
@@ -152,8 +164,14 @@ class TestAXI(unittest.TestCase):
             self.reads_last_errors = 0
             while not axi_port.reads_enable:
                 yield
+            # a single port answers in order, with multiple ports responses are only ordered per ID
+            pending = {}
             for read in reads:
-                for i, data in enumerate(read.data):
+                pending.setdefault(read.id, []).append(read)
+            for expected in reads:
+                read = expected if nports == 1 else None
+                i    = 0
+                while read is None or i < len(read.data):
                     # wait data / response
                     yield axi_port.r.ready.eq(0)
                     yield
@@ -163,7 +181,12 @@ class TestAXI(unittest.TestCase):
                         yield
                     yield axi_port.r.ready.eq(1)
                     yield
-                    if (yield axi_port.r.data) != data:
+                    if read is None:
+                        if not pending.get((yield axi_port.r.id), []):
+                            self.reads_id_errors += 1
+                            break
+                        read = pending[(yield axi_port.r.id)].pop(0)
+                    if (yield axi_port.r.data) != read.data[i]:
                         self.reads_data_errors += 1
                     if (yield axi_port.r.id) != read.id:
                         self.reads_id_errors += 1
@@ -173,11 +196,12 @@ class TestAXI(unittest.TestCase):
                     else:
                         if (yield axi_port.r.last) != 0:
                             self.reads_last_errors += 1
+                    i += 1
 
         # dut
         axi_port = LiteDRAMAXIPort(32, 32, 8)
-        dram_port = LiteDRAMNativePort("both", 32, 32)
-        dut = LiteDRAMAXI2Native(axi_port, dram_port)
+        dram_ports = [LiteDRAMNativePort("both", 32, 32) for _ in range(nports)]
+        dut = LiteDRAMAXI2Native(axi_port, dram_ports if nports > 1 else dram_ports[0])
         mem = DRAMMemory(32, 1024)
 
         # generate writes/reads
@@ -205,9 +229,12 @@ class TestAXI(unittest.TestCase):
             writes_response_generator(axi_port, writes),
             reads_cmd_generator(axi_port, reads),
             reads_response_data_generator(axi_port, reads),
-            mem.read_handler(dram_port, rdata_valid_random=r_valid_random),
-            mem.write_handler(dram_port, wdata_ready_random=w_ready_random)
         ]
+        for dram_port in dram_ports:
+            generators += [
+                mem.read_handler(dram_port, rdata_valid_random=r_valid_random),
+                mem.write_handler(dram_port, wdata_ready_random=w_ready_random)
+            ]
         run_simulation(dut, generators)
         #mem.show_content()
         self.assertEqual(self.writes_id_errors, 0)
@@ -272,3 +299,22 @@ class TestAXI(unittest.TestCase):
             r_valid_random=90,
             r_ready_random=90
         )
+
+    # multiple ports: IDs interleaved over the ports, responses reordered per ID
+    def test_axi2native_interleaved_no_random(self):
+        self._test_axi2native(nports=4)
+
+    def test_axi2native_interleaved_random_all(self):
+        self._test_axi2native(
+            nports=4,
+            id_rand_enable=True,
+            len_rand_enable=True,
+            data_rand_enable=True,
+            aw_valid_random=50,
+            w_ready_random=50,
+            b_ready_random=50,
+            w_valid_random=50,
+            ar_valid_random=90,
+            r_valid_random=90,
+            r_ready_random=90
+        )
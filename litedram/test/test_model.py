@@ -0,0 +1,204 @@
+# This file is Copyright (c) 2020 LiteDRAM developers
+# License: BSD
+
+import os
+import random
+import unittest
+import tempfile
+
+from migen import *
+
+from litex.gen.sim import *
+
+from litedram.common import PhySettings
+from litedram.modules import MT48LC16M16
+from litedram.phy.model import SparseMemory, SparseMemoryImage, SparseMemoryInit, SDRAMPHYModel
+from litedram.core.controller import ControllerSettings, LiteDRAMController
+from litedram.core.crossbar import LiteDRAMCrossbar
+
+
+class SparseMemoryDUT(Module):
+    def __init__(self, init=None):
+        self.mem = SparseMemory(32, 2**20, init=init, page_words=16)
+        self.specials += self.mem
+
+
+class TestSparseMemory(unittest.TestCase):
+    image = bytes(range(64))
+
+    def image_word(self, n):
+        return int.from_bytes(self.image[4*n:4*n + 4], "little")
+
+    def run_sparse_memory(self, dut, accesses):
+        # accesses: list of ("w", adr, data, we) / ("r", adr, expected)
+        mem = dut.mem
+        def generator():
+            for access in accesses:
+                if access[0] == "w":
+                    _, adr, data, we = access
+                    yield mem.wr_adr.eq(adr)
+                    yield mem.dat_w.eq(data)
+                    yield mem.we.eq(we)
+                    yield
+                    yield mem.we.eq(0)
+                    yield
+                else:
+                    _, adr, expected = access
+                    yield mem.rd_adr.eq(adr)
+                    yield mem.re.eq(1)
+                    yield
+                    yield mem.re.eq(0)
+                    yield
+                    self.assertEqual((yield mem.dat_r), expected)
+        run_simulation(dut, generator())
+
+    def test_sparse_memory_write_read(self):
+        dut = SparseMemoryDUT()
+        self.run_sparse_memory(dut, [
+            ("r", 0x12345, 0),
+            ("w", 0x12345, 0xdeadbeef, 0b1111),
+            ("w", 0x00003, 0xaabbccdd, 0b0101),
+            ("r", 0x12345, 0xdeadbeef),
+            ("r", 0x12346, 0),
+            ("r", 0x00003, 0x00bb00dd),
+        ])
+
+    def test_sparse_memory_init(self):
+        # word adr of the memory is image word (adr//2)*4 + 1 + adr%2
+        image = SparseMemoryImage(data=self.image)
+        dut = SparseMemoryDUT(init=SparseMemoryInit(image, offset=1, chunk=2, stride=4))
+        self.run_sparse_memory(dut, [
+            ("r", 0, self.image_word(1)),
+            ("r", 1, self.image_word(2)),
+            ("r", 2, self.image_word(5)),
+            ("w", 3, 0xaabbccdd, 0b0101),
+            ("r", 3, (self.image_word(6) & 0xff00ff00) | 0x00bb00dd),
+            ("r", 2, self.image_word(5)),
+            ("r", 1000, 0),
+        ])
+
+    def test_sparse_memory_init_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "init.bin")
+            with open(filename, "wb") as f:
+                f.write(self.image)
+            image = SparseMemoryImage(filename=filename)
+            dut = SparseMemoryDUT(init=SparseMemoryInit(image))
+            self.run_sparse_memory(dut, [
+                ("r", 0, self.image_word(0)),
+                ("r", 15, self.image_word(15)),
+                ("r", 16, 0),
+            ])
+            image.data.close()
+
+
+class SimModule(MT48LC16M16):
+    # MT48LC16M16 with only a few rows, to keep the simulated banks small
+    nrows = 16
+
+
+class ControllerDUT(Module):
+    def __init__(self, address_mapping="ROW_BANK_COL", **kwargs):
+        module = SimModule(100e6, "1:1")
+        module.geom_settings.addressbits = 13 # A10 is used for (auto-)precharges
+        phy_settings = PhySettings(
+            memtype       = "SDR",
+            databits      = 16,
+            dfi_databits  = 16,
+            nphases       = 1,
+            rdphase       = 0,
+            wrphase       = 0,
+            rdcmdphase    = 0,
+            wrcmdphase    = 0,
+            cl            = 2,
+            cwl           = None,
+            read_latency  = 4,
+            write_latency = 0)
+        self.submodules.sdrphy = SDRAMPHYModel(module, phy_settings,
+            address_mapping=address_mapping, **kwargs)
+        self.submodules.controller = LiteDRAMController(phy_settings, module.geom_settings,
+            module.timing_settings, 100e6,
+            controller_settings=ControllerSettings(address_mapping=address_mapping))
+        self.comb += self.controller.dfi.connect(self.sdrphy.dfi)
+        self.submodules.crossbar = LiteDRAMCrossbar(self.controller.interface)
+        self.port = self.crossbar.get_port()
+
+
+class TestSDRAMPHYModel(unittest.TestCase):
+    # Note: the sparse backend requires the LiteX simulator (litex.gen.sim)
+    image_size = 2*SimModule.nbanks*SimModule.nrows*SimModule.ncols
+
+    def run_port(self, dut, commands):
+        """Run the commands ((we, addr, data)) on the port of dut, return the read data"""
+        port   = dut.port
+        reads  = []
+        wdatas = [data for we, addr, data in commands if we]
+        nreads = len(commands) - len(wdatas)
+
+        def cmd_generator():
+            for we, addr, data in commands:
+                yield port.cmd.valid.eq(1)
+                yield port.cmd.we.eq(we)
+                yield port.cmd.addr.eq(addr)
+                yield
+                while not (yield port.cmd.ready):
+                    yield
+            yield port.cmd.valid.eq(0)
+            while len(reads) < nreads:
+                yield
+
+        @passive
+        def wdata_generator():
+            yield port.wdata.we.eq(0b11)
+            while True:
+                yield port.wdata.valid.eq(len(wdatas) != 0)
+                yield port.wdata.data.eq(wdatas[0] if wdatas else 0)
+                yield
+                if (yield port.wdata.ready):
+                    wdatas.pop(0)
+
+        @passive
+        def rdata_generator():
+            yield port.rdata.ready.eq(1)
+            while True:
+                yield
+                if (yield port.rdata.valid):
+                    reads.append((yield port.rdata.data))
+
+        run_simulation(dut, [cmd_generator(), wdata_generator(), rdata_generator()])
+        return reads
+
+    def commands(self, seed=0):
+        # Writes then reads at random addresses of all the banks/rows, with row hits and misses
+        prng  = random.Random(seed)
+        addrs = [prng.randrange(self.image_size//2) for i in range(48)]
+        addrs += [addr + 1 for addr in addrs[:16]]
+        commands  = [(1, addr, prng.randrange(2**16)) for addr in addrs[:24]]
+        commands += [(0, addr, None) for addr in addrs]
+        return commands
+
+    def test_sparse_backend(self):
+        # Sparse backend returns the same data as the memory backend
+        commands = self.commands()
+        results  = []
+        for backend in ["memory", "sparse"]:
+            results.append(self.run_port(ControllerDUT(backend=backend), commands))
+        self.assertEqual(len(results[0]), 48 + 16)
+        self.assertEqual(results[0], results[1])
+
+    def test_sparse_backend_init_file(self):
+        # Init image is seen at the port addresses, whatever the address mapping and backend
+        prng  = random.Random(1)
+        image = bytes(prng.randrange(256) for i in range(self.image_size))
+        init  = [int.from_bytes(image[4*i:4*i + 4], "little") for i in range(len(image)//4)]
+        addrs = [prng.randrange(self.image_size//2) for i in range(32)]
+        expected = [int.from_bytes(image[2*addr:2*addr + 2], "little") for addr in addrs]
+        commands = [(0, addr, None) for addr in addrs]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "init.bin")
+            with open(filename, "wb") as f:
+                f.write(image)
+            for address_mapping in ["ROW_BANK_COL", "BANK_ROW_COL"]:
+                for kwargs in [dict(init=init), dict(backend="sparse", init_file=filename)]:
+                    dut = ControllerDUT(address_mapping=address_mapping, **kwargs)
+                    self.assertEqual(self.run_port(dut, commands), expected)
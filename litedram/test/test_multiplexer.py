@@ -0,0 +1,102 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litedram.common import PhySettings
+from litedram.modules import MT48LC16M16
+from litedram.core.controller import ControllerSettings, LiteDRAMController
+from litedram.core.multiplexer import _ReadWriteBatching
+
+
+class BankMachineModel:
+    def __init__(self, depth=8):
+        self.pending_reads  = Signal(max=depth + 2)
+        self.pending_writes = Signal(max=depth + 2)
+        self.cmd = Record([("valid", 1), ("is_read", 1), ("is_write", 1)])
+
+
+def controller(**kwargs):
+    module = MT48LC16M16(100e6, "1:1")
+    phy_settings = PhySettings(
+        memtype       = "SDR",
+        databits      = 16,
+        dfi_databits  = 16,
+        nphases       = 1,
+        rdphase       = 0,
+        wrphase       = 0,
+        rdcmdphase    = 0,
+        wrcmdphase    = 0,
+        cl            = 2,
+        cwl           = None,
+        read_latency  = 4,
+        write_latency = 0)
+    return LiteDRAMController(phy_settings, module.geom_settings, module.timing_settings, 100e6,
+        controller_settings=ControllerSettings(with_rw_batching=True, **kwargs))
+
+
+class TestReadWriteBatching(unittest.TestCase):
+    def test_decisions(self):
+        # (pending reads, pending writes, next command) of the 2 banks, reads_done, writes_done
+        cases = [
+            ([(0, 0, None), (0, 0, None)], 1, 1),
+            ([(2, 0, "r"),  (0, 0, None)], 0, 1),
+            ([(2, 6, None), (0, 0, None)], 0, 0),
+            ([(2, 6, "w"),  (0, 0, None)], 1, 0), # reads blocked behind a write
+            ([(2, 6, "r"),  (0, 0, None)], 0, 1), # writes blocked behind a read
+            ([(0, 0, None), (1, 3, "r")],  0, 1),
+            ([(2, 3, None), (0, 1, "w")],  0, 1), # low watermark
+            ([(2, 3, None), (0, 4, "w")],  0, 0),
+            ([(2, 3, None), (0, 5, "w")],  1, 0), # high watermark
+        ]
+        def generator(dut, bank_machines):
+            for banks, reads_done, writes_done in cases:
+                for bm, (pending_reads, pending_writes, cmd) in zip(bank_machines, banks):
+                    yield bm.pending_reads.eq(pending_reads)
+                    yield bm.pending_writes.eq(pending_writes)
+                    yield bm.cmd.valid.eq(cmd is not None)
+                    yield bm.cmd.is_read.eq(cmd == "r")
+                    yield bm.cmd.is_write.eq(cmd == "w")
+                yield
+                self.assertEqual((yield dut.reads_done), reads_done)
+                self.assertEqual((yield dut.writes_done), writes_done)
+            # watermarks are runtime-tunable
+            yield dut.write_high.storage.eq(10)
+            yield
+            self.assertEqual((yield dut.reads_done), 0)
+
+        bank_machines = [BankMachineModel(), BankMachineModel()]
+        dut = _ReadWriteBatching(bank_machines, write_watermarks=(4, 8))
+        run_simulation(dut, generator(dut, bank_machines))
+
+    def test_counters(self):
+        states = "RRTTWWWTTTRRTRFRTW"
+        def generator(dut):
+            for state in states:
+                yield dut.reading.eq(state == "R")
+                yield dut.writing.eq(state == "W")
+                yield dut.turnaround.eq(state == "T")
+                yield
+            yield
+            # read -> write, write -> read, read -> write
+            self.assertEqual((yield dut.switches.status), 3)
+            self.assertEqual((yield dut.turnaround_cycles.status), states.count("T"))
+
+        dut = _ReadWriteBatching([BankMachineModel()], write_watermarks=(2, 8))
+        run_simulation(dut, generator(dut))
+
+    def test_write_watermarks(self):
+        # Default high watermark is reachable by a single writer (cmd_buffer_depth + 1 per bank)
+        for cmd_buffer_depth in [4, 8, 16]:
+            batching = controller(cmd_buffer_depth=cmd_buffer_depth).multiplexer.batching
+            self.assertEqual(batching.write_low.storage.reset.value, cmd_buffer_depth//4)
+            self.assertEqual(batching.write_high.storage.reset.value, cmd_buffer_depth)
+        batching = controller(write_watermarks=(4, 16)).multiplexer.batching
+        self.assertEqual(batching.write_high.storage.reset.value, 16)
+        # Unreachable high watermark (4 banks of 9 commands) or inverted watermarks
+        with self.assertRaises(AssertionError):
+            controller(write_watermarks=(4, 40))
+        with self.assertRaises(AssertionError):
+            controller(write_watermarks=(8, 4))
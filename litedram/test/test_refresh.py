@@ -5,6 +5,9 @@ import unittest
 
 from migen import *
 
+from litedram.common import PhySettings
+from litedram.modules import MT48LC16M16
+from litedram.core.controller import ControllerSettings, LiteDRAMController
 from litedram.core.multiplexer import cmd_request_rw_layout
 from litedram.core.refresher import RefreshSequencer, RefreshTimer, Refresher
 
@@ -12,6 +15,12 @@ from litedram.core.refresher import RefreshSequencer, RefreshTimer, Refresher
 def c2bool(c):
     return {"-": 1, "_": 0}[c]
 
+class CustomRefresher(Refresher):
+    # refresh_cls without opportunistic refresh support (no pull_in parameter nor idle signal)
+    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1):
+        Refresher.__init__(self, settings, clk_freq, zqcs_freq, postponing)
+        del self.idle
+
 class TestRefresh(unittest.TestCase):
     def refresh_sequencer_test(self, trp, trfc, starts, dones, cmds):
         cmd = Record(cmd_request_rw_layout(a=16, ba=3))
@@ -66,7 +75,7 @@ class TestRefresh(unittest.TestCase):
         for i in range(1, 32):
             self.refresh_timer_test(i)
 
-    def refresher_test(self, postponing):
+    def refresher_settings(self):
         class Obj: pass
         settings = Obj()
         settings.with_refresh = True
@@ -81,6 +90,10 @@ class TestRefresh(unittest.TestCase):
         settings.geom.bankbits    = 3
         settings.phy = Obj()
         settings.phy.nranks = 1
+        return settings
+
+    def refresher_test(self, postponing):
+        settings = self.refresher_settings()
 
         def generator(dut):
             dut.errors = 0
@@ -106,3 +119,64 @@ class TestRefresh(unittest.TestCase):
     def test_refresher(self):
         for i in [1, 2, 4, 8]:
             self.refresher_test(postponing=i)
+
+    def refresher_pull_in_test(self, idle, postponing=8, pull_in=8):
+        settings = self.refresher_settings()
+        settings.timing.tZQCS = None
+        trefi = settings.timing.tREFI
+
+        def generator(dut):
+            dut.refreshes = []
+            yield dut.cmd.ready.eq(1)
+            yield dut.idle.eq(idle)
+            cmd_valid = 0
+            for i in range(32*trefi):
+                if (yield dut.cmd.valid) and not cmd_valid:
+                    dut.refreshes.append(i)
+                cmd_valid = (yield dut.cmd.valid)
+                yield
+
+        dut = Refresher(settings, clk_freq=100e6, postponing=postponing, pull_in=pull_in)
+        run_simulation(dut, [generator(dut)])
+        return dut.refreshes
+
+    def test_refresher_pull_in_idle(self):
+        # Idle: pull_in refreshes are pulled in ahead of the timer, then 1 refresh per tREFI
+        trefi     = 64
+        refreshes = self.refresher_pull_in_test(idle=1)
+        self.assertEqual(len([r for r in refreshes if r < trefi - 8]), 8)
+        self.assertEqual(set(b - a for a, b in zip(refreshes[8:-1], refreshes[9:])), {trefi})
+
+    def test_refresher_pull_in_busy(self):
+        # Busy: refreshes are postponed until postponing refreshes are owed, then 1 per tREFI
+        trefi     = 64
+        refreshes = self.refresher_pull_in_test(idle=0)
+        self.assertEqual(refreshes[0]//trefi, 8)
+        self.assertEqual(set(b - a for a, b in zip(refreshes[:-1], refreshes[1:])), {trefi})
+
+    def test_custom_refresher(self):
+        module = MT48LC16M16(100e6, "1:1")
+        phy_settings = PhySettings(
+            memtype       = "SDR",
+            databits      = 16,
+            dfi_databits  = 16,
+            nphases       = 1,
+            rdphase       = 0,
+            wrphase       = 0,
+            rdcmdphase    = 0,
+            wrcmdphase    = 0,
+            cl            = 2,
+            cwl           = None,
+            read_latency  = 4,
+            write_latency = 0)
+        def controller(**kwargs):
+            return LiteDRAMController(phy_settings, module.geom_settings, module.timing_settings,
+                clk_freq=100e6, controller_settings=ControllerSettings(**kwargs))
+        dut = controller(refresh_cls=CustomRefresher)
+        self.assertIsInstance(dut.refresher, CustomRefresher)
+        def generator():
+            for i in range(4):
+                yield
+        run_simulation(dut, generator())
+        with self.assertRaises(TypeError):
+            controller(refresh_cls=CustomRefresher, refresh_pull_in=4)
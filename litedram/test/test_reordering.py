@@ -0,0 +1,153 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litedram.common import PhySettings
+from litedram.modules import MT48LC16M16
+from litedram.phy.model import SDRAMPHYModel
+from litedram.core.controller import ControllerSettings, LiteDRAMController
+from litedram.core.crossbar import LiteDRAMCrossbar
+
+
+class SimModule(MT48LC16M16):
+    # MT48LC16M16 with only a few rows, to keep the simulated banks small
+    nrows = 16
+
+
+def addr(row, bank, col):
+    # ROW_BANK_COL mapping
+    return (row*SimModule.nbanks + bank)*SimModule.ncols + col
+
+
+class DUT(Module):
+    def __init__(self, nmasters, **kwargs):
+        module = SimModule(100e6, "1:1")
+        module.geom_settings.addressbits = 13 # A10 is used for (auto-)precharges
+        phy_settings = PhySettings(
+            memtype       = "SDR",
+            databits      = 16,
+            dfi_databits  = 16,
+            nphases       = 1,
+            rdphase       = 0,
+            wrphase       = 0,
+            rdcmdphase    = 0,
+            wrcmdphase    = 0,
+            cl            = 2,
+            cwl           = None,
+            read_latency  = 4,
+            write_latency = 0)
+        self.submodules.sdrphy = SDRAMPHYModel(module, phy_settings)
+        self.submodules.controller = LiteDRAMController(phy_settings, module.geom_settings,
+            module.timing_settings, 100e6, controller_settings=ControllerSettings(**kwargs))
+        self.comb += self.controller.dfi.connect(self.sdrphy.dfi)
+        self.submodules.crossbar = LiteDRAMCrossbar(self.controller.interface)
+        self.ports = [self.crossbar.get_port() for n in range(nmasters)]
+
+
+class TestReordering(unittest.TestCase):
+    def run_masters(self, commands, **kwargs):
+        """Run the commands ((we, addr, data) lists) of each master, return the read data of each
+        master and the number of cycles and activates"""
+        dut    = DUT(len(commands), **kwargs)
+        reads  = [[] for c in commands]
+        wdatas = [[data for we, addr, data in c if we] for c in commands]
+        stats  = {"cycles": 0, "activates": 0}
+        done   = [False]*len(commands)
+
+        def master(n, port):
+            for we, addr, data in commands[n]:
+                yield port.cmd.valid.eq(1)
+                yield port.cmd.we.eq(we)
+                yield port.cmd.addr.eq(addr)
+                yield
+                while not (yield port.cmd.ready):
+                    yield
+            yield port.cmd.valid.eq(0)
+            while len(reads[n]) < sum(not we for we, addr, data in commands[n]):
+                yield
+            done[n] = True
+
+        @passive
+        def wdata(n, port):
+            yield port.wdata.we.eq(2**len(port.wdata.we) - 1)
+            while True:
+                yield port.wdata.valid.eq(len(wdatas[n]) != 0)
+                yield port.wdata.data.eq(wdatas[n][0] if wdatas[n] else 0)
+                yield
+                if (yield port.wdata.ready):
+                    wdatas[n].pop(0)
+
+        @passive
+        def rdata(n, port):
+            yield port.rdata.ready.eq(1)
+            while True:
+                yield
+                if (yield port.rdata.valid):
+                    reads[n].append((yield port.rdata.data))
+
+        @passive
+        def monitor(phase):
+            while True:
+                yield
+                if not all(done):
+                    stats["cycles"] += 1
+                activate = ((yield phase.cs_n) == 0) & ((yield phase.ras_n) == 0) & \
+                    ((yield phase.cas_n) == 1) & ((yield phase.we_n) == 1)
+                stats["activates"] += activate
+
+        generators = [monitor(dut.sdrphy.dfi.phases[0])]
+        for n, port in enumerate(dut.ports):
+            generators += [master(n, port), wdata(n, port), rdata(n, port)]
+        run_simulation(dut, generators)
+        return reads, stats
+
+    def expected_reads(self, commands):
+        reads = []
+        for c in commands:
+            mem = {}
+            reads.append([])
+            for we, addr, data in c:
+                if we:
+                    mem[addr] = data
+                else:
+                    reads[-1].append(mem.get(addr, 0))
+        return reads
+
+    def streaming_test(self, nmasters, n=16):
+        # Masters streaming writes then reads, each on its own row of bank 0
+        commands = []
+        for m in range(nmasters):
+            addrs = [addr(row=m + 1, bank=0, col=col) for col in range(n)]
+            commands.append([(1, a, (m << 8) | col) for col, a in enumerate(addrs)] +
+                            [(0, a, None) for a in addrs])
+        results = {}
+        for with_reordering in [False, True]:
+            reads, stats = self.run_masters(commands, with_reordering=with_reordering)
+            self.assertEqual(reads, self.expected_reads(commands))
+            results[with_reordering] = stats
+        # Row hits of a master are not interleaved with the commands of the other masters: each
+        # row is opened once.
+        self.assertEqual(results[True]["activates"], nmasters)
+        self.assertLessEqual(results[True]["cycles"], results[False]["cycles"])
+
+    def test_streaming_2_masters(self):
+        self.streaming_test(2)
+
+    def test_streaming_4_masters(self):
+        self.streaming_test(4)
+
+    def test_random(self):
+        # Masters on random rows/banks, each on its own columns
+        prng = random.Random(42)
+        commands = []
+        for m in range(4):
+            commands.append([])
+            for i in range(24):
+                a = addr(prng.randrange(16), prng.randrange(4), 8*m + prng.randrange(4))
+                commands[-1].append((prng.randrange(2), a, prng.randrange(2**16)))
+        reads, stats = self.run_masters(commands, with_reordering=True)
+        self.assertEqual(reads, self.expected_reads(commands))
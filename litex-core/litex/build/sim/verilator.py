@@ -150,9 +150,9 @@ def _compile_sim(build_name, verbose):
     if verbose:
         print(output)
 
-def _run_sim(build_name, as_root=False):
+def _run_sim(build_name, as_root=False, sim_args=[]):
     run_script_contents = "sudo " if as_root else ""
-    run_script_contents += "obj_dir/Vdut"
+    run_script_contents += " ".join(["obj_dir/Vdut"] + sim_args)
     run_script_file = "run_" + build_name + ".sh"
     tools.write_to_file(run_script_file, run_script_contents, force_unix=True)
     if sys.platform != "win32":
@@ -172,7 +172,8 @@ class SimVerilatorToolchain:
     def build(self, platform, fragment, build_dir="build", build_name="dut",
             toolchain_path=None, serial="console", build=True, run=True, threads=1,
             verbose=True, sim_config=None, coverage=False, opt_level="O0",
-            trace=False, trace_fst=False, trace_start=0, trace_end=-1):
+            trace=False, trace_fst=False, trace_start=0, trace_end=-1,
+            compile_sim=None, sim_args=[]):
 
         # create build directory
         os.makedirs(build_dir, exist_ok=True)
@@ -191,6 +192,10 @@ class SimVerilatorToolchain:
             top_file = build_name + ".v"
             top_output.write(top_file)
             platform.add_source(top_file)
+            # C++ models generated by specials (ex: DPI-C models) are compiled with the design
+            for filename in sorted(top_output.data_files):
+                if filename.endswith(".cpp"):
+                    platform.add_source(filename)
 
             # generate cpp header/main/variables
             _generate_sim_h(platform)
@@ -204,15 +209,20 @@ class SimVerilatorToolchain:
             # build
             _build_sim(build_name, platform.sources, threads, coverage, opt_level, trace_fst)
 
-        # run
-        if run:
+        # compile (by default, only when running)
+        if compile_sim is None:
+            compile_sim = run
+        if compile_sim:
             _compile_sim(build_name, verbose)
+
+        # run (sim_args: simulation arguments, ex plusargs)
+        if run:
             run_as_root = False
             if sim_config.has_module("ethernet"):
                 run_as_root = True
             if sim_config.has_module("xgmii_ethernet"):
                 run_as_root = True
-            _run_sim(build_name, as_root=run_as_root)
+            _run_sim(build_name, as_root=run_as_root, sim_args=sim_args)
 
         os.chdir("../../")
 
@@ -0,0 +1,324 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+from collections.abc import Iterable
+from itertools import count
+
+from migen.fhdl.structure import *
+from migen.fhdl.structure import (_Value, _Operator, _Slice, _ArrayProxy,
+                                  _Assign)
+from migen.fhdl.bitcontainer import value_bits_sign
+from migen.fhdl.specials import _MemoryLocation
+
+
+# Python source compiler for Migen statements.
+#
+# Statement lists are translated once into plain Python functions operating on
+# a flat list of signal values ("slots"). Signals are referenced by their slot
+# index, committed values are read from `v` and pending (non-blocking) writes
+# go to the `m` dict, exactly like the modifications of the interpreted
+# Evaluator.
+
+
+_binops = {
+    "+":   "+",
+    "-":   "-",
+    "*":   "*",
+    ">>>": ">>",
+    "<<<": "<<",
+    "&":   "&",
+    "^":   "^",
+    "|":   "|",
+    "<":   "<",
+    "<=":  "<=",
+    "==":  "==",
+    "!=":  "!=",
+    ">":   ">",
+    ">=":  ">=",
+}
+
+
+def _mask(nbits):
+    return (1 << nbits) - 1
+
+
+class StatementCompiler:
+    def __init__(self, slot, clock_domains, replaced_memories):
+        self.slot = slot
+        self.clock_domains = clock_domains
+        self.replaced_memories = replaced_memories
+        self.tables = dict()
+        self.tmpgen = count()
+
+    # helpers
+
+    def _tmp(self):
+        return "t{}".format(next(self.tmpgen))
+
+    def _table(self, prefix, content):
+        key = (prefix, content)
+        try:
+            return self.tables[key]
+        except KeyError:
+            name = "{}{}".format(prefix, len(self.tables))
+            self.tables[key] = name
+            return name
+
+    def _signal(self, signal, postcommit):
+        slot = self.slot(signal)
+        if postcommit:
+            return "g({0}, v[{0}])".format(slot)
+        return "v[{}]".format(slot)
+
+    def _clock_domain_signal(self, node):
+        cd = self.clock_domains[node.cd]
+        if isinstance(node, ClockSignal):
+            return cd.clk
+        if cd.rst is None:
+            if node.allow_reset_less:
+                return Constant(0)
+            raise ValueError("Attempted to get reset signal of resetless"
+                             " domain '{}'".format(node.cd))
+        return cd.rst
+
+    def _uniform_choices(self, choices):
+        # Returns (kind, table, nbits, signed, start, stop) when all choices
+        # share a layout that can be dispatched through a table of slots.
+        if all(isinstance(c, Constant) for c in choices):
+            return ("const", tuple(c.value for c in choices), None, None, None, None)
+        if all(isinstance(c, Signal) for c in choices):
+            layouts = {(c.nbits, c.signed) for c in choices}
+            if len(layouts) == 1:
+                nbits, signed = layouts.pop()
+                table = tuple(self.slot(c) for c in choices)
+                return ("signal", table, nbits, signed, None, None)
+        if all(isinstance(c, _Slice) and isinstance(c.value, Signal) for c in choices):
+            layouts = {(c.value.nbits, c.value.signed, c.start, c.stop) for c in choices}
+            if len(layouts) == 1:
+                nbits, signed, start, stop = layouts.pop()
+                table = tuple(self.slot(c.value) for c in choices)
+                return ("slice", table, nbits, signed, start, stop)
+        return None
+
+    def _array_index(self, node):
+        if isinstance(node, _MemoryLocation):
+            return self.expr(node.index)
+        return "min({}, {})".format(len(node.choices) - 1, self.expr(node.key))
+
+    def _array_choices(self, node):
+        if isinstance(node, _MemoryLocation):
+            return list(self.replaced_memories[node.memory])
+        return node.choices
+
+    # expressions
+
+    def expr(self, node, postcommit=False):
+        if isinstance(node, Constant):
+            return repr(node.value)
+        elif isinstance(node, Signal):
+            return self._signal(node, postcommit)
+        elif isinstance(node, _Operator):
+            operands = [self.expr(o, postcommit) for o in node.operands]
+            if node.op == "-" and len(operands) == 1:
+                return "(-{})".format(operands[0])
+            elif node.op == "~":
+                return "(~{})".format(operands[0])
+            elif node.op == "m":
+                return "({1} if {0} else {2})".format(*operands)
+            else:
+                return "({} {} {})".format(operands[0], _binops[node.op], operands[1])
+        elif isinstance(node, _Slice):
+            v = self.expr(node.value, postcommit)
+            if node.start:
+                v = "({} >> {})".format(v, node.start)
+            return "({} & {})".format(v, _mask(node.stop - node.start))
+        elif isinstance(node, Cat):
+            shift = 0
+            terms = []
+            for element in node.l:
+                nbits = len(element)
+                if nbits:
+                    term = "({} & {})".format(self.expr(element, postcommit), _mask(nbits))
+                    if shift:
+                        term = "({} << {})".format(term, shift)
+                    terms.append(term)
+                shift += nbits
+            if not terms:
+                return "0"
+            return "({})".format(" | ".join(terms))
+        elif isinstance(node, Replicate):
+            nbits = len(node.v)
+            # replication of a masked value is a multiplication by 0b..0001..0001
+            factor = sum(1 << i*nbits for i in range(node.n))
+            return "(({} & {}) * {})".format(self.expr(node.v, postcommit), _mask(nbits), factor)
+        elif isinstance(node, (_ArrayProxy, _MemoryLocation)):
+            choices = self._array_choices(node)
+            index = self._array_index(node)
+            uniform = self._uniform_choices(choices)
+            if uniform is not None:
+                kind, table, nbits, signed, start, stop = uniform
+                if kind == "const":
+                    return "{}[{}]".format(self._table("C", table), index)
+                slot = "{}[{}]".format(self._table("S", table), index)
+                if postcommit:
+                    value = "g({0}, v[{0}])".format(slot)
+                else:
+                    value = "v[{}]".format(slot)
+                if kind == "slice":
+                    value = "(({} >> {}) & {})".format(value, start, _mask(stop - start))
+                return value
+            else:
+                lambdas = tuple("lambda v, m, g: " + self.expr(c, postcommit) for c in choices)
+                return "{}[{}](v, m, g)".format(self._table("L", lambdas), index)
+        elif isinstance(node, (ClockSignal, ResetSignal)):
+            return self.expr(self._clock_domain_signal(node), postcommit)
+        else:
+            raise NotImplementedError(node)
+
+    # assignments
+
+    def _assign_signal(self, lines, indent, slot, nbits, signed, value):
+        if signed:
+            t = self._tmp()
+            lines.append(indent + "{} = {} & {}".format(t, value, _mask(nbits)))
+            lines.append(indent + "m[{}] = {} - {} if {} & {} else {}".format(
+                slot, t, 1 << nbits, t, 1 << (nbits - 1), t))
+        else:
+            lines.append(indent + "m[{}] = {} & {}".format(slot, value, _mask(nbits)))
+
+    def _assign_slice(self, lines, indent, slot, nbits, signed, start, stop, value):
+        t = self._tmp()
+        lines.append(indent + "{} = {}".format(t, slot))
+        clear = ~(_mask(stop) ^ _mask(start))
+        full = "(g({0}, v[{0}]) & {1}) | (({2} & {3}) << {4})".format(
+            t, clear, value, _mask(stop - start), start)
+        self._assign_signal(lines, indent, t, nbits, signed, full)
+
+    def assign(self, node, value, lines, indent):
+        if isinstance(node, Signal):
+            assert not node.variable
+            self._assign_signal(lines, indent, self.slot(node), node.nbits, node.signed, value)
+        elif isinstance(node, Cat):
+            t = self._tmp()
+            lines.append(indent + "{} = {}".format(t, value))
+            shift = 0
+            for element in node.l:
+                nbits = len(element)
+                element_value = "({} >> {})".format(t, shift) if shift else t
+                self.assign(element, "({} & {})".format(element_value, _mask(nbits)), lines, indent)
+                shift += nbits
+        elif isinstance(node, _Slice):
+            if isinstance(node.value, Signal):
+                signal = node.value
+                self._assign_slice(lines, indent, self.slot(signal), signal.nbits, signal.signed,
+                    node.start, node.stop, value)
+            else:
+                full = "(({} & {}) | (({} & {}) << {}))".format(
+                    self.expr(node.value, True), ~(_mask(node.stop) ^ _mask(node.start)),
+                    value, _mask(node.stop - node.start), node.start)
+                self.assign(node.value, full, lines, indent)
+        elif isinstance(node, (_ArrayProxy, _MemoryLocation)):
+            choices = self._array_choices(node)
+            t = self._tmp()
+            lines.append(indent + "{} = {}".format(t, value))
+            i = self._tmp()
+            lines.append(indent + "{} = {}".format(i, self._array_index(node)))
+            uniform = self._uniform_choices(choices)
+            if uniform is not None and uniform[0] != "const":
+                kind, table, nbits, signed, start, stop = uniform
+                slot = "{}[{}]".format(self._table("S", table), i)
+                if kind == "signal":
+                    self._assign_signal(lines, indent, slot, nbits, signed, t)
+                else:
+                    self._assign_slice(lines, indent, slot, nbits, signed, start, stop, t)
+            else:
+                for n, choice in enumerate(choices):
+                    keyword = "if" if n == 0 else "elif"
+                    if n == len(choices) - 1 and n:
+                        lines.append(indent + "else:")
+                    else:
+                        lines.append(indent + "{} {} == {}:".format(keyword, i, n))
+                    self.assign(choice, t, lines, indent + "    ")
+        else:
+            raise NotImplementedError(node)
+
+    # statements
+
+    def statements(self, statements, lines, indent):
+        start = len(lines)
+        for s in statements:
+            if isinstance(s, _Assign):
+                self.assign(s.l, self.expr(s.r), lines, indent)
+            elif isinstance(s, If):
+                self._if(s, lines, indent, "if")
+            elif isinstance(s, Case):
+                self._case(s, lines, indent)
+            elif isinstance(s, Iterable):
+                self.statements(s, lines, indent)
+            elif isinstance(s, Display):
+                args = "".join(self.expr(arg) + ", " for arg in s.args)
+                lines.append(indent + "print({!r} % ({}))".format(s.s, args))
+            else:
+                raise NotImplementedError(s)
+        if len(lines) == start:
+            lines.append(indent + "pass")
+
+    def _if(self, s, lines, indent, keyword):
+        lines.append(indent + "{} {} & {}:".format(keyword, self.expr(s.cond), _mask(len(s.cond))))
+        self.statements(s.t, lines, indent + "    ")
+        f = s.f
+        while len(f) == 1 and isinstance(f[0], Iterable) \
+                and not isinstance(f[0], _Value):
+            f = list(f[0])
+        if len(f) == 1 and isinstance(f[0], If):
+            # flatten Elif chains to keep the indentation level constant
+            self._if(f[0], lines, indent, "elif")
+        elif f:
+            lines.append(indent + "else:")
+            self.statements(f, lines, indent + "    ")
+
+    def _case(self, s, lines, indent):
+        nbits, signed = value_bits_sign(s.test)
+        t = self._tmp()
+        lines.append(indent + "{} = {} & {}".format(t, self.expr(s.test), _mask(nbits)))
+        if signed:
+            lines.append(indent + "if {} & {}: {} -= {}".format(t, 1 << (nbits - 1), t, 1 << nbits))
+        keyword = "if"
+        for k, v in s.cases.items():
+            if isinstance(k, Constant):
+                lines.append(indent + "{} {} == {!r}:".format(keyword, t, k.value))
+                self.statements(v, lines, indent + "    ")
+                keyword = "elif"
+        if "default" in s.cases:
+            if keyword == "if":
+                self.statements(s.cases["default"], lines, indent)
+            else:
+                lines.append(indent + "else:")
+                self.statements(s.cases["default"], lines, indent + "    ")
+
+    # code generation
+
+    def compile(self, statements, values, modifications, name="f"):
+        return self.compile_many([(name, statements)], values, modifications)[0]
+
+    def compile_many(self, functions, values, modifications):
+        # all functions are generated in a single module to share tables and
+        # the (costly) exec
+        source = []
+        for name, statements in functions:
+            source += ["def {}():".format(name),
+                       "    v = _v",
+                       "    m = _m",
+                       "    g = m.get"]
+            self.statements(statements, source, "    ")
+        header = []
+        for (prefix, content), table in self.tables.items():
+            if prefix == "L":
+                header.append("{} = ({},)".format(table, ", ".join(content)))
+            else:
+                header.append("{} = {!r}".format(table, content))
+        source = "\n".join(header + source) + "\n"
+        namespace = {"_v": values, "_m": modifications}
+        filename = "<litex.gen.sim:{}>".format(functions[0][0] if functions else "")
+        exec(compile(source, filename, "exec"), namespace)
+        return [namespace[name] for name, _ in functions]
@@ -7,8 +7,11 @@
 
 # License: BSD
 
+import heapq
 import operator
+from math import gcd
 import collections
+import collections.abc
 import inspect
 from functools import wraps
 
@@ -19,12 +22,14 @@ from migen.fhdl.structure import (_Value, _Statement,
 from migen.fhdl.bitcontainer import value_bits_sign
 from migen.fhdl.tools import (list_targets, list_signals,
                               insert_resets, lower_specials)
+from migen.fhdl.visit import NodeVisitor
 from migen.fhdl.simplify import MemoryToArray
 from migen.fhdl.specials import _MemoryLocation
 from migen.fhdl.module import Module
 from migen.genlib.resetsync import AsyncResetSynchronizer
 
 from litex.gen.sim.vcd import VCDWriter, DummyVCDWriter
+from litex.gen.sim.compiler import StatementCompiler
 
 
 class ClockState:
@@ -35,7 +40,14 @@ class ClockState:
 
 
 class TimeManager:
-    def __init__(self, description):
+    """Clock edges scheduler
+
+    When the hyperperiod of the clocks (least common multiple of their periods)
+    contains at most `max_schedule` transitions, the sequence of edges is
+    precomputed once and replayed; otherwise (irrational-like ratios) edges are
+    generated from a heap of next transition times.
+    """
+    def __init__(self, description, max_schedule=4096):
         self.clocks = collections.OrderedDict()
 
         for k, period_phase in description.items():
@@ -52,21 +64,76 @@ class TimeManager:
                 high = False
             self.clocks[k] = ClockState(high, half_period, half_period - phase)
 
+        self.names = list(self.clocks.keys())
+        self.schedule = self._hyperperiod_schedule(max_schedule)
+        self.position = 0
+        if self.schedule is None:
+            self.time = 0
+            self.high = [cs.high for cs in self.clocks.values()]
+            self.heap = [(cs.time_before_trans, i)
+                         for i, cs in enumerate(self.clocks.values())]
+            heapq.heapify(self.heap)
+
+    def _hyperperiod_schedule(self, max_schedule):
+        clocks = list(self.clocks.values())
+        hyperperiod = 1
+        for cs in clocks:
+            period = 2*cs.half_period
+            hyperperiod = hyperperiod*period//gcd(hyperperiod, period)
+        if sum(hyperperiod//cs.half_period for cs in clocks) > max_schedule:
+            return None
+        high = [cs.high for cs in clocks]
+        time_before_trans = [cs.time_before_trans for cs in clocks]
+        schedule = []
+        t = 0
+        while t < hyperperiod:
+            rising = []
+            falling = []
+            dt = min(time_before_trans)
+            for i, cs in enumerate(clocks):
+                if time_before_trans[i] == dt:
+                    high[i] = not high[i]
+                    if high[i]:
+                        rising.append(i)
+                    else:
+                        falling.append(i)
+                time_before_trans[i] -= dt
+                if not time_before_trans[i]:
+                    time_before_trans[i] += cs.half_period
+            schedule.append((dt, tuple(rising), tuple(falling)))
+            t += dt
+        return schedule
+
+    def tick_indexes(self):
+        """Advance to the next edge(s), return (dt, rising, falling) clock indexes"""
+        if self.schedule is not None:
+            r = self.schedule[self.position]
+            self.position += 1
+            if self.position == len(self.schedule):
+                self.position = 0
+            return r
+        heap = self.heap
+        t = heap[0][0]
+        rising = []
+        falling = []
+        while heap and heap[0][0] == t:
+            _, i = heapq.heappop(heap)
+            self.high[i] = not self.high[i]
+            if self.high[i]:
+                rising.append(i)
+            else:
+                falling.append(i)
+        for i in rising + falling:
+            heapq.heappush(heap, (t + self.clocks[self.names[i]].half_period, i))
+        dt = t - self.time
+        self.time = t
+        return dt, sorted(rising), sorted(falling)
+
     def tick(self):
-        rising = set()
-        falling = set()
-        dt = min(cs.time_before_trans for cs in self.clocks.values())
-        for k, cs in self.clocks.items():
-            if cs.time_before_trans == dt:
-                cs.high = not cs.high
-                if cs.high:
-                    rising.add(k)
-                else:
-                    falling.add(k)
-            cs.time_before_trans -= dt
-            if not cs.time_before_trans:
-                cs.time_before_trans += cs.half_period
-        return dt, rising, falling
+        dt, rising, falling = self.tick_indexes()
+        return (dt,
+                {self.names[i] for i in rising},
+                {self.names[i] for i in falling})
 
 
 str2op = {
@@ -92,18 +159,96 @@ str2op = {
 
 
 def _truncate(value, nbits, signed):
-    value = value & (2**nbits - 1)
-    if signed and (value & 2**(nbits - 1)):
-        value -= 2**nbits
+    value = value & ((1 << nbits) - 1)
+    if signed and (value & (1 << (nbits - 1))):
+        value -= 1 << nbits
     return value
 
 
+def _node_constants(node):
+    # shift/mask constants of a node, computed once per node of the fragment
+    if isinstance(node, _Slice):
+        width = node.stop - node.start
+        # (start, mask, clear mask for slice assignments)
+        return (node.start, (1 << width) - 1,
+                ~(((1 << node.stop) - 1) ^ ((1 << node.start) - 1)))
+    elif isinstance(node, Cat):
+        r = []
+        shift = 0
+        for element in node.l:
+            nbits = len(element)
+            r.append((element, shift, (1 << nbits) - 1))
+            shift += nbits
+        return tuple(r)
+    elif isinstance(node, Replicate):
+        nbits = len(node.v)
+        # replication of a masked value is a multiplication by 0b..0001..0001
+        return (1 << nbits) - 1, sum(1 << i*nbits for i in range(node.n))
+    elif isinstance(node, If):
+        return (1 << len(node.cond)) - 1
+    elif isinstance(node, Case):
+        nbits, signed = value_bits_sign(node.test)
+        cases = dict()
+        for k, v in node.cases.items():
+            # first matching case wins
+            if isinstance(k, Constant) and k.value not in cases:
+                cases[k.value] = v
+        return nbits, signed, cases, node.cases.get("default")
+    else:
+        return None
+
+
+class _ConstantsCollector(NodeVisitor):
+    def __init__(self, constants):
+        self.constants = constants
+
+    def _add(self, node):
+        self.constants[id(node)] = (node, _node_constants(node))
+
+    def visit_Slice(self, node):
+        self._add(node)
+        NodeVisitor.visit_Slice(self, node)
+
+    def visit_Cat(self, node):
+        self._add(node)
+        NodeVisitor.visit_Cat(self, node)
+
+    def visit_Replicate(self, node):
+        self._add(node)
+        NodeVisitor.visit_Replicate(self, node)
+
+    def visit_If(self, node):
+        self._add(node)
+        NodeVisitor.visit_If(self, node)
+
+    def visit_Case(self, node):
+        self._add(node)
+        NodeVisitor.visit_Case(self, node)
+
+
 class Evaluator:
     def __init__(self, clock_domains, replaced_memories):
         self.clock_domains = clock_domains
         self.replaced_memories = replaced_memories
         self.signal_values = dict()
         self.modifications = dict()
+        # id(node) -> (node, constants), nodes are kept alive so that ids
+        # can not be reused.
+        self.node_constants = dict()
+
+    def prepare(self, statements):
+        """Precompute shift/mask constants of the nodes of `statements`"""
+        _ConstantsCollector(self.node_constants).visit(statements)
+
+    def _constants(self, node):
+        try:
+            cached, constants = self.node_constants[id(node)]
+            if cached is node:
+                return constants
+        except KeyError:
+            pass
+        # node built on the fly (generators), not cached
+        return _node_constants(node)
 
     def commit(self):
         r = set()
@@ -139,22 +284,17 @@ class Evaluator:
             else:
                 return str2op[node.op](*operands)
         elif isinstance(node, _Slice):
-            v = self.eval(node.value, postcommit)
-            idx = range(node.start, node.stop)
-            return sum(((v >> i) & 1) << j for j, i in enumerate(idx))
+            start, mask, _ = self._constants(node)
+            return (self.eval(node.value, postcommit) >> start) & mask
         elif isinstance(node, Cat):
-            shift = 0
             r = 0
-            for element in node.l:
-                nbits = len(element)
+            for element, shift, mask in self._constants(node):
                 # make value always positive
-                r |= (self.eval(element, postcommit) & (2**nbits-1)) << shift
-                shift += nbits
+                r |= (self.eval(element, postcommit) & mask) << shift
             return r
         elif isinstance(node, Replicate):
-            nbits = len(node.v)
-            v = self.eval(node.v, postcommit) & (2**nbits - 1)
-            return sum(v << i*nbits for i in range(node.n))
+            mask, factor = self._constants(node)
+            return (self.eval(node.v, postcommit) & mask)*factor
         elif isinstance(node, _ArrayProxy):
             idx = min(len(node.choices) - 1, self.eval(node.key, postcommit))
             return self.eval(node.choices[idx], postcommit)
@@ -182,17 +322,13 @@ class Evaluator:
             self.modifications[node] = _truncate(value,
                                                  node.nbits, node.signed)
         elif isinstance(node, Cat):
-            for element in node.l:
-                nbits = len(element)
-                self.assign(element, value & (2**nbits-1))
-                value >>= nbits
+            for element, shift, mask in self._constants(node):
+                self.assign(element, (value >> shift) & mask)
         elif isinstance(node, _Slice):
+            start, mask, clear = self._constants(node)
             full_value = self.eval(node.value, True)
-            # clear bits assigned to by the slice
-            full_value &= ~((2**node.stop-1) - (2**node.start-1))
-            # set them to the new value
-            value &= 2**(node.stop - node.start)-1
-            full_value |= value << node.start
+            # clear bits assigned to by the slice and set them to the new value
+            full_value = (full_value & clear) | ((value & mask) << start)
             self.assign(node.value, full_value)
         elif isinstance(node, _ArrayProxy):
             idx = min(len(node.choices) - 1, self.eval(node.key))
@@ -203,27 +339,28 @@ class Evaluator:
         else:
             raise NotImplementedError(node)
 
+    def compile(self, statements, name="f"):
+        return lambda: self.execute(statements)
+
+    def compile_many(self, functions):
+        return [self.compile(statements, name) for name, statements in functions]
+
     def execute(self, statements):
         for s in statements:
             if isinstance(s, _Assign):
                 self.assign(s.l, self.eval(s.r))
             elif isinstance(s, If):
-                if self.eval(s.cond) & (2**len(s.cond) - 1):
+                if self.eval(s.cond) & self._constants(s):
                     self.execute(s.t)
                 else:
                     self.execute(s.f)
             elif isinstance(s, Case):
-                nbits, signed = value_bits_sign(s.test)
+                nbits, signed, cases, default = self._constants(s)
                 test = _truncate(self.eval(s.test), nbits, signed)
-                found = False
-                for k, v in s.cases.items():
-                    if isinstance(k, Constant) and k.value == test:
-                        self.execute(v)
-                        found = True
-                        break
-                if not found and "default" in s.cases:
-                    self.execute(s.cases["default"])
-            elif isinstance(s, collections.Iterable):
+                statements = cases.get(test, default)
+                if statements is not None:
+                    self.execute(statements)
+            elif isinstance(s, collections.abc.Iterable):
                 self.execute(s)
             elif isinstance(s, Display):
                 args = []
@@ -238,6 +375,227 @@ class Evaluator:
                 raise NotImplementedError
 
 
+class _SlotValues(collections.abc.Mapping):
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+
+    def __getitem__(self, signal):
+        return self.evaluator.values[self.evaluator.slots[signal]]
+
+    def __iter__(self):
+        return iter(self.evaluator.slots)
+
+    def __len__(self):
+        return len(self.evaluator.slots)
+
+
+class CompiledEvaluator(Evaluator):
+    """Evaluator storing signal values in a flat slot-indexed list
+
+    Statement lists are translated once to Python functions by `compile`,
+    generators requests are still interpreted (on the same storage).
+    """
+    def __init__(self, clock_domains, replaced_memories):
+        Evaluator.__init__(self, clock_domains, replaced_memories)
+        self.slots = dict()
+        self.signals = []
+        self.values = []
+        self.signal_values = _SlotValues(self)
+
+    def slot(self, signal):
+        try:
+            return self.slots[signal]
+        except KeyError:
+            slot = len(self.signals)
+            self.slots[signal] = slot
+            self.signals.append(signal)
+            self.values.append(signal.reset.value)
+            return slot
+
+    def compile(self, statements, name="f"):
+        return self.compile_many([(name, statements)])[0]
+
+    def compile_many(self, functions):
+        compiler = StatementCompiler(self.slot, self.clock_domains,
+                                     self.replaced_memories)
+        try:
+            return compiler.compile_many(functions, self.values,
+                                         self.modifications)
+        except (SyntaxError, RecursionError, MemoryError):
+            if len(functions) > 1:
+                return sum((self.compile_many([f]) for f in functions), [])
+            # too deeply nested for the Python compiler, interpret instead
+            return Evaluator.compile_many(self, functions)
+
+    def commit(self):
+        values = self.values
+        signals = self.signals
+        r = set()
+        for k, v in self.modifications.items():
+            if values[k] != v:
+                values[k] = v
+                r.add(signals[k])
+        self.modifications.clear()
+        return r
+
+    def eval(self, node, postcommit=False):
+        if isinstance(node, Signal):
+            slot = self.slot(node)
+            if postcommit:
+                try:
+                    return self.modifications[slot]
+                except KeyError:
+                    pass
+            return self.values[slot]
+        return Evaluator.eval(self, node, postcommit)
+
+    def assign(self, node, value):
+        if isinstance(node, Signal):
+            assert not node.variable
+            self.modifications[self.slot(node)] = _truncate(value,
+                                                            node.nbits, node.signed)
+        else:
+            Evaluator.assign(self, node, value)
+
+
+class _InputLister(NodeVisitor):
+    def __init__(self, clock_domains, replaced_memories):
+        self.clock_domains = clock_domains
+        self.replaced_memories = replaced_memories
+        self.output_list = set()
+        self.display = False
+
+    def visit_Signal(self, node):
+        self.output_list.add(node)
+
+    def visit_ClockSignal(self, node):
+        self.output_list.add(self.clock_domains[node.cd].clk)
+
+    def visit_ResetSignal(self, node):
+        rst = self.clock_domains[node.cd].rst
+        if rst is not None:
+            self.output_list.add(rst)
+
+    def visit_Assign(self, node):
+        self.visit_lvalue(node.l)
+        self.visit(node.r)
+
+    def visit_lvalue(self, node):
+        # assigned signals are not inputs, but array/memory indexes are
+        if isinstance(node, Cat):
+            for element in node.l:
+                self.visit_lvalue(element)
+        elif isinstance(node, _Slice):
+            self.visit_lvalue(node.value)
+        elif isinstance(node, _ArrayProxy):
+            self.visit(node.key)
+            for choice in node.choices:
+                self.visit_lvalue(choice)
+        elif isinstance(node, _MemoryLocation):
+            self.visit(node.index)
+
+    def visit_unknown(self, node):
+        if isinstance(node, _MemoryLocation):
+            self.output_list |= set(self.replaced_memories[node.memory])
+            self.visit(node.index)
+        elif isinstance(node, Display):
+            self.display = True
+            for arg in node.args:
+                self.visit(arg)
+
+
+def _comb_processes(statements, clock_domains, replaced_memories):
+    """Split comb statements in processes and sort them topologically
+
+    Statements assigning a common signal are grouped (in their original order)
+    in a process, so that a process can be re-evaluated alone when one of its
+    inputs changes. Processes are returned with their inputs, in topological
+    order of the (writer -> reader) graph; processes of a combinatorial loop
+    are kept together.
+    """
+    # group statements assigning common targets (union-find)
+    parent = list(range(len(statements)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    owner = dict()
+    for i, statement in enumerate(statements):
+        for target in list_targets([statement]):
+            if target in owner:
+                parent[find(i)] = find(owner[target])
+            else:
+                owner[target] = i
+    groups = collections.OrderedDict()
+    for i, statement in enumerate(statements):
+        groups.setdefault(find(i), []).append(statement)
+    groups = list(groups.values())
+
+    inputs  = []
+    writers = dict()
+    for n, group in enumerate(groups):
+        lister = _InputLister(clock_domains, replaced_memories)
+        lister.visit(group)
+        inputs.append(lister.output_list)
+        for target in list_targets(group):
+            writers[target] = n
+
+    # writer -> readers graph
+    successors = [set() for group in groups]
+    for n, group_inputs in enumerate(inputs):
+        for signal in group_inputs:
+            try:
+                successors[writers[signal]].add(n)
+            except KeyError:
+                pass
+
+    # strongly connected components (iterative Tarjan), emitted in reverse
+    # topological order
+    index    = [None]*len(groups)
+    lowlink  = [0]*len(groups)
+    on_stack = [False]*len(groups)
+    stack    = []
+    order    = []
+    counter  = 0
+    for root in range(len(groups)):
+        if index[root] is not None:
+            continue
+        work = [(root, iter(sorted(successors[root])))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, it = work[-1]
+            for succ in it:
+                if index[succ] is None:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack[succ] = True
+                    work.append((succ, iter(sorted(successors[succ]))))
+                    break
+                elif on_stack[succ]:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent_node = work[-1][0]
+                    lowlink[parent_node] = min(lowlink[parent_node], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    order.append(sorted(component))
+    order.reverse()
+    return [(groups[n], inputs[n]) for component in order for n in component]
+
+
 class DummyAsyncResetSynchronizerImpl(Module):
     def __init__(self, cd, async_reset):
         # TODO: asynchronous set
@@ -255,7 +613,8 @@ class DummyAsyncResetSynchronizer:
 # TODO: instances via Iverilog/VPI
 class Simulator:
     def __init__(self, fragment_or_module, generators, clocks={"sys": 10}, vcd_name=None,
-                 special_overrides={}):
+                 special_overrides={}, compiled=False, event_driven=True, quiescent=True,
+                 trace_filter=None, trace_start=0, trace_end=-1):
         if isinstance(fragment_or_module, _Fragment):
             self.fragment = fragment_or_module
         else:
@@ -264,6 +623,12 @@ class Simulator:
         mta = MemoryToArray()
         mta.transform_fragment(None, self.fragment)
 
+        # specials providing a sim_generator() are simulated natively by a
+        # passive generator of their clock domain (ex: sparse memories)
+        native_specials = [s for s in self.fragment.specials
+                           if hasattr(s, "sim_generator")]
+        self.fragment.specials -= set(native_specials)
+
         overrides = {AsyncResetSynchronizer: DummyAsyncResetSynchronizer}
         overrides.update(special_overrides)
         f, lowered = lower_specials(overrides, self.fragment)
@@ -275,11 +640,14 @@ class Simulator:
         self.generators = dict()
         self.passive_generators = set()
         for k, v in generators.items():
-            if (isinstance(v, collections.Iterable)
+            if (isinstance(v, collections.abc.Iterable)
                     and not inspect.isgenerator(v)):
                 self.generators[k] = list(v)
             else:
                 self.generators[k] = [v]
+        for special in native_specials:
+            self.generators.setdefault(special.clock.cd, []).append(
+                special.sim_generator())
 
         clocks = collections.OrderedDict(sorted(clocks.items(),
                                                 key=operator.itemgetter(0)))
@@ -294,13 +662,86 @@ class Simulator:
         # comb signals return to their reset value if nothing assigns them
         self.fragment.comb[0:0] = [s.eq(s.reset)
                                    for s in list_targets(self.fragment.comb)]
-        self.evaluator = Evaluator(self.fragment.clock_domains,
+        if compiled:
+            evaluator = CompiledEvaluator
+        else:
+            evaluator = Evaluator
+        self.evaluator = evaluator(self.fragment.clock_domains,
                                    mta.replacements)
+        self.evaluator.prepare([self.fragment.comb, self.fragment.sync])
+
+        # comb processes and sensitivity graph
+        self.event_driven = event_driven
+        if event_driven:
+            processes = _comb_processes(self.fragment.comb,
+                                        self.fragment.clock_domains,
+                                        mta.replacements)
+        else:
+            processes = [(self.fragment.comb, set())]
+        self.comb_processes = self.evaluator.compile_many(
+            [("comb{}".format(n), statements)
+             for n, (statements, inputs) in enumerate(processes)])
+        self.comb_sizes = [len(statements) for statements, inputs in processes]
+        self.comb_readers = dict()
+        self.comb_writers = dict()
+        for n, (statements, inputs) in enumerate(processes):
+            for signal in inputs:
+                self.comb_readers.setdefault(signal, []).append(n)
+            for signal in list_targets(statements):
+                self.comb_writers[signal] = [n]
+        self.comb_queued = [False]*len(processes)
+        self.comb_worklist = []
+
+        # statistics
+        self.cycles = 0
+        self.comb_statements = 0
+
+        sync = list(self.fragment.sync.items())
+        self.execute_sync = dict(zip(
+            [cd for cd, statements in sync],
+            self.evaluator.compile_many([("sync_" + cd, statements)
+                                         for cd, statements in sync])))
+
+        # clock domains indexed as in the TimeManager
+        names = self.time.names
+        self.domain_clk = [self.fragment.clock_domains[cd].clk for cd in names]
+        self.domain_sync = [self.execute_sync.get(cd) for cd in names]
+        self.domain_generators = [cd if cd in self.generators else None
+                                  for cd in names]
+
+        # quiescent domains: the sync block of a domain is skipped when none
+        # of its inputs and targets changed since its last edge (its result
+        # would be identical to the already committed one).
+        self.sync_dirty = [True]*len(names)
+        self.sync_watchers = dict()
+        self.sync_skipped = 0
+        if quiescent:
+            for i, cd in enumerate(names):
+                if cd not in self.fragment.sync:
+                    continue
+                statements = self.fragment.sync[cd]
+                lister = _InputLister(self.fragment.clock_domains,
+                                      mta.replacements)
+                lister.visit(statements)
+                if lister.display:
+                    # Display statements are side effects of every edge
+                    continue
+                for signal in lister.output_list | list_targets(statements):
+                    self.sync_watchers.setdefault(signal, []).append(i)
+                self.sync_dirty[i] = False
+            self.quiescent_domains = [not dirty for dirty in self.sync_dirty]
+            self.sync_dirty = [True]*len(names)
+        else:
+            self.quiescent_domains = [False]*len(names)
 
+        self.vcd_name = vcd_name
         if vcd_name is None:
             self.vcd = DummyVCDWriter()
         else:
-            self.vcd = VCDWriter(vcd_name)
+            self.vcd = VCDWriter(vcd_name,
+                signals_filter = trace_filter,
+                trace_start    = trace_start,
+                trace_end      = trace_end)
 
             signals = list_signals(self.fragment)
             for cd in self.fragment.clock_domains:
@@ -310,8 +751,6 @@ class Simulator:
             for memory_array in mta.replacements.values():
                 signals |= set(memory_array)
             self.vcd.init(signals)
-            for signal in sorted(signals, key=lambda x: x.duid):
-                self.vcd.set(signal, signal.reset.value)
 
     def __enter__(self):
         return self
@@ -322,17 +761,61 @@ class Simulator:
     def close(self):
         self.vcd.close()
 
+    def comb_statements_per_cycle(self):
+        return self.comb_statements/max(self.cycles, 1)
+
+    def _execute_comb(self):
+        for process in self.comb_processes:
+            process()
+        self.comb_statements += len(self.fragment.comb)
+
+    def _schedule(self, modified, readers):
+        queued   = self.comb_queued
+        worklist = self.comb_worklist
+        for signal in modified:
+            for n in readers.get(signal, ()):
+                if not queued[n]:
+                    queued[n] = True
+                    heapq.heappush(worklist, n)
+
     def _commit_and_comb_propagate(self):
-        # TODO: optimize
-        all_modified = set()
-        modified = self.evaluator.commit()
-        all_modified |= modified
-        while modified:
-            self.evaluator.execute(self.fragment.comb)
-            modified = self.evaluator.commit()
-            all_modified |= modified
-        for signal in all_modified:
-            self.vcd.set(signal, self.evaluator.signal_values[signal])
+        all_modified = self.evaluator.commit()
+        if self.event_driven:
+            # only re-evaluate processes reading a modified signal, in
+            # topological order
+            processes = self.comb_processes
+            sizes     = self.comb_sizes
+            queued    = self.comb_queued
+            worklist  = self.comb_worklist
+            # comb targets modified by sync statements or generators get
+            # their comb value back
+            self._schedule(all_modified, self.comb_writers)
+            self._schedule(all_modified, self.comb_readers)
+            while worklist:
+                n = heapq.heappop(worklist)
+                queued[n] = False
+                processes[n]()
+                self.comb_statements += sizes[n]
+                modified = self.evaluator.commit()
+                if modified:
+                    all_modified |= modified
+                    self._schedule(modified, self.comb_readers)
+        else:
+            modified = all_modified
+            while modified:
+                self._execute_comb()
+                modified = self.evaluator.commit()
+                all_modified |= modified
+        watchers = self.sync_watchers
+        if watchers:
+            dirty = self.sync_dirty
+            for signal in all_modified:
+                for i in watchers.get(signal, ()):
+                    dirty[i] = True
+        if self.vcd_name is not None:
+            signal_values = self.evaluator.signal_values
+            for signal in all_modified:
+                self.vcd.set(signal, signal_values[signal])
 
     def _evalexec_nested_lists(self, x):
         if isinstance(x, list):
@@ -371,26 +854,40 @@ class Simulator:
             self.generators[cd].remove(generator)
 
     def _continue_simulation(self):
+        passive_generators = self.passive_generators
         for cd_generators in self.generators.values():
-            if set(cd_generators) - self.passive_generators:
-                return True
+            for generator in cd_generators:
+                if generator not in passive_generators:
+                    return True
         return False
 
     def run(self):
-        self.evaluator.execute(self.fragment.comb)
+        self._execute_comb()
         self._commit_and_comb_propagate()
 
+        tick = self.time.tick_indexes
+        assign = self.evaluator.assign
+        clk = self.domain_clk
+        sync = self.domain_sync
+        generators = self.domain_generators
+        quiescent = self.quiescent_domains
+        dirty = self.sync_dirty
         while True:
-            dt, rising, falling = self.time.tick()
+            dt, rising, falling = tick()
             self.vcd.delay(dt)
-            for cd in rising:
-                self.evaluator.assign(self.fragment.clock_domains[cd].clk, 1)
-                if cd in self.fragment.sync:
-                    self.evaluator.execute(self.fragment.sync[cd])
-                if cd in self.generators:
-                    self._process_generators(cd)
-            for cd in falling:
-                self.evaluator.assign(self.fragment.clock_domains[cd].clk, 0)
+            self.cycles += len(rising)
+            for i in rising:
+                assign(clk[i], 1)
+                if sync[i] is not None:
+                    if dirty[i] or not quiescent[i]:
+                        dirty[i] = False
+                        sync[i]()
+                    else:
+                        self.sync_skipped += 1
+                if generators[i] is not None:
+                    self._process_generators(generators[i])
+            for i in falling:
+                assign(clk[i], 0)
             self._commit_and_comb_propagate()
 
             if not self._continue_simulation():
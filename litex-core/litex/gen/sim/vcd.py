@@ -5,10 +5,16 @@
 
 
 from itertools import count
-import tempfile
 import os
-from collections import OrderedDict
+import re
+import bz2
+import gzip
+import lzma
+import fnmatch
 import shutil
+import subprocess
+import tempfile
+import warnings
 
 from migen.fhdl.namer import build_namespace
 
@@ -24,85 +30,174 @@ def vcd_codes():
         yield code
 
 
+def _compile_filter(signals_filter):
+    # glob patterns (strings, matching the whole name) and/or compiled regular
+    # expressions (searched in the name)
+    if signals_filter is None:
+        return None
+    if isinstance(signals_filter, (str, type(re.compile("")))):
+        signals_filter = [signals_filter]
+    matchers = []
+    for f in signals_filter:
+        if isinstance(f, str):
+            matchers.append(re.compile(fnmatch.translate(f)).match)
+        else:
+            matchers.append(f.search)
+    return lambda name: any(m(name) for m in matchers)
+
+
+_compressors = {
+    ".gz":  gzip.open,
+    ".bz2": bz2.open,
+    ".xz":  lzma.open,
+}
+
+
 class VCDWriter:
-    def __init__(self, filename):
+    """Value Change Dump writer
+
+    The header is written once by `init` with the (filtered) signals, value
+    changes are buffered and written in batches. Signals unknown at `init`
+    are not traced.
+
+    signals_filter: glob pattern(s) and/or compiled regular expression(s)
+    matched against the signal names, only matching signals are traced.
+
+    trace_start/trace_end: simulation time window to trace (trace_end=-1 for
+    the end of the simulation), the values of all the traced signals are
+    dumped when entering the window.
+
+    filename: ".gz", ".bz2" or ".xz" extensions enable compression, ".fst"
+    writes a VCD converted to FST by GTKWave's vcd2fst on close.
+    """
+    def __init__(self, filename, signals_filter=None, trace_start=0, trace_end=-1,
+                 buffer_size=8192):
         self.filename = filename
-        self.out_file = None
-        self.buffer_file = tempfile.TemporaryFile(
-            dir=os.path.dirname(filename), mode="w+")
-        self.initialized = False
-        self.codegen = vcd_codes()
-        self.codes = OrderedDict()
+        self.filter = _compile_filter(signals_filter)
+        self.trace_start = trace_start
+        self.trace_end = trace_end
+        self.buffer_size = buffer_size
+
+        self.codes = dict()
         self.signal_values = dict()
+        self.buffer = []
+        self.out_file = None
         self.t = 0
-
-    def _write_value(self, signal, value):
-        l = len(signal)
+        self.t_written = None
+        self.tracing = trace_start <= 0 and trace_end != 0
+        self.done = False
+
+    def _open(self):
+        base, ext = os.path.splitext(self.filename)
+        if ext == ".fst":
+            fd, self.vcd_filename = tempfile.mkstemp(suffix=".vcd",
+                dir=os.path.dirname(os.path.abspath(self.filename)))
+            return os.fdopen(fd, "w")
+        self.vcd_filename = self.filename
+        if ext in _compressors:
+            return _compressors[ext](self.filename, "wt")
+        return open(self.filename, "w", buffering=2**20)
+
+    def _format(self, signal, value):
+        code, nbits = self.codes[signal]
         if value < 0:
-            value += 2**l
-        if l > 1:
-            fmtstr = "b{:0" + str(l) + "b} {}\n"
-        else:
-            fmtstr = "{}{}\n"
-        try:
-            code = self.codes[signal]
-        except KeyError:
-            code = next(self.codegen)
-            self.codes[signal] = code
-            self.init(self.codes.keys())
+            value += 1 << nbits
+        if nbits > 1:
+            return "b{:b} {}\n".format(value, code)
+        return "{}{}\n".format(value, code)
 
-        return fmtstr.format(value, code)
-
-    def _write(self, s):
-        self.out_file.write(s)
-        self.buffer_file.write(s)
+    def _flush(self):
+        if self.buffer:
+            self.out_file.write("".join(self.buffer))
+            self.buffer.clear()
 
     def init(self, signals):
-        self.out_file = open(self.filename, "w")
-
-        # generate codes
-        for signal in signals:
-            try:
-                code = self.codes[signal]
-            except KeyError:
-                code = next(self.codegen)
-                self.codes[signal] = code
-
-        # write vcd header
-        header = ""
-        ns = build_namespace(self.codes.keys())
-        for signal, code in self.codes.items():
-            name = ns.get_name(signal)
-            header += "$var wire {len} {code} {name} $end\n".format(name=name, code=code, len=len(signal))
-        header += "$dumpvars\n"
-        for signal in self.codes.keys():
-            header += self._write_value(signal, signal.reset.value)
-        header += "$end\n"
-        self.out_file.write(header)
-
-        if self.initialized:
-            self.buffer_file.seek(0)
-            shutil.copyfileobj(self.buffer_file, self.out_file)
-            self.buffer_file.seek(0, 2)
-        else:
-            # init time
-            self._write("#0\n")
+        self.out_file = self._open()
 
-        self.initialized = True
+        # generate codes and write vcd header (once)
+        ns = build_namespace(signals)
+        codegen = vcd_codes()
+        header = []
+        for signal in sorted(signals, key=lambda x: x.duid):
+            name = ns.get_name(signal)
+            if self.filter is None or self.filter(name):
+                code = next(codegen)
+                self.codes[signal] = (code, len(signal))
+                self.signal_values[signal] = signal.reset.value
+                header.append("$var wire {len} {code} {name} $end\n".format(
+                    name=name, code=code, len=len(signal)))
+        header.append("$enddefinitions $end\n")
+        self.out_file.write("".join(header))
+        if self.tracing:
+            self._dumpvars()
+
+    def _dumpvars(self):
+        self.buffer.append("#{}\n$dumpvars\n".format(self.t))
+        for signal, value in self.signal_values.items():
+            self.buffer.append(self._format(signal, value))
+        self.buffer.append("$end\n")
+        self.t_written = self.t
 
     def set(self, signal, value):
-        if (signal not in self.signal_values
-                or self.signal_values[signal] != value):
-            self._write(self._write_value(signal, value))
-            self.signal_values[signal] = value
+        try:
+            if self.signal_values[signal] == value:
+                return
+        except KeyError:
+            # filtered out or unknown signal
+            return
+        self.signal_values[signal] = value
+        if self.tracing:
+            if self.t_written != self.t:
+                self.buffer.append("#{}\n".format(self.t))
+                self.t_written = self.t
+            self.buffer.append(self._format(signal, value))
+            if len(self.buffer) >= self.buffer_size:
+                self._flush()
 
     def delay(self, delay):
         self.t += delay
-        self._write("#{}\n".format(self.t))
+        if self.done:
+            return
+        if self.tracing:
+            if self.trace_end >= 0 and self.t > self.trace_end:
+                self.tracing = False
+                self.done = True
+                if self.t_written != self.trace_end:
+                    self.buffer.append("#{}\n".format(self.trace_end))
+                self._flush()
+        elif self.t >= self.trace_start:
+            if self.trace_end < 0 or self.t <= self.trace_end:
+                self.tracing = True
+                self._dumpvars()
+            else:
+                # the delay jumped past the whole window
+                self.done = True
 
     def close(self):
+        if self.out_file is None:
+            return
+        if self.tracing and self.t_written != self.t:
+            self.buffer.append("#{}\n".format(self.t))
+        self._flush()
         self.out_file.close()
-        self.buffer_file.close()
+        self.out_file = None
+        if self.vcd_filename != self.filename:
+            self._convert_fst()
+
+    def _convert_fst(self):
+        # the simulation is done: keep the VCD rather than failing when it can't be converted
+        vcd_filename = os.path.splitext(self.filename)[0] + ".vcd"
+        if shutil.which("vcd2fst") is None:
+            os.replace(self.vcd_filename, vcd_filename)
+            warnings.warn("vcd2fst (GTKWave) not found, VCD kept as {}".format(vcd_filename))
+            return
+        try:
+            subprocess.check_call(["vcd2fst", self.vcd_filename, self.filename])
+        except (OSError, subprocess.CalledProcessError) as e:
+            os.replace(self.vcd_filename, vcd_filename)
+            warnings.warn("vcd2fst failed ({}), VCD kept as {}".format(e, vcd_filename))
+        else:
+            os.remove(self.vcd_filename)
 
 
 class DummyVCDWriter:
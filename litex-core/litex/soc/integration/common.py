@@ -2,9 +2,11 @@
 # License: BSD
 
 import os
+import sys
 import math
 import json
 import time
+import array
 import struct
 import datetime
 
@@ -16,19 +18,20 @@ def get_version(with_time=True):
     fmt = "%Y-%m-%d %H:%M:%S" if with_time else "%Y-%m-%d"
     return datetime.datetime.fromtimestamp(time.time()).strftime(fmt)
 
-def get_mem_data(filename_or_regions, endianness="big", mem_size=None):
-    # create memory regions
+def get_mem_regions(filename_or_regions):
     if isinstance(filename_or_regions, dict):
-        regions = filename_or_regions
-    else:
-        filename = filename_or_regions
-        _, ext = os.path.splitext(filename)
-        if ext == ".json":
-            f = open(filename, "r")
-            regions = json.load(f)
-            f.close()
-        else:
-            regions = {filename: "0x00000000"}
+        return filename_or_regions
+    filename = filename_or_regions
+    _, ext = os.path.splitext(filename)
+    if ext == ".json":
+        with open(filename, "r") as f:
+            return json.load(f)
+    return {filename: "0x00000000"}
+
+def get_mem_image(filename_or_regions, endianness="big", mem_size=None):
+    """Load memory regions as 32-bit words (array.array), without per-word Python loop"""
+    # create memory regions
+    regions = get_mem_regions(filename_or_regions)
 
     # determine data_size
     data_size = 0
@@ -41,20 +44,40 @@ def get_mem_data(filename_or_regions, endianness="big", mem_size=None):
              data_size, mem_size))
 
     # fill data
-    data = [0]*math.ceil(data_size/4)
+    data = array.array("I", bytes(4*math.ceil(data_size/4)))
+    assert data.itemsize == 4
     for filename, base in regions.items():
         with open(filename, "rb") as f:
-            i = 0
-            while True:
-                w = f.read(4)
-                if not w:
-                    break
-                if len(w) != 4:
-                    for _ in range(len(w), 4):
-                        w += b'\x00'
-                if endianness == "little":
-                    data[int(base, 16)//4 + i] = struct.unpack("<I", w)[0]
-                else:
-                    data[int(base, 16)//4 + i] = struct.unpack(">I", w)[0]
-                i += 1
+            content = f.read()
+        content += bytes(-len(content) % 4)
+        words = array.array("I", content)
+        if endianness != sys.byteorder:
+            words.byteswap()
+        offset = int(base, 16)//4
+        data[offset:offset + len(words)] = words
     return data
+
+def get_mem_data(filename_or_regions, endianness="big", mem_size=None):
+    return get_mem_image(filename_or_regions, endianness, mem_size).tolist()
+
+def mem_data_to_bytes(data):
+    """Convert 32-bit words to little-endian bytes"""
+    data = array.array("I", data)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+def mem_data_from_bytes(data, data_width=32):
+    """Convert little-endian bytes to data_width-bit words (bytes are zero-padded if needed)"""
+    data_width_bytes = data_width//8
+    assert data_width_bytes*8 == data_width
+    data = bytes(data) + bytes(-len(data) % data_width_bytes)
+    typecodes = {1: "B", 2: "H", 4: "I", 8: "Q"}
+    if data_width_bytes in typecodes:
+        words = array.array(typecodes[data_width_bytes], data)
+        assert words.itemsize == data_width_bytes
+        if sys.byteorder == "big":
+            words.byteswap()
+        return words.tolist()
+    return [int.from_bytes(data[i:i + data_width_bytes], "little")
+        for i in range(0, len(data), data_width_bytes)]
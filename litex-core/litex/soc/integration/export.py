@@ -19,7 +19,7 @@ from sysconfig import get_platform
 
 from migen import *
 
-from litex.soc.interconnect.csr import CSRStatus
+from litex.soc.interconnect.csr import CSRStatus, CSRAccess
 
 from litex.build.tools import generated_banner
 
@@ -242,6 +242,14 @@ def get_csr_json(csr_regions={}, constants={}, mem_regions={}):
                     "size": size,
                     "type": "ro" if isinstance(csr, CSRStatus) else "rw"
                 }
+                if hasattr(csr, "fields"):
+                    d["csr_registers"][name + "_" + csr.name]["fields"] = [{
+                        "name":   field.name,
+                        "offset": field.offset,
+                        "size":   field.size,
+                        "access": {CSRAccess.WriteOnly: "wo", CSRAccess.ReadOnly: "ro", CSRAccess.ReadWrite: "rw"}[field.access],
+                        "pulse":  field.pulse,
+                    } for field in csr.fields.fields]
                 region_origin += alignment//8*size
 
     for name, value in constants.items():
@@ -269,6 +277,12 @@ def get_csr_csv(csr_regions={}, constants={}, mem_regions={}):
             d["csr_registers"][name]["addr"],
             d["csr_registers"][name]["size"],
             d["csr_registers"][name]["type"])
+    for name in d["csr_registers"].keys():
+        for field in d["csr_registers"][name].get("fields", []):
+            r += "csr_field,{}.{},{},{},{}\n".format(name, field["name"],
+                field["offset"],
+                field["size"],
+                "pulse" if field["pulse"] else field["access"])
     for name, value in d["constants"].items():
         r += "constant,{},{},,\n".format(name, value)
     for name in d["memories"].keys():
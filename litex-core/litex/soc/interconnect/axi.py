@@ -109,18 +109,25 @@ class AXIBurst2Beat(Module):
         beat_count  = Signal(8)
         beat_size   = Signal(8 + 4)
         beat_offset = Signal(8 + 4)
-        beat_wrap   = Signal(8 + 4)
+        beat_wrap   = Signal(len(ax_burst.addr))
 
         # compute parameters
         self.comb += beat_size.eq(1 << ax_burst.size)
-        self.comb += beat_wrap.eq(ax_burst.len << ax_burst.size)
+        # WRAP bursts are 2, 4, 8 or 16 beats long: the wrap boundary is aligned on the total size
+        # of the burst ((len + 1) << size) and beat addresses wrap around it.
+        self.comb += beat_wrap.eq((ax_burst.len << ax_burst.size) | (beat_size - 1))
 
         # combinatorial logic
         self.comb += [
             ax_beat.valid.eq(ax_burst.valid | ~ax_beat.first),
             ax_beat.first.eq(beat_count == 0),
             ax_beat.last.eq(beat_count == ax_burst.len),
-            ax_beat.addr.eq(ax_burst.addr + beat_offset),
+            If((ax_burst.burst == BURST_WRAP) & (BURST_WRAP in capabilities),
+                ax_beat.addr.eq((ax_burst.addr & ~beat_wrap) |
+                                ((ax_burst.addr + beat_offset) & beat_wrap))
+            ).Else(
+                ax_beat.addr.eq(ax_burst.addr + beat_offset)
+            ),
             ax_beat.id.eq(ax_burst.id),
             If(ax_beat.ready,
                 If(ax_beat.last,
@@ -141,11 +148,6 @@ class AXIBurst2Beat(Module):
                        ((ax_burst.burst == BURST_WRAP) & (BURST_WRAP in capabilities)),
                         beat_offset.eq(beat_offset + beat_size)
                     )
-                ),
-                If((ax_burst.burst == BURST_WRAP) & (BURST_WRAP in capabilities),
-                    If(beat_offset == beat_wrap,
-                        beat_offset.eq(0)
-                    )
                 )
             )
         ]
@@ -12,16 +12,30 @@ from litex.soc.interconnect import stream
 
 
 class WishboneStreamingBridge(Module):
+    # Commands: cmd (1 byte), length in words (1 byte, 2 bytes big-endian for _v2 commands),
+    # address in words (4 bytes big-endian), then the data words (big-endian) for writes.
     cmds = {
-        "write": 0x01,
-        "read": 0x02
+        "write":    0x01,
+        "read":     0x02,
+        "write_v2": 0x03,
+        "read_v2":  0x04,
     }
 
-    def __init__(self, phy, clk_freq):
+    def __init__(self, phy, clk_freq, rx_fifo_depth=16):
         self.wishbone = wishbone.Interface()
 
         # # #
 
+        # buffer the commands received while a read is being answered (pipelined commands), phy
+        # sources have no backpressure.
+        if rx_fifo_depth:
+            rx_fifo = stream.SyncFIFO([("data", 8)], rx_fifo_depth, buffered=True)
+            self.submodules += rx_fifo
+            self.comb += phy.source.connect(rx_fifo.sink)
+            source = rx_fifo.source
+        else:
+            source = phy.source
+
         byte_counter = Signal(3, reset_less=True)
         byte_counter_reset = Signal()
         byte_counter_ce = Signal()
@@ -32,7 +46,7 @@ class WishboneStreamingBridge(Module):
                 byte_counter.eq(byte_counter + 1)
             )
 
-        word_counter = Signal(3, reset_less=True)
+        word_counter = Signal(16, reset_less=True)
         word_counter_reset = Signal()
         word_counter_ce = Signal()
         self.sync += \
@@ -44,8 +58,16 @@ class WishboneStreamingBridge(Module):
 
         cmd = Signal(8, reset_less=True)
         cmd_ce = Signal()
+        cmd_write = Signal()
+        cmd_read = Signal()
+        cmd_v2 = Signal()
+        self.comb += [
+            cmd_write.eq((cmd == self.cmds["write"]) | (cmd == self.cmds["write_v2"])),
+            cmd_read.eq((cmd == self.cmds["read"]) | (cmd == self.cmds["read_v2"])),
+            cmd_v2.eq((cmd == self.cmds["write_v2"]) | (cmd == self.cmds["read_v2"]))
+        ]
 
-        length = Signal(8, reset_less=True)
+        length = Signal(16, reset_less=True)
         length_ce = Signal()
 
         address = Signal(32, reset_less=True)
@@ -56,11 +78,14 @@ class WishboneStreamingBridge(Module):
         tx_data_ce = Signal()
 
         self.sync += [
-            If(cmd_ce, cmd.eq(phy.source.data)),
-            If(length_ce, length.eq(phy.source.data)),
-            If(address_ce, address.eq(Cat(phy.source.data, address[0:24]))),
+            If(cmd_ce,
+                cmd.eq(source.data),
+                length.eq(0)
+            ),
+            If(length_ce, length.eq(Cat(source.data, length[0:8]))),
+            If(address_ce, address.eq(Cat(source.data, address[0:24]))),
             If(rx_data_ce,
-                data.eq(Cat(phy.source.data, data[0:24]))
+                data.eq(Cat(source.data, data[0:24]))
             ).Elif(tx_data_ce,
                 data.eq(self.wishbone.dat_r)
             )
@@ -71,13 +96,18 @@ class WishboneStreamingBridge(Module):
         self.submodules += fsm, timer
         self.comb += [
             fsm.reset.eq(timer.done),
-            phy.source.ready.eq(1)
+            source.ready.eq(fsm.ongoing("IDLE") |
+                            fsm.ongoing("RECEIVE_LENGTH") |
+                            fsm.ongoing("RECEIVE_ADDRESS") |
+                            fsm.ongoing("RECEIVE_DATA"))
         ]
         fsm.act("IDLE",
-            If(phy.source.valid,
+            If(source.valid,
                 cmd_ce.eq(1),
-                If((phy.source.data == self.cmds["write"]) |
-                   (phy.source.data == self.cmds["read"]),
+                If((source.data == self.cmds["write"]) |
+                   (source.data == self.cmds["read"]) |
+                   (source.data == self.cmds["write_v2"]) |
+                   (source.data == self.cmds["read_v2"]),
                     NextState("RECEIVE_LENGTH")
                 ),
                 byte_counter_reset.eq(1),
@@ -85,19 +115,23 @@ class WishboneStreamingBridge(Module):
             )
         )
         fsm.act("RECEIVE_LENGTH",
-            If(phy.source.valid,
+            If(source.valid,
                 length_ce.eq(1),
-                NextState("RECEIVE_ADDRESS")
+                byte_counter_ce.eq(1),
+                If(~cmd_v2 | (byte_counter == 1),
+                    NextState("RECEIVE_ADDRESS"),
+                    byte_counter_reset.eq(1)
+                )
             )
         )
         fsm.act("RECEIVE_ADDRESS",
-            If(phy.source.valid,
+            If(source.valid,
                 address_ce.eq(1),
                 byte_counter_ce.eq(1),
                 If(byte_counter == 3,
-                    If(cmd == self.cmds["write"],
+                    If(cmd_write,
                         NextState("RECEIVE_DATA")
-                    ).Elif(cmd == self.cmds["read"],
+                    ).Elif(cmd_read,
                         NextState("READ_DATA")
                     ),
                     byte_counter_reset.eq(1),
@@ -105,7 +139,7 @@ class WishboneStreamingBridge(Module):
             )
         )
         fsm.act("RECEIVE_DATA",
-            If(phy.source.valid,
+            If(source.valid,
                 rx_data_ce.eq(1),
                 byte_counter_ce.eq(1),
                 If(byte_counter == 3,
@@ -159,7 +193,9 @@ class WishboneStreamingBridge(Module):
             )
         )
 
-        self.comb += timer.wait.eq(~fsm.ongoing("IDLE"))
+        # timeout when no byte is received/sent for clk_freq//10 cycles (long bursts can last longer)
+        self.comb += timer.wait.eq(~fsm.ongoing("IDLE") &
+            ~(source.valid & source.ready) & ~(phy.sink.valid & phy.sink.ready) & ~self.wishbone.ack)
 
         self.comb += phy.sink.last.eq((byte_counter == 3) & (word_counter == length - 1))
 
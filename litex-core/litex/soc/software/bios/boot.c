@@ -13,6 +13,7 @@
 #include <uart.h>
 #include <system.h>
 #include <crc.h>
+#include <lz4.h>
 #include <string.h>
 #include <irq.h>
 
@@ -110,6 +111,191 @@ static uint32_t get_uint32(unsigned char* data)
 
 #define MAX_FAILED 5
 
+static void sfl_load(unsigned char *payload, int length)
+{
+	char *writepointer;
+	int i;
+
+	writepointer = (char *) get_uint32(&payload[0]);
+	for(i=4;i<length;i++)
+		*(writepointer++) = payload[i];
+}
+
+/* Returns 0 if flashing is not supported */
+static int sfl_flash(unsigned char *payload, int length)
+{
+#if (defined CSR_SPIFLASH_BASE && defined SPIFLASH_PAGE_SIZE)
+	uint32_t addr;
+	int i;
+
+	addr = get_uint32(&payload[0]);
+
+	for (i = 4; i < length; i++) {
+		// erase page at sector boundaries before writing
+		if ((addr & (SPIFLASH_SECTOR_SIZE - 1)) == 0) {
+			erase_flash_sector(addr);
+		}
+		write_to_flash(addr, &payload[i], 1);
+		addr++;
+	}
+	return 1;
+#else
+	return 0;
+#endif
+}
+
+/* Returns 0 if the block is malformed */
+static int sfl_load_lz4(unsigned char *payload, int length)
+{
+	return lz4_decompress(&payload[4], length - 4, (unsigned char *) get_uint32(&payload[0])) >= 0;
+}
+
+/* Returns 1 if the CRC32 of the region matches */
+static int sfl_verify(unsigned char *payload)
+{
+	return crc32((unsigned char *) get_uint32(&payload[0]), get_uint32(&payload[4])) == get_uint32(&payload[8]);
+}
+
+static void sfl_timer_start(unsigned int ticks)
+{
+	timer0_en_write(0);
+	timer0_reload_write(0);
+	timer0_load_write(ticks);
+	timer0_en_write(1);
+	timer0_update_value_write(1);
+}
+
+/* Discards the frames in flight after an error: waits for 10ms without data */
+static void sfl_drain(void)
+{
+	sfl_timer_start(CONFIG_CLOCK_FREQUENCY/100);
+	while(timer0_value_read()) {
+		if(uart_read_nonblock()) {
+			uart_read();
+			sfl_timer_start(CONFIG_CLOCK_FREQUENCY/100);
+		}
+		timer0_update_value_write(1);
+	}
+}
+
+static void sfl_reply(char ack, unsigned char seq)
+{
+	uart_write(ack);
+	uart_write(seq);
+}
+
+/* Windowed mode: the host sends up to window frames ahead, frames are executed in sequence
+ * order and acknowledged with the reply and sequence number (cumulative acks). Erroneous
+ * frames are reported with SFL_ACK_CRCERROR and the expected sequence number, from which
+ * the host resends (go-back-N). SFL_CMD_VERIFY replies SFL_ACK_SUCCESS or SFL_ACK_ERROR.
+ */
+static int serialboot_windowed(int payload_length, int features)
+{
+	static struct sfl_frame_windowed frame;
+	unsigned char expected;
+	char last_ack;
+	int nak_sent;
+	int failed;
+
+	expected = 0;
+	last_ack = SFL_ACK_SUCCESS;
+	nak_sent = 0;
+	failed = 0;
+	while(1) {
+		int i;
+		int length;
+		int actualcrc;
+		int goodcrc;
+
+		/* Get one Frame */
+		length = (int)uart_read() << 8;
+		length |= (int)uart_read();
+		frame.crc[0] = uart_read();
+		frame.crc[1] = uart_read();
+		frame.cmd = uart_read();
+		frame.seq = uart_read();
+		goodcrc = -1;
+		if(length <= payload_length) {
+			for(i=0;i<length;i++)
+				frame.payload[i] = uart_read();
+			goodcrc = crc16(&frame.cmd, length+2);
+		}
+
+		/* Check Frame CRC */
+		actualcrc = ((int)frame.crc[0] << 8)|(int)frame.crc[1];
+		if(actualcrc != goodcrc) {
+			failed++;
+			if(failed == MAX_FAILED) {
+				printf("Too many consecutive errors, aborting");
+				return 1;
+			}
+			sfl_drain();
+			sfl_reply(SFL_ACK_CRCERROR, expected);
+			nak_sent = 1;
+			continue;
+		}
+
+		/* Check Frame sequence number */
+		if(frame.seq != expected) {
+			if((unsigned char)(frame.seq - expected) < 128) {
+				/* Frame(s) lost: ask once for retransmission */
+				if(!nak_sent)
+					sfl_reply(SFL_ACK_CRCERROR, expected);
+				nak_sent = 1;
+			} else
+				/* Retransmission of an executed frame */
+				sfl_reply(last_ack, expected - 1);
+			continue;
+		}
+		failed = 0;
+		nak_sent = 0;
+		expected++;
+
+		/* Execute Frame CMD */
+		switch(frame.cmd) {
+			case SFL_CMD_ABORT:
+				sfl_reply(SFL_ACK_SUCCESS, frame.seq);
+				return 1;
+			case SFL_CMD_LOAD:
+			case SFL_CMD_LOAD_NO_CRC:
+				sfl_load(frame.payload, length);
+				last_ack = SFL_ACK_SUCCESS;
+				break;
+			case SFL_CMD_LOAD_LZ4:
+				if((features & SFL_FEATURE_LZ4) && sfl_load_lz4(frame.payload, length))
+					last_ack = SFL_ACK_SUCCESS;
+				else
+					last_ack = SFL_ACK_UNKNOWN;
+				break;
+			case SFL_CMD_VERIFY:
+				if(!(features & SFL_FEATURE_VERIFY) || length < 12)
+					last_ack = SFL_ACK_UNKNOWN;
+				else
+					last_ack = sfl_verify(frame.payload) ? SFL_ACK_SUCCESS : SFL_ACK_ERROR;
+				break;
+			case SFL_CMD_JUMP:
+				sfl_reply(SFL_ACK_SUCCESS, frame.seq);
+				boot(0, 0, 0, get_uint32(&frame.payload[0]));
+				break;
+			case SFL_CMD_FLASH:
+				last_ack = sfl_flash(frame.payload, length) ? SFL_ACK_SUCCESS : SFL_ACK_UNKNOWN;
+				break;
+			case SFL_CMD_REBOOT:
+#ifdef CSR_CTRL_BASE
+				sfl_reply(SFL_ACK_SUCCESS, frame.seq);
+				ctrl_reset_write(1);
+#endif
+				last_ack = SFL_ACK_UNKNOWN;
+				break;
+			default:
+				last_ack = SFL_ACK_UNKNOWN;
+				break;
+		}
+		sfl_reply(last_ack, frame.seq);
+	}
+	return 1;
+}
+
 /* Returns 1 if other boot methods should be tried */
 int serialboot(void)
 {
@@ -174,17 +360,12 @@ int serialboot(void)
 				uart_write(SFL_ACK_SUCCESS);
 				return 1;
 			case SFL_CMD_LOAD:
-			case SFL_CMD_LOAD_NO_CRC: {
-				char *writepointer;
-
+			case SFL_CMD_LOAD_NO_CRC:
 				failed = 0;
-				writepointer = (char *) get_uint32(&frame.payload[0]);
-				for(i=4;i<frame.length;i++)
-					*(writepointer++) = frame.payload[i];
+				sfl_load(frame.payload, frame.length);
 				if (frame.cmd == SFL_CMD_LOAD)
 					uart_write(SFL_ACK_SUCCESS);
 				break;
-			}
 			case SFL_CMD_JUMP: {
 				uint32_t addr;
 
@@ -194,31 +375,44 @@ int serialboot(void)
 				boot(0, 0, 0, addr);
 				break;
 			}
-			case SFL_CMD_FLASH: {
-#if (defined CSR_SPIFLASH_BASE && defined SPIFLASH_PAGE_SIZE)
-				uint32_t addr;
-
+			case SFL_CMD_FLASH:
 				failed = 0;
-				addr = get_uint32(&frame.payload[0]);
-
-				for (i = 4; i < frame.length; i++) {
-					// erase page at sector boundaries before writing
-					if ((addr & (SPIFLASH_SECTOR_SIZE - 1)) == 0) {
-						erase_flash_sector(addr);
-					}
-					write_to_flash(addr, &frame.payload[i], 1);
-					addr++;
-				}
-				uart_write(SFL_ACK_SUCCESS);
-#endif
+				if (sfl_flash(frame.payload, frame.length))
+					uart_write(SFL_ACK_SUCCESS);
 				break;
-			}
 			case SFL_CMD_REBOOT:
 #ifdef CSR_CTRL_BASE
 				uart_write(SFL_ACK_SUCCESS);
 				ctrl_reset_write(1);
 #endif
 				break;
+			case SFL_CMD_CONFIG: {
+				int window;
+				int payload_length;
+				int features;
+
+				/* Switch to the windowed mode, reply with the accepted parameters */
+				if (frame.length < 3) {
+					uart_write(SFL_ACK_ERROR);
+					break;
+				}
+				failed = 0;
+				window = frame.payload[0];
+				if (window > SFL_WINDOW_MAX)
+					window = SFL_WINDOW_MAX;
+				payload_length = ((int)frame.payload[1] << 8) | (int)frame.payload[2];
+				if (payload_length > SFL_PAYLOAD_LENGTH_MAX)
+					payload_length = SFL_PAYLOAD_LENGTH_MAX;
+				features = 0;
+				if (frame.length > 3)
+					features = frame.payload[3] & (SFL_FEATURE_LZ4 | SFL_FEATURE_VERIFY);
+				uart_write(SFL_ACK_SUCCESS);
+				uart_write(window);
+				uart_write(payload_length >> 8);
+				uart_write(payload_length & 0xff);
+				uart_write(features);
+				return serialboot_windowed(payload_length, features);
+			}
 			default:
 				failed++;
 				if(failed == MAX_FAILED) {
@@ -15,6 +15,20 @@ struct sfl_frame {
 	unsigned char payload[255];
 } __attribute__((packed));
 
+/* Windowed mode (negotiated with SFL_CMD_CONFIG): 16-bit lengths, sequence numbers */
+#ifndef SFL_PAYLOAD_LENGTH_MAX
+#define SFL_PAYLOAD_LENGTH_MAX 1024
+#endif
+#define SFL_WINDOW_MAX 32
+
+struct sfl_frame_windowed {
+	unsigned char length[2];
+	unsigned char crc[2];
+	unsigned char cmd;
+	unsigned char seq;
+	unsigned char payload[SFL_PAYLOAD_LENGTH_MAX];
+} __attribute__((packed));
+
 /* General commands */
 #define SFL_CMD_ABORT		0x00
 #define SFL_CMD_LOAD		0x01
@@ -22,6 +36,15 @@ struct sfl_frame {
 #define SFL_CMD_LOAD_NO_CRC	0x03
 #define SFL_CMD_FLASH		0x04
 #define SFL_CMD_REBOOT		0x05
+#define SFL_CMD_CONFIG		0x06
+
+/* Windowed mode commands */
+#define SFL_CMD_LOAD_LZ4	0x07
+#define SFL_CMD_VERIFY		0x08
+
+/* Windowed mode features (negotiated with SFL_CMD_CONFIG) */
+#define SFL_FEATURE_LZ4		0x01
+#define SFL_FEATURE_VERIFY	0x02
 
 /* Replies */
 #define SFL_ACK_SUCCESS		'K'
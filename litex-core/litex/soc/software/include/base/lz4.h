@@ -0,0 +1,14 @@
+#ifndef __LZ4_H
+#define __LZ4_H
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+int lz4_decompress(const unsigned char *src, int srclen, unsigned char *dst);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* __LZ4_H */
@@ -0,0 +1,68 @@
+// This file is Copyright (c) 2020 LiteX developers
+// License: BSD
+
+#include <string.h>
+#include <lz4.h>
+
+/* Decompresses the sequences of a LZ4 block (block format, without frame header) from src to
+ * dst. Matches can reference the data before dst (up to 64KB back), allowing to decompress
+ * a stream cut in blocks directly to its destination. The last sequence of a block can have
+ * literals only.
+ * Returns the number of bytes written to dst or -1 if the block is malformed.
+ */
+int lz4_decompress(const unsigned char *src, int srclen, unsigned char *dst)
+{
+	const unsigned char *ip = src;
+	const unsigned char *iend = src + srclen;
+	unsigned char *op = dst;
+	unsigned char *match;
+	unsigned int token;
+	unsigned int length;
+	unsigned int offset;
+	unsigned int c;
+
+	while(ip < iend) {
+		token = *ip++;
+
+		/* Literals */
+		length = token >> 4;
+		if(length == 15) {
+			do {
+				if(ip >= iend)
+					return -1;
+				c = *ip++;
+				length += c;
+			} while(c == 255);
+		}
+		if(length > (unsigned int)(iend - ip))
+			return -1;
+		memcpy(op, ip, length);
+		op += length;
+		ip += length;
+		if(ip >= iend)
+			break;
+
+		/* Match */
+		if(iend - ip < 2)
+			return -1;
+		offset = ip[0] | ((unsigned int)ip[1] << 8);
+		ip += 2;
+		if(offset == 0)
+			return -1;
+		length = token & 15;
+		if(length == 15) {
+			do {
+				if(ip >= iend)
+					return -1;
+				c = *ip++;
+				length += c;
+			} while(c == 255);
+		}
+		length += 4;
+		/* Byte copy: the match can overlap the output */
+		match = op - offset;
+		while(length--)
+			*op++ = *match++;
+	}
+	return op - dst;
+}
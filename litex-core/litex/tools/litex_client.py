@@ -3,17 +3,148 @@
 # License: BSD
 
 import socket
+import collections
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
-from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import EtherboneFastPacket, EtherboneFastRecord
 from litex.tools.remote.etherbone import EtherboneIPC
 from litex.tools.remote.csr_builder import CSRBuilder
 
+# Etherbone records carry at most 255 writes and 255 reads (8-bit counts).
+etherbone_max_count = 255
+
+
+class RemoteFuture:
+    """Result of a read issued in a RemoteBatch, available once the batch is flushed"""
+    def __init__(self, batch, addr, length):
+        self.batch = batch
+        self.addr = addr
+        self.length = length
+        self.datas = []
+
+    def done(self):
+        return len(self.datas) == (1 if self.length is None else self.length)
+
+    def result(self):
+        if not self.done():
+            self.batch.flush()
+        return self.datas[0] if self.length is None else self.datas
+
+
+class _BatchRecord:
+    def __init__(self):
+        self.base_addr = 0
+        self.wdatas = []
+        self.raddrs = []
+        self.futures = [] # [future, number of reads] receiving the reads, in order
+
+    def encode(self):
+        record = EtherboneFastRecord(base_addr=self.base_addr, wdatas=self.wdatas, raddrs=self.raddrs)
+        return EtherboneFastPacket([record]).encode()
+
+
+class RemoteBatch:
+    """Batch of reads/writes pipelined to the server
+
+    Operations are packed in Etherbone records (a record holds a burst of
+    writes followed by up to 255 reads) that are sent back-to-back without
+    waiting for the replies, with up to `max_inflight` read records awaiting
+    their reply. Reads return RemoteFuture objects, resolved in order.
+
+    With `coalesce` (default), consecutive operations share records: reads
+    are merged in the current record and writes contiguous to the current
+    write burst (and not following a read) are appended to it. Otherwise
+    each operation gets its own record(s).
+
+    Usage:
+        with client.batch() as b:
+            f = b.read(addr)
+            b.write(addr, value)
+        print(f.result())
+    """
+    def __init__(self, client, coalesce=True, max_inflight=16):
+        self.client = client
+        self.coalesce = coalesce
+        self.max_inflight = max_inflight
+        self.records = []
+        self.inflight = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.flush()
+
+    def _new_operation(self):
+        if not self.coalesce or not self.records:
+            self.records.append(_BatchRecord())
+
+    def read(self, addr, length=None):
+        future = RemoteFuture(self, addr, length)
+        self._new_operation()
+        for i in range(1 if length is None else length):
+            record = self.records[-1]
+            if len(record.raddrs) >= etherbone_max_count:
+                record = _BatchRecord()
+                self.records.append(record)
+            record.raddrs.append(addr + 4*i)
+            if not record.futures or record.futures[-1][0] is not future:
+                record.futures.append([future, 0])
+            record.futures[-1][1] += 1
+        return future
+
+    def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        self._new_operation()
+        for i, data in enumerate(datas):
+            record = self.records[-1]
+            if (record.raddrs or
+                len(record.wdatas) >= etherbone_max_count or
+                (record.wdatas and record.base_addr + 4*len(record.wdatas) != addr + 4*i)):
+                record = _BatchRecord()
+                self.records.append(record)
+            if not record.wdatas:
+                record.base_addr = addr + 4*i
+            record.wdatas.append(data)
+            if self.client.debug:
+                print("write {:08x} @ {:08x}".format(data, addr + 4*i))
+
+    def _receive(self):
+        record = self.inflight.popleft()
+        packet = self.client._receive_reply()
+        datas = packet.records.pop().wdatas.tolist()
+        if self.client.debug:
+            for addr, data in zip(record.raddrs, datas):
+                print("read {:08x} @ {:08x}".format(data, addr))
+        offset = 0
+        for future, n in record.futures:
+            future.datas += datas[offset:offset+n]
+            offset += n
+
+    def flush(self):
+        """Send the pending records and wait for all the replies"""
+        pending = bytearray()
+        for record in self.records:
+            if record.raddrs and len(self.inflight) >= self.max_inflight:
+                # window full: wait for the oldest reply
+                self.client.send_packet(self.client.socket, pending)
+                pending = bytearray()
+                self._receive()
+            pending += record.encode()
+            if record.raddrs:
+                self.inflight.append(record)
+        if pending:
+            self.client.send_packet(self.client.socket, pending)
+        self.records = []
+        while self.inflight:
+            self._receive()
+
 
 class RemoteClient(EtherboneIPC, CSRBuilder):
-    def __init__(self, host="localhost", port=1234, csr_csv="csr.csv", csr_data_width=None, debug=False):
+    def __init__(self, host="localhost", port=1234, csr_csv="csr.csv", csr_data_width=None, debug=False,
+        csr_shadow=False):
         if csr_csv is not None:
-            CSRBuilder.__init__(self, self, csr_csv, csr_data_width)
+            CSRBuilder.__init__(self, self, csr_csv, csr_data_width, csr_shadow)
         else:
             assert csr_data_width is not None
         self.host = host
@@ -34,36 +165,47 @@ class RemoteClient(EtherboneIPC, CSRBuilder):
 
     def read(self, addr, length=None):
         length_int = 1 if length is None else length
+        if length_int > etherbone_max_count:
+            # split in several records
+            with self.batch() as batch:
+                future = batch.read(addr, length)
+            return future.result()
+
         # prepare packet
-        record = EtherboneRecord()
-        record.reads = EtherboneReads(addrs=[addr + 4*j for j in range(length_int)])
-        record.rcount = len(record.reads)
+        record = EtherboneFastRecord(raddrs=range(addr, addr + 4*length_int, 4))
 
         # send packet
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.send_packet(self.socket, packet[:])
+        packet = EtherboneFastPacket([record])
+        self.send_packet(self.socket, packet.encode())
 
         # receive response
-        packet = EtherbonePacket(self.receive_packet(self.socket))
-        packet.decode()
-        datas = packet.records.pop().writes.get_datas()
+        packet = self._receive_reply()
+        datas = packet.records.pop().wdatas.tolist()
         if self.debug:
             for i, data in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(data, addr + 4*i))
         return datas[0] if length is None else datas
 
+    def _receive_reply(self):
+        packet = self.receive_packet(self.socket)
+        if not packet:
+            raise ConnectionError("Connection closed by the server")
+        return EtherboneFastPacket.decode_from(packet)
+
+    def batch(self, coalesce=True, max_inflight=16):
+        return RemoteBatch(self, coalesce, max_inflight)
+
     def write(self, addr, datas):
         datas = datas if isinstance(datas, list) else [datas]
-        record = EtherboneRecord()
-        record.writes = EtherboneWrites(base_addr=addr, datas=[d for d in datas])
-        record.wcount = len(record.writes)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.send_packet(self.socket, packet)
+        if len(datas) > etherbone_max_count:
+            # split in several records
+            with self.batch() as batch:
+                batch.write(addr, datas)
+            return
+        record = EtherboneFastRecord(base_addr=addr, wdatas=datas)
+
+        packet = EtherboneFastPacket([record])
+        self.send_packet(self.socket, packet.encode())
 
         if self.debug:
             for i, data in enumerate(datas):
@@ -11,17 +11,48 @@ import sys
 import socket
 import time
 import threading
+import selectors
+import traceback
+from collections import deque
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneWrites
-from litex.tools.remote.etherbone import EtherboneIPC
+from litex.tools.remote.etherbone import EtherboneFastPacket, EtherboneFastRecord
+from litex.tools.remote.etherbone import EtherboneIPC, EtherboneIPCStream
+
+
+class RemoteServerClient:
+    def __init__(self, socket, addr):
+        self.socket   = socket
+        self.addr     = addr
+        self.rx       = EtherboneIPCStream()
+        self.tx       = bytearray()
+        self.requests = deque() # decoded packets waiting for the comm worker
+        self.events   = 0
+        self.closed   = False
+        self.failed   = False # requests lost by the comm worker, closed by the I/O thread
 
 
 class RemoteServer(EtherboneIPC):
-    def __init__(self, comm, bind_ip, bind_port=1234):
-        self.comm = comm
-        self.bind_ip = bind_ip
-        self.bind_port = bind_port
-        self.lock = False
+    """Etherbone TCP server sharing a comm (UART, UDP, PCIe, USB) between clients
+
+    A single I/O thread accepts the clients and receives/sends their packets (selectors based
+    event loop) while a single comm worker executes the requests. Clients are served in
+    round-robin: each round of the worker takes one pending packet from each client and executes
+    them as one batch, merging accesses to contiguous addresses (from the same or from different
+    clients) into comm bursts of up to max_burst words. Clients with max_pending packets waiting
+    are not read until the worker catches up.
+    """
+    def __init__(self, comm, bind_ip, bind_port=1234, max_burst=255, max_pending=64):
+        self.comm        = comm
+        self.bind_ip     = bind_ip
+        self.bind_port   = bind_port
+        self.max_burst   = max_burst
+        self.max_pending = max_pending
+        self.condition   = threading.Condition()
+        self.clients     = []
+        self.ready       = deque() # clients with pending requests, in round-robin order
+        self.running     = False
+        self.threads     = []
+        self.stats       = dict(packets=0, records=0, batches=0, comm_reads=0, comm_writes=0)
 
     def open(self):
         if hasattr(self, "socket"):
@@ -34,72 +65,228 @@ class RemoteServer(EtherboneIPC):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket_flags, 1)
         self.socket.bind((self.bind_ip, self.bind_port))
-        print("tcp port: {:d}".format(self.bind_port))
-        self.socket.listen(1)
+        print("tcp port: {:d}".format(self.socket.getsockname()[1]))
+        self.socket.listen(8)
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, "accept")
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, "wakeup")
         self.comm.open()
 
     def close(self):
+        if self.running:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            self._wakeup()
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
         self.comm.close()
         if not hasattr(self, "socket"):
             return
+        for client in self.clients[:]:
+            self._close_client(client)
+        self.selector.close()
+        self.wakeup_r.close()
+        self.wakeup_w.close()
         self.socket.close()
         del self.socket
 
-    def _serve_thread(self):
-        while True:
-            client_socket, addr = self.socket.accept()
-            print("Connected with " + addr[0] + ":" + str(addr[1]))
-            try:
-                while True:
+    def start(self, nthreads=1):
+        # nthreads is kept for compatibility: requests are always served by one I/O thread and one
+        # comm worker (the comm can only execute one transaction at a time).
+        self.running = True
+        for target in [self._io_thread, self._comm_thread]:
+            thread = threading.Thread(target=target)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _wakeup(self):
+        try:
+            self.wakeup_w.send(b"\x00")
+        except (BlockingIOError, OSError):
+            pass
+
+    # I/O thread -----------------------------------------------------------------------------------
+
+    def _io_thread(self):
+        while self.running:
+            for key, events in self.selector.select():
+                if key.data == "accept":
+                    self._accept()
+                elif key.data == "wakeup":
                     try:
-                        packet = self.receive_packet(client_socket)
-                        if packet == 0:
-                            break
-                    except:
-                        break
-                    packet = EtherbonePacket(packet)
-                    packet.decode()
+                        while self.wakeup_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._receive(client)
+                    if events & selectors.EVENT_WRITE and not client.closed:
+                        self._send(client)
+            for client in self.clients[:]:
+                if client.failed:
+                    self._close_client(client)
+                else:
+                    self._update(client)
 
-                    record = packet.records.pop()
+    def _accept(self):
+        try:
+            client_socket, addr = self.socket.accept()
+        except BlockingIOError:
+            return
+        print("Connected with " + addr[0] + ":" + str(addr[1]))
+        client_socket.setblocking(False)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients.append(RemoteServerClient(client_socket, addr))
 
-                    # wait for lock
-                    while self.lock:
-                        time.sleep(0.01)
+    def _update(self, client):
+        with self.condition:
+            events = 0
+            if len(client.requests) < self.max_pending:
+                events |= selectors.EVENT_READ
+            if client.tx:
+                events |= selectors.EVENT_WRITE
+        if events == client.events:
+            return
+        if client.events == 0:
+            self.selector.register(client.socket, events, client)
+        elif events == 0:
+            self.selector.unregister(client.socket)
+        else:
+            self.selector.modify(client.socket, events, client)
+        client.events = events
 
-                    # set lock
-                    self.lock = True
+    def _close_client(self, client):
+        print("Disconnect")
+        with self.condition:
+            client.closed = True
+            client.requests.clear()
+            if client in self.ready:
+                self.ready.remove(client)
+        if client.events:
+            self.selector.unregister(client.socket)
+        client.socket.close()
+        self.clients.remove(client)
 
-                    # handle writes:
-                    if record.writes != None:
-                        self.comm.write(record.writes.base_addr, record.writes.get_datas())
+    def _receive(self, client):
+        try:
+            data = client.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close_client(client)
+            return
+        try:
+            packets = client.rx.feed(data)
+        except ValueError as e:
+            print("Invalid packet from {}:{} ({}), closing.".format(client.addr[0], client.addr[1], e))
+            self._close_client(client)
+            return
+        if packets:
+            with self.condition:
+                if not client.requests:
+                    self.ready.append(client)
+                client.requests.extend(packets)
+                self.condition.notify()
 
-                    # handle reads
-                    if record.reads != None:
-                        reads = []
-                        for addr in record.reads.get_addrs():
-                            reads.append(self.comm.read(addr))
+    def _send(self, client):
+        with self.condition:
+            try:
+                n = client.socket.send(client.tx)
+            except BlockingIOError:
+                return
+            except OSError:
+                n = None
+            if n is not None:
+                del client.tx[:n]
+        if n is None:
+            self._close_client(client)
+
+    # Comm worker ----------------------------------------------------------------------------------
 
-                        record = EtherboneRecord()
-                        record.writes = EtherboneWrites(datas=reads)
-                        record.wcount = len(record.writes)
+    def _comm_thread(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ready:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                # one packet from each client with pending requests
+                batch = []
+                for i in range(len(self.ready)):
+                    client = self.ready.popleft()
+                    batch.append((client, client.requests.popleft()))
+                    if client.requests:
+                        self.ready.append(client)
+            try:
+                replies = self._execute(batch)
+            except Exception:
+                traceback.print_exc()
+                replies = []
+                # replies of the batch are lost: disconnect its clients instead of leaving them
+                # waiting for them
+                with self.condition:
+                    for client, packet in batch:
+                        client.failed = True
+            with self.condition:
+                for client, reply in replies:
+                    if not client.closed:
+                        client.tx += reply
+            self._wakeup()
 
-                        packet = EtherbonePacket()
-                        packet.records = [record]
-                        packet.encode()
-                        self.send_packet(client_socket, packet)
+    def _execute(self, batch):
+        operations = [] # ["w", addr, datas] or ["r", addr, length, [(reply datas, offset)]]
+        replies    = []
+        def write(addr, datas):
+            last = operations[-1] if operations else None
+            if (last is not None and last[0] == "w" and last[1] + 4*len(last[2]) == addr and
+                len(last[2]) + len(datas) <= self.max_burst):
+                last[2] += datas
+            else:
+                operations.append(["w", addr, datas])
+        def read(addr, datas, offset):
+            last = operations[-1] if operations else None
+            if (last is not None and last[0] == "r" and last[1] + 4*last[2] == addr and
+                last[2] < self.max_burst):
+                last[2] += 1
+                last[3].append((datas, offset))
+            else:
+                operations.append(["r", addr, 1, [(datas, offset)]])
 
-                    # release lock
-                    self.lock = False
+        for client, packet in batch:
+            self.stats["packets"] += 1
+            for record in packet.records:
+                self.stats["records"] += 1
+                if record.wcount:
+                    write(record.base_addr, record.wdatas.tolist())
+                if record.rcount:
+                    datas = [0]*record.rcount
+                    for i, addr in enumerate(record.raddrs):
+                        read(addr, datas, i)
+                    replies.append((client, record.base_ret_addr, datas))
 
-            finally:
-                print("Disconnect")
-                client_socket.close()
+        self.stats["batches"] += 1
+        for operation in operations:
+            if operation[0] == "w":
+                self.comm.write(operation[1], operation[2])
+                self.stats["comm_writes"] += 1
+            else:
+                datas = self.comm.read(operation[1], operation[2])
+                self.stats["comm_reads"] += 1
+                for data, (reply, offset) in zip(datas, operation[3]):
+                    reply[offset] = data
 
-    def start(self, nthreads):
-        for i in range(nthreads):
-            self.serve_thread = threading.Thread(target=self._serve_thread)
-            self.serve_thread.setDaemon(True)
-            self.serve_thread.start()
+        return [(client, EtherboneFastPacket([EtherboneFastRecord(base_addr=base_ret_addr, wdatas=datas)]).encode())
+            for client, base_ret_addr, datas in replies]
 
 
 def main():
@@ -118,6 +305,8 @@ def main():
                         help="Set UART port")
     parser.add_argument("--uart-baudrate", default=115200,
                         help="Set UART baudrate")
+    parser.add_argument("--uart-v2", action="store_true",
+                        help="Use UART bridge v2 protocol (16-bit lengths, pipelined commands)")
 
     # UDP arguments
     parser.add_argument("--udp", action="store_true",
@@ -152,8 +341,9 @@ def main():
             exit()
         uart_port = args.uart_port
         uart_baudrate = int(float(args.uart_baudrate))
-        print("[CommUART] port: {} / baudrate: {} / ".format(uart_port, uart_baudrate), end="")
-        comm = CommUART(uart_port, uart_baudrate)
+        uart_version = 2 if args.uart_v2 else 1
+        print("[CommUART] port: {} / baudrate: {} / version: {} / ".format(uart_port, uart_baudrate, uart_version), end="")
+        comm = CommUART(uart_port, uart_baudrate, version=uart_version)
     elif args.udp:
         from litex.tools.remote.comm_udp import CommUDP
         udp_ip = args.udp_ip
@@ -187,12 +377,12 @@ def main():
 
     server = RemoteServer(comm, args.bind_ip, int(args.bind_port))
     server.open()
-    server.start(4)
+    server.start()
     try:
-        import time
         while True: time.sleep(100)
     except KeyboardInterrupt:
         pass
+    server.close()
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,7 @@
 # This file is Copyright (c) 2017 Pierre-Olivier Vauboin <po@lambdaconcept>
 # License: BSD
 
+import os
 import argparse
 
 from migen import *
@@ -20,6 +21,7 @@ from litex.soc.cores import uart
 
 from litedram import modules as litedram_modules
 from litedram.common import *
+from litedram.core.controller import ControllerSettings
 from litedram.phy.model import SDRAMPHYModel
 
 from liteeth.phy.model import LiteEthPHYModel
@@ -159,7 +161,10 @@ class SimSoC(SoCSDRAM):
         with_analyzer         = False,
         sdram_module          = "MT48LC16M16",
         sdram_init            = [],
+        sdram_init_file       = None,
+        sdram_backend         = "memory",
         sdram_data_width      = 32,
+        sdram_ctrl_settings   = None,
         sdram_verbosity       = 0,
         **kwargs):
         platform     = Platform()
@@ -190,16 +195,21 @@ class SimSoC(SoCSDRAM):
                 memtype    = sdram_module.memtype,
                 data_width = sdram_data_width,
                 clk_freq   = sdram_clk_freq)
+            controller_settings = sdram_ctrl_settings or ControllerSettings()
             self.submodules.sdrphy = SDRAMPHYModel(
-                module    = sdram_module,
-                settings  = phy_settings,
-                clk_freq  = sdram_clk_freq,
-                verbosity = sdram_verbosity,
-                init      = sdram_init)
+                module          = sdram_module,
+                settings        = phy_settings,
+                clk_freq        = sdram_clk_freq,
+                verbosity       = sdram_verbosity,
+                init            = sdram_init,
+                init_file       = sdram_init_file,
+                address_mapping = controller_settings.address_mapping,
+                backend         = sdram_backend)
             self.register_sdram(
                 self.sdrphy,
                 sdram_module.geom_settings,
-                sdram_module.timing_settings)
+                sdram_module.timing_settings,
+                controller_settings = controller_settings)
             # Reduce memtest size for simulation speedup
             self.add_constant("MEMTEST_DATA_SIZE", 8*1024)
             self.add_constant("MEMTEST_ADDR_SIZE", 8*1024)
@@ -261,6 +271,8 @@ def main():
     parser.add_argument("--sdram-data-width",     default=32,              help="Set SDRAM chip data width")
     parser.add_argument("--sdram-init",           default=None,            help="SDRAM init file")
     parser.add_argument("--sdram-verbosity",      default=0,               help="Set SDRAM checker verbosity")
+    parser.add_argument("--sdram-backend",        default="memory",        help="SDRAM model storage: memory or sparse (for large modules)")
+    parser.add_argument("--sdram-address-mapping", default="ROW_BANK_COL", help="SDRAM address mapping: ROW_BANK_COL, ROW_BANK_COL_XOR, ROW_COL_BANK or BANK_ROW_COL")
     parser.add_argument("--with-ethernet",        action="store_true",     help="Enable Ethernet support")
     parser.add_argument("--with-etherbone",       action="store_true",     help="Enable Etherbone support")
     parser.add_argument("--local-ip",             default="192.168.1.50",  help="Local IP address of SoC (default=192.168.1.50)")
@@ -298,6 +310,15 @@ def main():
         soc_kwargs["sdram_module"]             = args.sdram_module
         soc_kwargs["sdram_data_width"]         = int(args.sdram_data_width)
         soc_kwargs["sdram_verbosity"]          = int(args.sdram_verbosity)
+        soc_kwargs["sdram_backend"]            = args.sdram_backend
+        soc_kwargs["sdram_ctrl_settings"]      = ControllerSettings(address_mapping=args.sdram_address_mapping)
+        if args.sdram_init is not None:
+            _, ext = os.path.splitext(args.sdram_init)
+            if args.sdram_backend == "sparse" and ext != ".json" and cpu_endianness == "little":
+                # raw little-endian image: mmap-ed by the sparse model, no need to load it
+                soc_kwargs["sdram_init_file"] = args.sdram_init
+            else:
+                soc_kwargs["sdram_init"] = get_mem_image(args.sdram_init, cpu_endianness)
 
     if args.with_ethernet or args.with_etherbone:
         sim_config.add_module("ethernet", "eth", args={"interface": "tap0", "ip": args.remote_ip})
@@ -308,7 +329,6 @@ def main():
         with_ethernet  = args.with_ethernet,
         with_etherbone = args.with_etherbone,
         with_analyzer  = args.with_analyzer,
-        sdram_init     = [] if args.sdram_init is None else get_mem_data(args.sdram_init, cpu_endianness),
         **soc_kwargs)
     if args.ram_init is not None:
         soc.add_constant("ROM_BOOT_ADDRESS", 0x40000000)
@@ -13,6 +13,9 @@ import serial
 import threading
 import argparse
 import json
+import zlib
+import binascii
+from collections import deque
 
 
 if sys.platform == "win32":
@@ -54,6 +57,12 @@ sfl_magic_ack = b"z6IHG7cYDID6o\n"
 
 sfl_payload_length = 251
 
+# Windowed mode
+sfl_window_max         = 32 # sequence numbers are 8-bit, window must be < 128
+sfl_window_timeout     = 1.0
+sfl_window_max_retries = 8
+sfl_verify_rate        = 64*1024 # bytes/s, conservative CRC32 throughput of the BIOS for VERIFY
+
 # General commands
 sfl_cmd_abort       = b"\x00"
 sfl_cmd_load        = b"\x01"
@@ -61,6 +70,15 @@ sfl_cmd_load_no_crc = b"\x03"
 sfl_cmd_jump        = b"\x02"
 sfl_cmd_flash       = b"\x04"
 sfl_cmd_reboot      = b"\x05"
+sfl_cmd_config      = b"\x06"
+
+# Windowed mode commands
+sfl_cmd_load_lz4    = b"\x07"
+sfl_cmd_verify      = b"\x08"
+
+# Windowed mode features
+sfl_feature_lz4     = 0x01
+sfl_feature_verify  = 0x02
 
 # Replies
 sfl_ack_success  = b"K"
@@ -69,47 +87,138 @@ sfl_ack_unknown  = b"U"
 sfl_ack_error    = b"E"
 
 
-crc16_table = [
-    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7,
-    0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
-    0x1231, 0x0210, 0x3273, 0x2252, 0x52B5, 0x4294, 0x72F7, 0x62D6,
-    0x9339, 0x8318, 0xB37B, 0xA35A, 0xD3BD, 0xC39C, 0xF3FF, 0xE3DE,
-    0x2462, 0x3443, 0x0420, 0x1401, 0x64E6, 0x74C7, 0x44A4, 0x5485,
-    0xA56A, 0xB54B, 0x8528, 0x9509, 0xE5EE, 0xF5CF, 0xC5AC, 0xD58D,
-    0x3653, 0x2672, 0x1611, 0x0630, 0x76D7, 0x66F6, 0x5695, 0x46B4,
-    0xB75B, 0xA77A, 0x9719, 0x8738, 0xF7DF, 0xE7FE, 0xD79D, 0xC7BC,
-    0x48C4, 0x58E5, 0x6886, 0x78A7, 0x0840, 0x1861, 0x2802, 0x3823,
-    0xC9CC, 0xD9ED, 0xE98E, 0xF9AF, 0x8948, 0x9969, 0xA90A, 0xB92B,
-    0x5AF5, 0x4AD4, 0x7AB7, 0x6A96, 0x1A71, 0x0A50, 0x3A33, 0x2A12,
-    0xDBFD, 0xCBDC, 0xFBBF, 0xEB9E, 0x9B79, 0x8B58, 0xBB3B, 0xAB1A,
-    0x6CA6, 0x7C87, 0x4CE4, 0x5CC5, 0x2C22, 0x3C03, 0x0C60, 0x1C41,
-    0xEDAE, 0xFD8F, 0xCDEC, 0xDDCD, 0xAD2A, 0xBD0B, 0x8D68, 0x9D49,
-    0x7E97, 0x6EB6, 0x5ED5, 0x4EF4, 0x3E13, 0x2E32, 0x1E51, 0x0E70,
-    0xFF9F, 0xEFBE, 0xDFDD, 0xCFFC, 0xBF1B, 0xAF3A, 0x9F59, 0x8F78,
-    0x9188, 0x81A9, 0xB1CA, 0xA1EB, 0xD10C, 0xC12D, 0xF14E, 0xE16F,
-    0x1080, 0x00A1, 0x30C2, 0x20E3, 0x5004, 0x4025, 0x7046, 0x6067,
-    0x83B9, 0x9398, 0xA3FB, 0xB3DA, 0xC33D, 0xD31C, 0xE37F, 0xF35E,
-    0x02B1, 0x1290, 0x22F3, 0x32D2, 0x4235, 0x5214, 0x6277, 0x7256,
-    0xB5EA, 0xA5CB, 0x95A8, 0x8589, 0xF56E, 0xE54F, 0xD52C, 0xC50D,
-    0x34E2, 0x24C3, 0x14A0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-    0xA7DB, 0xB7FA, 0x8799, 0x97B8, 0xE75F, 0xF77E, 0xC71D, 0xD73C,
-    0x26D3, 0x36F2, 0x0691, 0x16B0, 0x6657, 0x7676, 0x4615, 0x5634,
-    0xD94C, 0xC96D, 0xF90E, 0xE92F, 0x99C8, 0x89E9, 0xB98A, 0xA9AB,
-    0x5844, 0x4865, 0x7806, 0x6827, 0x18C0, 0x08E1, 0x3882, 0x28A3,
-    0xCB7D, 0xDB5C, 0xEB3F, 0xFB1E, 0x8BF9, 0x9BD8, 0xABBB, 0xBB9A,
-    0x4A75, 0x5A54, 0x6A37, 0x7A16, 0x0AF1, 0x1AD0, 0x2AB3, 0x3A92,
-    0xFD2E, 0xED0F, 0xDD6C, 0xCD4D, 0xBDAA, 0xAD8B, 0x9DE8, 0x8DC9,
-    0x7C26, 0x6C07, 0x5C64, 0x4C45, 0x3CA2, 0x2C83, 0x1CE0, 0x0CC1,
-    0xEF1F, 0xFF3E, 0xCF5D, 0xDF7C, 0xAF9B, 0xBFBA, 0x8FD9, 0x9FF8,
-    0x6E17, 0x7E36, 0x4E55, 0x5E74, 0x2E93, 0x3EB2, 0x0ED1, 0x1EF0
-]
-
-
 def crc16(l):
-    crc = 0
-    for d in l:
-        crc = crc16_table[((crc >> 8) ^ d) & 0xff] ^ (crc << 8)
-    return crc & 0xffff
+    # CRC-16/XMODEM (as libbase crc16), computed in C by binascii
+    return binascii.crc_hqx(bytes(l), 0)
+
+
+def lz4_literals_size(n):
+    # token + literals of a sequence
+    return 1 + n + ((n - 15)//255 + 1 if n >= 15 else 0)
+
+
+def lz4_encode_length(n):
+    r = bytearray()
+    n -= 15
+    while n >= 255:
+        r.append(255)
+        n -= 255
+    r.append(n)
+    return r
+
+
+def lz4_encode_sequence(literals, offset=0, length=0):
+    token = min(len(literals), 15) << 4
+    if offset:
+        token |= min(length - 4, 15)
+    r = bytearray([token])
+    if len(literals) >= 15:
+        r += lz4_encode_length(len(literals))
+    r += literals
+    if offset:
+        r += offset.to_bytes(2, "little")
+        if length - 4 >= 15:
+            r += lz4_encode_length(length - 4)
+    return r
+
+
+def lz4_compress_blocks(data, block_size):
+    """Compress data in LZ4 blocks (block format) of at most block_size bytes
+
+    Blocks are meant to be decompressed back to back: matches can reference the data of the
+    previous blocks (up to 64KB back), as done by the BIOS when decompressing to RAM. The last
+    sequence of a block can have literals only. Yields (position of the decompressed data,
+    block).
+    """
+    data   = bytes(data)
+    end    = len(data)
+    # limit the match length extension to a quarter of the block
+    max_length = 4 + 15 + 255*(block_size//4 - 1)
+    table  = {}
+    block  = bytearray()
+    start  = 0 # position of the decompressed data of the block
+    anchor = 0 # start of the pending literals
+    pos    = 0
+
+    def literals_blocks(literals_end, reserve):
+        # split the pending literals in literal-only blocks until the rest fits with reserve
+        nonlocal block, start, anchor
+        while len(block) + lz4_literals_size(literals_end - anchor) + reserve > block_size:
+            if block:
+                yield start, bytes(block)
+                block, start = bytearray(), anchor
+                continue
+            n = block_size - 1
+            while lz4_literals_size(n) > block_size:
+                n -= 1
+            n = min(n, literals_end - anchor)
+            yield start, bytes(lz4_encode_sequence(data[anchor:anchor + n]))
+            anchor += n
+            start   = anchor
+
+    while pos + 4 <= end:
+        key = data[pos:pos + 4]
+        ref = table.get(key)
+        table[key] = pos
+        if ref is None or pos - ref > 0xffff:
+            # accelerate on incompressible data
+            pos += 1 + ((pos - anchor) >> 6)
+            continue
+        # extend the match
+        length = 4
+        while pos + length + 64 <= end and data[ref + length:ref + length + 64] == data[pos + length:pos + length + 64]:
+            length += 64
+        while pos + length < end and data[ref + length] == data[pos + length]:
+            length += 1
+        length = min(length, max_length)
+        sequence = lz4_encode_sequence(data[anchor:pos], pos - ref, length)
+        if len(block) + len(sequence) > block_size:
+            yield from literals_blocks(pos, len(sequence) - lz4_literals_size(pos - anchor))
+            sequence = lz4_encode_sequence(data[anchor:pos], pos - ref, length)
+        block += sequence
+        pos   += length
+        anchor = pos
+    # last literals
+    yield from literals_blocks(end, 0)
+    if anchor < end:
+        block += lz4_encode_sequence(data[anchor:end])
+    if block:
+        yield start, bytes(block)
+
+
+def lz4_decompress_blocks(blocks, history=b""):
+    """Decompress blocks of lz4_compress_blocks (reference implementation of the BIOS's)
+
+    history is the data preceding the blocks (positions include it), that matches can reference.
+    """
+    r = bytearray(history)
+    for start, block in blocks:
+        assert start == len(r)
+        i = 0
+        while i < len(block):
+            token = block[i]
+            i += 1
+            def length(n):
+                nonlocal i
+                if n == 15:
+                    while True:
+                        c = block[i]
+                        i += 1
+                        n += c
+                        if c != 255:
+                            break
+                return n
+            n  = length(token >> 4)
+            r += block[i:i + n]
+            i += n
+            if i >= len(block):
+                break
+            offset = int.from_bytes(block[i:i + 2], "little")
+            i += 2
+            n = length(token & 15) + 4
+            for j in range(n):
+                r.append(r[-offset])
+    return bytes(r[len(history):])
 
 
 class SFLFrame:
@@ -127,9 +236,69 @@ class SFLFrame:
         packet += self.payload
         return packet
 
+    def encode_windowed(self, seq):
+        header = self.cmd + bytes([seq & 0xff])
+        packet = len(self.payload).to_bytes(2, "big")
+        packet += crc16(header + self.payload).to_bytes(2, "big")
+        packet += header
+        packet += self.payload
+        return packet
+
+
+class PatternMatcher:
+    """Incremental multi-pattern matcher over a stream of chunks
+
+    The end of the previous chunk is kept to detect the patterns spanning chunks.
+    """
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.keep = max(len(pattern) for pattern in patterns) - 1
+        self.tail = b""
+
+    def feed(self, data):
+        """Returns the (end position in data, pattern) of the patterns found, in stream order"""
+        buffer  = self.tail + data
+        matches = []
+        for pattern in self.patterns:
+            # only the occurrences ending in data
+            start = max(0, len(self.tail) - len(pattern) + 1)
+            while True:
+                i = buffer.find(pattern, start)
+                if i < 0:
+                    break
+                matches.append((i + len(pattern) - len(self.tail), pattern))
+                start = i + 1
+        self.tail = buffer[max(0, len(buffer) - self.keep):]
+        return sorted(matches)
+
+
+class TimestampedLog:
+    """Console log with the time since the start at the beginning of each line"""
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.start = time.time()
+        self.line_start = True
+
+    def write(self, data):
+        if not data:
+            return
+        # one timestamp per chunk
+        prefix = "[{:14.6f}] ".format(time.time() - self.start).encode()
+        data = data.replace(b"\n", b"\n" + prefix)
+        if self.line_start:
+            data = prefix + data
+        self.line_start = data.endswith(b"\n" + prefix)
+        if self.line_start:
+            data = data[:-len(prefix)]
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
 
 class LiteXTerm:
-    def __init__(self, serial_boot, kernel_image, kernel_address, json_images, no_crc, flash):
+    def __init__(self, serial_boot, kernel_image, kernel_address, json_images, no_crc, flash,
+        window=8, payload_length=1024, compress=False, verify=False, log=None):
         self.serial_boot = serial_boot
         assert not (kernel_image is not None and json_images is not None)
         self.mem_regions = {}
@@ -143,12 +312,24 @@ class LiteXTerm:
             f.close()
         self.no_crc = no_crc
         self.flash = flash
+        # Windowed mode: requested parameters, negotiated with the device at each boot
+        self.window = min(window, sfl_window_max)
+        self.payload_length = payload_length
+        self.windowed = False
+        # Windowed mode features: LZ4 compressed uploads, CRC32 verification of the regions
+        # (regions already in RAM are not uploaded again)
+        self.features = 0
+        if compress:
+            self.features |= sfl_feature_lz4
+        if verify:
+            self.features |= sfl_feature_verify
+        self.sfl_features = 0
 
         self.reader_alive = False
         self.writer_alive = False
 
-        self.prompt_detect_buffer = bytes(len(sfl_prompt_req))
-        self.magic_detect_buffer = bytes(len(sfl_magic_req))
+        self.matcher = PatternMatcher([sfl_prompt_req, sfl_magic_req])
+        self.log = None if log is None else TimestampedLog(log)
 
         self.console = Console()
 
@@ -161,6 +342,9 @@ class LiteXTerm:
         self.port = serial.serial_for_url(port, baudrate)
 
     def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
         if not hasattr(self, "port"):
             return
         self.port.close()
@@ -178,6 +362,8 @@ class LiteXTerm:
             self.sigint_time_last = sigint_time_current
 
     def send_frame(self, frame):
+        if self.windowed:
+            return self.send_frames([frame])
         retry = 1
         while retry:
             self.port.write(frame.encode())
@@ -195,39 +381,171 @@ class LiteXTerm:
                 retry = 0
         return 1
 
+    def configure_window(self):
+        """Negotiate the windowed mode with the device, returns False with a legacy BIOS"""
+        self.windowed = False
+        if self.no_crc or self.window < 2 or self.payload_length <= sfl_payload_length:
+            return False
+        frame = SFLFrame()
+        frame.cmd = sfl_cmd_config
+        features = 0 if self.flash else self.features
+        frame.payload = bytes([self.window]) + self.payload_length.to_bytes(2, "big") + bytes([features])
+        self.port.write(frame.encode())
+        reply = self.port.read()
+        if reply != sfl_ack_success:
+            # legacy BIOS: unknown command
+            return False
+        config = self.port.read(4)
+        self.sfl_window = config[0]
+        self.sfl_payload_length = int.from_bytes(config[1:3], "big")
+        self.sfl_features = config[3]
+        self.sfl_seq = 0
+        self.windowed = True
+        print("[LXTERM] Windowed upload: {} frames of {} bytes{}{}.".format(
+            self.sfl_window, self.sfl_payload_length,
+            ", LZ4" if self.sfl_features & sfl_feature_lz4 else "",
+            ", verify" if self.sfl_features & sfl_feature_verify else ""))
+        return True
+
+    def send_frames(self, frames, window=None, timeout=None):
+        """Send frames with up to window unacknowledged frames in flight (go-back-N)
+
+        Replies are 2 bytes (ack, sequence number): sfl_ack_success acknowledges all the frames up
+        to the sequence number, sfl_ack_crcerror asks to resend from the sequence number. All the
+        unacknowledged frames are resent when no reply is received for timeout (sfl_window_timeout
+        by default).
+        sfl_ack_error acknowledges the frames as well, with a negative result for the last one
+        (SFL_CMD_VERIFY); the result of the last frame is kept in sfl_last_ack.
+        """
+        frames  = iter(frames)
+        window  = self.sfl_window if window is None else window
+        pending = deque() # encoded frames not acknowledged, pending[0] has sequence number first
+        first   = self.sfl_seq
+        sent    = 0
+        retries = 0
+        port_timeout = self.port.timeout
+        self.port.timeout = sfl_window_timeout if timeout is None else timeout
+        try:
+            while True:
+                # fill the window
+                while len(pending) < window:
+                    frame = next(frames, None)
+                    if frame is None:
+                        break
+                    pending.append(frame.encode_windowed(first + len(pending)))
+                if not pending:
+                    break
+                if sent < len(pending):
+                    self.port.write(b"".join(list(pending)[sent:]))
+                    sent = len(pending)
+
+                # handle a reply
+                reply = self.port.read(2)
+                if len(reply) < 2:
+                    retries += 1
+                    if retries > sfl_window_max_retries:
+                        print("[LXTERM] No reply from the device, aborting.")
+                        return 0
+                    sent = 0
+                    continue
+                ack, seq = reply[0:1], reply[1]
+                n = ((seq - first) & 0xff) + 1 # frames up to seq
+                if ack in [sfl_ack_success, sfl_ack_error]:
+                    if n > sent:
+                        continue # duplicate ack
+                    retries = 0
+                    self.sfl_last_ack = ack
+                elif ack == sfl_ack_crcerror:
+                    n -= 1 # frames before seq
+                    if n >= sent:
+                        continue
+                    retries += 1
+                    if retries > sfl_window_max_retries:
+                        print("[LXTERM] Too many errors, aborting.")
+                        return 0
+                    sent = n
+                else:
+                    print("[LXTERM] Got unknown reply '{}' from the device, aborting.".format(ack))
+                    return 0
+                for i in range(n):
+                    pending.popleft()
+                first += n
+                sent  -= n
+        finally:
+            self.sfl_seq = first
+            self.port.timeout = port_timeout
+        return 1
+
+    def verify(self, address, data):
+        """Check the CRC32 of a RAM region against data
+
+        The BIOS does not read the UART while computing the CRC32 of the region: the reply timeout
+        is scaled with the length of the region to avoid resending the frame meanwhile.
+        """
+        frame = SFLFrame()
+        frame.cmd = sfl_cmd_verify
+        frame.payload = address.to_bytes(4, "big")
+        frame.payload += len(data).to_bytes(4, "big")
+        frame.payload += zlib.crc32(data).to_bytes(4, "big")
+        self.sfl_last_ack = None
+        if not self.send_frames([frame], timeout=sfl_window_timeout + len(data)/sfl_verify_rate):
+            return False
+        return self.sfl_last_ack == sfl_ack_success
+
     def upload(self, filename, address):
         f = open(filename, "rb")
-        f.seek(0, 2)
-        length = f.tell()
-        f.seek(0, 0)
-        print("[LXTERM] {} {} to 0x{:08x} ({} bytes)...".format(
-            "Flashing" if self.flash else "Uploading", filename, address, length))
-        current_address = address
-        position = 0
-        start = time.time()
-        remaining = length
-        while remaining:
+        data = f.read()
+        f.close()
+        length = len(data)
+        verify = self.windowed and (self.sfl_features & sfl_feature_verify)
+        if verify and self.verify(address, data):
+            print("[LXTERM] {} already at 0x{:08x}, skipped.".format(filename, address))
+            return length
+        compress = self.windowed and (self.sfl_features & sfl_feature_lz4)
+        print("[LXTERM] {} {} to 0x{:08x} ({} bytes{})...".format(
+            "Flashing" if self.flash else "Uploading", filename, address, length,
+            ", compressed" if compress else ""))
+        payload_length = self.sfl_payload_length - 4 if self.windowed else sfl_payload_length
+        def progress(position):
             sys.stdout.write("|{}>{}| {}%\r".format('=' * (20*position//length),
                                                     ' ' * (20-20*position//length),
                                                     100*position//length))
             sys.stdout.flush()
-            frame = SFLFrame()
-            frame_data = f.read(min(remaining, sfl_payload_length))
-            if self.flash:
-                frame.cmd = sfl_cmd_flash
+        def frames():
+            self.sent_bytes = 0
+            if compress:
+                blocks = lz4_compress_blocks(data, payload_length)
             else:
-                frame.cmd = sfl_cmd_load if not self.no_crc else sfl_cmd_load_no_crc
-            frame.payload = current_address.to_bytes(4, "big")
-            frame.payload += frame_data
-            if self.send_frame(frame) == 0:
-                return
-            current_address += len(frame_data)
-            position += len(frame_data)
-            remaining -= len(frame_data)
+                blocks = ((position, data[position:position + payload_length])
+                    for position in range(0, length, payload_length))
+            for position, block in blocks:
+                progress(position)
+                frame = SFLFrame()
+                if self.flash:
+                    frame.cmd = sfl_cmd_flash
+                elif compress:
+                    frame.cmd = sfl_cmd_load_lz4
+                else:
+                    frame.cmd = sfl_cmd_load if not self.no_crc else sfl_cmd_load_no_crc
+                frame.payload = (address + position).to_bytes(4, "big")
+                frame.payload += block
+                self.sent_bytes += len(block)
+                yield frame
+        start = time.time()
+        if self.windowed:
+            # flash writes are slow, keep a single frame in flight
+            status = self.send_frames(frames(), window=1 if self.flash else None)
+        else:
+            status = all(self.send_frame(frame) for frame in frames())
         end = time.time()
         elapsed = end - start
-        f.close()
-        print("[LXTERM] Upload complete ({0:.1f}KB/s).".format(length/(elapsed*1024)))
+        if not status:
+            return
+        if verify and not self.verify(address, data):
+            print("[LXTERM] CRC32 mismatch after upload of {}, aborting.".format(filename))
+            return
+        print("[LXTERM] Upload complete ({0:.1f}KB/s{1}).".format(length/(elapsed*1024),
+            ", ratio {:.2f}".format(length/max(self.sent_bytes, 1)) if compress else ""))
         return length
 
     def boot(self):
@@ -243,30 +561,18 @@ class LiteXTerm:
         frame.cmd = sfl_cmd_reboot
         self.send_frame(frame)
 
-    def detect_prompt(self, data):
-        if len(data):
-            self.prompt_detect_buffer = self.prompt_detect_buffer[1:] + data
-            return self.prompt_detect_buffer == sfl_prompt_req
-        else:
-            return False
-
     def answer_prompt(self):
         print("[LXTERM] Received serial boot prompt from the device.")
         self.port.write(sfl_prompt_ack)
 
-    def detect_magic(self, data):
-        if len(data):
-            self.magic_detect_buffer = self.magic_detect_buffer[1:] + data
-            return self.magic_detect_buffer == sfl_magic_req
-        else:
-            return False
-
     def answer_magic(self):
         print("[LXTERM] Received firmware download request from the device.")
         if(len(self.mem_regions)):
             self.port.write(sfl_magic_ack)
+            self.configure_window()
         for filename, base in self.mem_regions.items():
-            self.upload(filename, int(base, 16))
+            if self.upload(filename, int(base, 16)) is None:
+                return
         if self.flash:
             # clear mem_regions to avoid re-flashing on next reboot(s)
             self.mem_regions = {}
@@ -277,14 +583,18 @@ class LiteXTerm:
     def reader(self):
         try:
             while self.reader_alive:
-                c = self.port.read()
-                sys.stdout.buffer.write(c)
+                # wait for data, then read all the pending bytes at once
+                data = self.port.read(max(1, self.port.in_waiting))
+                sys.stdout.buffer.write(data)
                 sys.stdout.flush()
+                if self.log is not None:
+                    self.log.write(data)
                 if len(self.mem_regions):
-                    if self.serial_boot and self.detect_prompt(c):
-                        self.answer_prompt()
-                    if self.detect_magic(c):
-                        self.answer_magic()
+                    for position, pattern in self.matcher.feed(data):
+                        if pattern == sfl_prompt_req and self.serial_boot:
+                            self.answer_prompt()
+                        if pattern == sfl_magic_req:
+                            self.answer_magic()
 
         except serial.SerialException:
             self.reader_alive = False
@@ -352,12 +662,22 @@ def _get_args():
     parser.add_argument("--images", default=None, help="json description of the images to load to memory")
     parser.add_argument("--no-crc", default=False, action='store_true', help="disable CRC check (speedup serialboot)")
     parser.add_argument("--flash", default=False, action='store_true', help="flash data with serialboot command")
+    parser.add_argument("--sfl-window", default=8, type=int,
+                        help="frames in flight during serialboot (windowed mode, 1 to disable)")
+    parser.add_argument("--sfl-payload-length", default=1024, type=int,
+                        help="frame payload length requested for serialboot (windowed mode)")
+    parser.add_argument("--compress", default=False, action='store_true',
+                        help="LZ4 compressed serialboot uploads (windowed mode)")
+    parser.add_argument("--verify", default=False, action='store_true',
+                        help="CRC32 verification of the serialboot uploads (windowed mode)")
+    parser.add_argument("--log", default=None, help="log the console output to a file, with timestamps")
     return parser.parse_args()
 
 
 def main():
     args = _get_args()
-    term = LiteXTerm(args.serial_boot, args.kernel, args.kernel_adr, args.images, args.no_crc, args.flash)
+    term = LiteXTerm(args.serial_boot, args.kernel, args.kernel_adr, args.images, args.no_crc, args.flash,
+        args.sfl_window, args.sfl_payload_length, args.compress, args.verify, args.log)
     term.open(args.port, int(float(args.speed)))
     term.console.configure()
     term.start()
@@ -1,10 +1,28 @@
 # This file is Copyright (c) 2015-2019 Florent Kermarrec <florent@enjoy-digital.fr>
 # License: BSD
 
+import sys
 import mmap
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class CommPCIe:
+    """PCIe BAR access through the sysfs resource file
+
+    Bursts are done with a single mmap slice. Reads return a list of ints (default) or, with
+    format, "bytes" (raw little-endian words), "array" (array("I")) or "numpy" (uint32 array).
+    Writes accept an int, a list of ints, bytes-like objects (raw little-endian words),
+    array("I") or numpy arrays. view(base, size) maps a BAR region as a numpy array (or a
+    memoryview); views must be released before closing.
+    """
+    formats = ["list", "bytes", "array", "numpy"]
+
     def __init__(self, bar, debug=False):
         self.bar = bar
         self.debug = debug
@@ -24,23 +42,62 @@ class CommPCIe:
         self.sysfs.close()
         del self.sysfs
 
-    def read(self, addr, length=None):
-        data = []
-        length_int = 1 if length is None else length
-        for i in range(length_int):
-            self.mmap.seek(addr + 4*i)
-            value = int.from_bytes(self.mmap.read(4), byteorder="little")
+    def read(self, addr, length=None, format="list"):
+        if length is None:
+            value, = struct.unpack_from("<I", self.mmap, addr)
             if self.debug:
+                print("read {:08x} @ {:08x}".format(value, addr))
+            return value
+        if format not in self.formats:
+            raise ValueError("Invalid format {}, supported: {}".format(format, ", ".join(self.formats)))
+        data = self.mmap[addr:addr + 4*length]
+        if self.debug:
+            for i, value in enumerate(struct.unpack("<{}I".format(length), data)):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
-            if length is None:
-                return value
-            data.append(value)
-        return data
+        if format == "bytes":
+            return data
+        elif format == "array":
+            words = array("I")
+            words.frombytes(data)
+            if sys.byteorder == "big":
+                words.byteswap()
+            return words
+        elif format == "numpy":
+            if np is None:
+                raise ImportError("numpy is required for format=\"numpy\"")
+            return np.frombuffer(data, dtype="<u4")
+        else:
+            return list(struct.unpack("<{}I".format(length), data))
+
+    def _to_bytes(self, data):
+        # returns a byte view of the data, without copy when already in the wire format
+        if isinstance(data, int):
+            return memoryview(struct.pack("<I", data))
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return memoryview(data).cast("B")
+        if np is not None and isinstance(data, np.ndarray):
+            return memoryview(np.ascontiguousarray(data, dtype="<u4")).cast("B")
+        if not isinstance(data, array) or data.typecode != "I" or sys.byteorder == "big":
+            data = array("I", data)
+            if sys.byteorder == "big":
+                data.byteswap()
+        return memoryview(data).cast("B")
 
     def write(self, addr, data):
-        data = data if isinstance(data, list) else [data]
-        length = len(data)
-        for i, value in enumerate(data):
-            self.mmap[addr + 4*i:addr + 4*(i + 1)] = value.to_bytes(4, byteorder="little")
-            if self.debug:
+        data = self._to_bytes(data)
+        if len(data) % 4:
+            raise ValueError("Write data must be a multiple of 32-bit words")
+        self.mmap[addr:addr + len(data)] = data
+        if self.debug:
+            for i, value in enumerate(struct.unpack("<{}I".format(len(data)//4), data)):
                 print("write {:08x} @ {:08x}".format(value, addr + 4*i))
+
+    def view(self, base, size, format="numpy"):
+        """Map size bytes of the BAR at base as a uint32 numpy array (or memoryview)"""
+        if size % 4:
+            raise ValueError("View size must be a multiple of 32-bit words")
+        if format == "memoryview":
+            return memoryview(self.mmap)[base:base + size].cast("I")
+        if np is None:
+            raise ImportError("numpy is required for format=\"numpy\"")
+        return np.frombuffer(self.mmap, dtype="<u4", count=size//4, offset=base)
@@ -3,18 +3,40 @@
 
 import serial
 import struct
+from collections import deque
 
 
 class CommUART:
+    """UART bridge (WishboneStreamingBridge) host side
+
+    version=1: 8-bit lengths, bursts limited to 8 words (compatible with all the bridges), stale
+    bytes flushed before each operation.
+    version=2: 16-bit lengths (bursts up to 65535 words) and pipelined commands: writes do not wait
+    and read commands are sent ahead of the data of the previous read (requires a bridge with
+    the _v2 commands and a RX FIFO).
+    """
     msg_type = {
-        "write": 0x01,
-        "read":  0x02
+        "write":    0x01,
+        "read":     0x02,
+        "write_v2": 0x03,
+        "read_v2":  0x04,
     }
-    def __init__(self, port, baudrate=115200, debug=False):
+    def __init__(self, port, baudrate=115200, debug=False, version=1):
+        assert version in [1, 2]
         self.port = port
         self.baudrate = str(baudrate)
         self.debug = debug
+        self.version = version
+        if version == 1:
+            self.max_length = 8
+            self.max_pending_reads = 1
+        else:
+            self.max_length = 2**16 - 1
+            self.max_pending_reads = 2 # 2 read commands (14 bytes) fit in the bridge RX FIFO
         self.port = serial.serial_for_url(port, baudrate)
+        if version == 2:
+            # no flush before each operation with v2, discard stale bytes once
+            self._flush()
 
     def open(self):
         if hasattr(self, "port"):
@@ -28,50 +50,60 @@ class CommUART:
         del self.port
 
     def _read(self, length):
-        r = bytes()
+        r = bytearray()
         while len(r) < length:
             r += self.port.read(length - len(r))
         return r
 
     def _write(self, data):
-        remaining = len(data)
-        pos = 0
-        while remaining:
-            written = self.port.write(data[pos:])
-            remaining -= written
-            pos += written
+        data = memoryview(data)
+        while len(data):
+            written = self.port.write(data)
+            data = data[written:]
 
     def _flush(self):
         if self.port.inWaiting() > 0:
             self.port.read(self.port.inWaiting())
 
+    def _command(self, cmd, addr, length):
+        if self.version == 2:
+            return struct.pack(">BHI", self.msg_type[cmd + "_v2"], length, addr//4)
+        return struct.pack(">BBI", self.msg_type[cmd], length, addr//4)
+
+    def _chunks(self, addr, length):
+        for offset in range(0, length, self.max_length):
+            yield offset, addr + 4*offset, min(length - offset, self.max_length)
+
     def read(self, addr, length=None):
-        self._flush()
-        data = []
+        if self.version == 1:
+            self._flush()
         length_int = 1 if length is None else length
-        self._write([self.msg_type["read"], length_int])
-        self._write(list((addr//4).to_bytes(4, byteorder="big")))
-        for i in range(length_int):
-            value = int.from_bytes(self._read(4), "big")
-            if self.debug:
+        data    = []
+        pending = deque()
+        for offset, chunk_addr, chunk_length in self._chunks(addr, length_int):
+            if len(pending) >= self.max_pending_reads:
+                n = pending.popleft()
+                data += struct.unpack(">{}I".format(n), self._read(4*n))
+            self._write(self._command("read", chunk_addr, chunk_length))
+            pending.append(chunk_length)
+        while pending:
+            n = pending.popleft()
+            data += struct.unpack(">{}I".format(n), self._read(4*n))
+        if self.debug:
+            for i, value in enumerate(data):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
-            if length is None:
-                return value
-            data.append(value)
-        return data
+        return data[0] if length is None else data
 
     def write(self, addr, data):
-        self._flush()
+        if self.version == 1:
+            self._flush()
         data = data if isinstance(data, list) else [data]
-        length = len(data)
-        offset = 0
-        while length:
-            size = min(length, 8)
-            self._write([self.msg_type["write"], size])
-            self._write(list(((addr+offset)//4).to_bytes(4, byteorder="big")))
-            for i, value in enumerate(data[offset:offset+size]):
-                self._write(list(value.to_bytes(4, byteorder="big")))
-                if self.debug:
-                    print("write {:08x} @ {:08x}".format(value, addr + offset, 4*i))
-            offset += size
-            length -= size
+        # all the commands of the burst are sent at once
+        frame = bytearray()
+        for offset, chunk_addr, chunk_length in self._chunks(addr, len(data)):
+            frame += self._command("write", chunk_addr, chunk_length)
+            frame += struct.pack(">{}I".format(chunk_length), *data[offset:offset+chunk_length])
+        self._write(frame)
+        if self.debug:
+            for i, value in enumerate(data):
+                print("write {:08x} @ {:08x}".format(value, addr + 4*i))
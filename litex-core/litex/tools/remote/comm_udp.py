@@ -2,45 +2,203 @@
 # This file is Copyright (c) 2016 Tim 'mithro' Ansell <mithro@mithis.com>
 # License: BSD
 
+import time
+import struct
 import socket
+from collections import deque, OrderedDict
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
-from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import EtherboneFastPacket, EtherboneFastRecord
+from litex.tools.remote.etherbone import etherbone_packet_header_length, etherbone_record_header_length
+
+
+class CommUDPStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0   # records sent (without retransmissions)
+        self.retries  = 0   # records retransmitted
+        self.words    = 0   # words read/written
+        self.elapsed  = 0.0 # time spent in transfers
+        self.rtt_sum  = 0.0
+        self.rtt_min  = None
+        self.rtt_max  = 0.0
+        self.rtt_n    = 0
+
+    def add_rtt(self, rtt):
+        self.rtt_sum += rtt
+        self.rtt_min  = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max  = max(self.rtt_max, rtt)
+        self.rtt_n   += 1
+
+    @property
+    def rtt(self):
+        return self.rtt_sum/self.rtt_n if self.rtt_n else 0.0
+
+    @property
+    def words_per_second(self):
+        return self.words/self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return "requests: {} / retries: {} / rtt: {:.3f}ms (min {:.3f}ms, max {:.3f}ms) / {:.0f} words/s".format(
+            self.requests, self.retries,
+            1e3*self.rtt, 1e3*(self.rtt_min or 0.0), 1e3*self.rtt_max,
+            self.words_per_second)
+
+
+class CommUDPRequest:
+    def __init__(self, record, nreplies):
+        self.record   = record
+        self.nreplies = nreplies # number of words expected in the reply
+        self.datas    = None
+        self.tries    = 0
+        self.sent     = 0.0
 
 
 class CommUDP:
-    def __init__(self, server="192.168.1.50", port=1234, debug=False):
-        self.server = server
-        self.port = port
-        self.debug = debug
+    """Etherbone over UDP
+
+    Reads and writes are split in records of up to 255 words (fitting in the MTU), sent one record
+    per packet: the LiteEth Etherbone core only handles 1 record per frame. With `multi_records`,
+    records are packed in MTU-sized packets, for targets able to process several records per
+    packet. Up to `window` records are in flight; each record carries a tag in its base return
+    address (echoed by the board as the base address of the reply) to match replies to requests.
+    Records not answered after `timeout` seconds are retransmitted (up to `retries` times, then
+    TimeoutError is raised).
+
+    Etherbone does not reply to writes: by default, writes are sent once and not acknowledged.
+    With `ack_writes`, each write record also reads `ack_addr` (which must be an address without
+    read side effects, ex the ctrl scratch CSR) to acknowledge it, making writes retransmittable:
+    a write is then executed twice when its reply is lost, so this is only safe on memories or
+    registers without write side effects.
+
+    Transfer statistics (RTT, retries, words/s) are accumulated in `stats`.
+    """
+    def __init__(self, server="192.168.1.50", port=1234, debug=False,
+        local_port    = None,
+        window        = 8,
+        mtu           = 1500,
+        timeout       = 0.1,
+        retries       = 8,
+        multi_records = False,
+        ack_writes    = False,
+        ack_addr      = None):
+        if ack_writes and ack_addr is None:
+            raise ValueError("ack_writes requires an ack_addr without read side effects")
+        self.server        = server
+        self.port          = port
+        self.debug         = debug
+        self.local_port    = port if local_port is None else local_port
+        self.window        = window
+        self.timeout       = timeout
+        self.retries       = retries
+        self.multi_records = multi_records
+        self.ack_writes    = ack_writes
+        self.ack_addr      = ack_addr
+        self.tag           = 0
+        self.stats         = CommUDPStats()
+        # IPv4/UDP headers: 28 bytes, record: header + write base address + ack read (base return
+        # address + address) + datas.
+        self.payload_size = mtu - 28
+        self.max_words    = min(255, (self.payload_size - etherbone_packet_header_length -
+            etherbone_record_header_length - 3*4)//4)
 
     def open(self):
-        if hasattr(self, "tx_socket"):
+        if hasattr(self, "socket"):
             return
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(("", self.port))
+        self.socket.bind(("", self.local_port))
 
     def close(self):
-        if not hasattr(self, "tx_socket"):
+        if not hasattr(self, "socket"):
             return
         self.socket.close()
         del self.socket
 
+    # Transfers ------------------------------------------------------------------------------------
+
+    def _send(self, requests):
+        # one record per packet, or records packed in MTU-sized packets with multi_records
+        packet = EtherboneFastPacket()
+        for request in requests:
+            if packet.records and (not self.multi_records or
+                len(packet) + len(request.record) > self.payload_size):
+                self.socket.sendto(packet.encode(), (self.server, self.port))
+                packet = EtherboneFastPacket()
+            packet.records.append(request.record)
+        if packet.records:
+            self.socket.sendto(packet.encode(), (self.server, self.port))
+
+    def _receive(self, pending, timeout):
+        self.socket.settimeout(max(timeout, 0.0001))
+        try:
+            datas, addr = self.socket.recvfrom(65536)
+        except socket.timeout:
+            return
+        try:
+            packet = EtherboneFastPacket.decode_from(datas)
+        except (ValueError, struct.error):
+            return # not an Etherbone packet
+        now = time.perf_counter()
+        for record in packet.records:
+            request = pending.get(record.base_addr, None)
+            # ignore replies to requests already answered (retransmissions) or of wrong size
+            if request is None or record.wcount != request.nreplies:
+                continue
+            del pending[record.base_addr]
+            request.datas = record.wdatas
+            if request.tries == 1:
+                # only unambiguous RTT samples (Karn's algorithm)
+                self.stats.add_rtt(now - request.sent)
+
+    def _transfer(self, requests):
+        start   = time.perf_counter()
+        queue   = deque(requests)
+        pending = OrderedDict() # tag -> request, in send order
+        while queue or pending:
+            # fill the window
+            sent = []
+            while queue and len(pending) < self.window:
+                request = queue.popleft()
+                if request.tries == 0:
+                    self.tag = (self.tag + 1) & 0xffffffff
+                    request.record.base_ret_addr = self.tag
+                    self.stats.requests += 1
+                else:
+                    self.stats.retries += 1
+                request.tries += 1
+                request.sent = time.perf_counter()
+                pending[request.record.base_ret_addr] = request
+                sent.append(request)
+            self._send(sent)
+
+            # wait for replies until the oldest request expires
+            tag, oldest = next(iter(pending.items()))
+            self._receive(pending, oldest.sent + self.timeout - time.perf_counter())
+
+            # retransmit expired requests
+            now = time.perf_counter()
+            expired = [tag for tag, request in pending.items() if now - request.sent >= self.timeout]
+            for tag in reversed(expired):
+                request = pending.pop(tag)
+                if request.tries > self.retries:
+                    raise TimeoutError("No reply from {}:{} after {} retries".format(
+                        self.server, self.port, self.retries))
+                queue.appendleft(request)
+        self.stats.elapsed += time.perf_counter() - start
+
     def read(self, addr, length=None):
         length_int = 1 if length is None else length
-        record = EtherboneRecord()
-        record.reads = EtherboneReads(addrs=[addr+4*j for j in range(length_int)])
-        record.rcount = len(record.reads)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.socket.sendto(bytes(packet), (self.server, self.port))
-
-        datas, dummy = self.socket.recvfrom(8192)
-        packet = EtherbonePacket(datas)
-        packet.decode()
-        datas = packet.records.pop().writes.get_datas()
+        requests = []
+        for offset in range(0, length_int, self.max_words):
+            n = min(length_int - offset, self.max_words)
+            base = addr + 4*offset
+            requests.append(CommUDPRequest(EtherboneFastRecord(raddrs=range(base, base + 4*n, 4)), n))
+        self._transfer(requests)
+        self.stats.words += length_int
+        datas = []
+        for request in requests:
+            datas += request.datas.tolist()
         if self.debug:
             for i, value in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
@@ -48,16 +206,18 @@ class CommUDP:
 
     def write(self, addr, datas):
         datas = datas if isinstance(datas, list) else [datas]
-        length = len(datas)
-        record = EtherboneRecord()
-        record.writes = EtherboneWrites(base_addr=addr, datas=iter(datas))
-        record.wcount = len(record.writes)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.socket.sendto(bytes(packet), (self.server, self.port))
-
+        requests = []
+        for offset in range(0, len(datas), self.max_words):
+            base   = addr + 4*offset
+            record = EtherboneFastRecord(base_addr=base, wdatas=datas[offset:offset + self.max_words])
+            if self.ack_writes:
+                record.raddrs.append(self.ack_addr)
+            requests.append(CommUDPRequest(record, 1))
+        if self.ack_writes:
+            self._transfer(requests)
+        else:
+            self._send(requests)
+        self.stats.words += len(datas)
         if self.debug:
             for i, value in enumerate(datas):
                 print("write {:08x} @ {:08x}".format(value, addr + 4*i))
@@ -3,6 +3,7 @@
 
 import usb.core
 import time
+import struct
 
 # Wishbone USB Protocol Bridge
 # ============================
@@ -53,14 +54,46 @@ import time
 # Finally, the last two bytes indicate the length of the transaction.  Since
 # we only support 32-bit reads and writes, this is always 4.  On big endian
 # USB, this has the value {04, 00}.
+#
+# Bulk protocol
+# -------------
+#
+# Devices can advertise a faster bulk protocol with a vendor specific interface
+# (bInterfaceClass 0xff, bInterfaceSubClass 0x57) with one bulk OUT and one
+# bulk IN endpoint. Bursts are then framed on the bulk OUT endpoint:
+#
+# +----+----+--------+----------+-----------------+
+# | 01 | 00 | LENGTH | ADDRESS  | DATA (LENGTH*4) |   write burst
+# +----+----+--------+----------+-----------------+
+#   1    1      2         4
+#
+# +----+----+--------+----------+
+# | 02 | 00 | LENGTH | ADDRESS  |                     read burst
+# +----+----+--------+----------+
+#   1    1      2         4
+#
+# LENGTH is the number of 32-bit words (1-65535), ADDRESS the byte address of
+# the first word, all fields and words are little endian. The device answers
+# read bursts with LENGTH*4 bytes on the bulk IN endpoint. Single-word EP0
+# transfers remain the fallback when the interface is not present.
 
 class CommUSB:
-    def __init__(self, vid=None, pid=None, max_retries=10, debug=False):
+    bulk_interface_class    = 0xff
+    bulk_interface_subclass = 0x57
+    bulk_cmds = {
+        "write": 0x01,
+        "read":  0x02,
+    }
+    bulk_max_length = 2**16 - 1
+
+    def __init__(self, vid=None, pid=None, max_retries=10, debug=False, bulk=True, timeout=1000):
         self.vid = vid
         self.pid = pid
         self.debug = debug
         self.max_retries = max_retries
-        self.MAX_RECURSION_COUNT = 5
+        self.bulk = bulk       # use the bulk protocol when advertised by the device
+        self.timeout = timeout # bulk transfers timeout (ms)
+        self.bulk_endpoints = None
 
     def open(self):
         if hasattr(self, "dev"):
@@ -75,80 +108,128 @@ class CommUSB:
             if self.dev is not None:
                 if self.debug:
                     print("device connected after {} tries".format(t+1))
+                self.bulk_endpoints = self._find_bulk_endpoints() if self.bulk else None
                 return True
             del self.dev
             time.sleep(0.2 * t)
         print("unable to find usb device after {} tries".format(self.max_retries))
         return False
 
-
     def close(self):
         if not hasattr(self, "dev"):
             return
         del self.dev
 
-    def read(self, addr, length=None):
+    def _find_bulk_endpoints(self):
+        try:
+            configuration = self.dev.get_active_configuration()
+        except usb.core.USBError:
+            return None
+        for interface in configuration:
+            if (interface.bInterfaceClass    != self.bulk_interface_class or
+                interface.bInterfaceSubClass != self.bulk_interface_subclass):
+                continue
+            ep_in = ep_out = None
+            for endpoint in interface:
+                if endpoint.bmAttributes & 0x3 != 0x2: # bulk
+                    continue
+                if endpoint.bEndpointAddress & 0x80:
+                    ep_in = endpoint.bEndpointAddress
+                else:
+                    ep_out = endpoint.bEndpointAddress
+            if ep_in is not None and ep_out is not None:
+                if self.debug:
+                    print("using bulk endpoints: out 0x{:02x} / in 0x{:02x}".format(ep_out, ep_in))
+                return (ep_out, ep_in)
+        return None
+
+    def _reconnect(self):
+        self.close()
+        if not self.open():
+            raise IOError("unable to reconnect usb device")
+
+    def _retry(self, transaction, *args):
+        # errors are handled at the transaction level: reconnect and restart the transaction.
+        for retry in range(self.max_retries + 1):
+            try:
+                return transaction(*args)
+            except (usb.core.USBError, TypeError) as e:
+                if isinstance(e, usb.core.USBError) and e.errno == 13:
+                    print("Access Denied. Maybe try using sudo?")
+                if retry == self.max_retries:
+                    raise
+                self._reconnect()
+
+    # Bulk transactions ----------------------------------------------------------------------------
+
+    def _chunks(self, addr, length):
+        for offset in range(0, length, self.bulk_max_length):
+            yield offset, addr + 4*offset, min(length - offset, self.bulk_max_length)
+
+    def _bulk_read(self, addr, length):
+        ep_out, ep_in = self.bulk_endpoints
         data = []
-        length_int = 1 if length is None else length
-        for i in range(length_int):
-            value = self.usb_read(addr)
-            # Note that sometimes, the value ends up as None when the device
-            # disconnects during a transaction.  Paper over this fact by
-            # replacing it with a sentinal.
-            if value is None:
-                value = 0xffffffff
-            if self.debug:
-                print("read {:08x} @ {:08x}".format(value, addr))
-            if length is None:
-                return value
-            data.append(value)
+        for offset, chunk_addr, chunk_length in self._chunks(addr, length):
+            self.dev.write(ep_out, struct.pack("<BBHI", self.bulk_cmds["read"], 0, chunk_length, chunk_addr), self.timeout)
+            chunk = bytearray()
+            while len(chunk) < 4*chunk_length:
+                chunk += self.dev.read(ep_in, 4*chunk_length - len(chunk), self.timeout)
+            data += struct.unpack("<{}I".format(chunk_length), chunk)
         return data
 
-    def usb_read(self, addr, depth=0):
-        try:
-            value = self.dev.ctrl_transfer(bmRequestType=0xc3,
-                        bRequest=0x00,
-                        wValue=addr & 0xffff,
-                        wIndex=(addr >> 16) & 0xffff,
-                        data_or_wLength=4)
-            if value is None:
-                raise TypeError
-            return int.from_bytes(value, byteorder="little")
-        except usb.core.USBError as e:
-            if e.errno == 13:
-                print("Access Denied. Maybe try using sudo?")
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_read(addr, depth+1)
-        except TypeError:
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_read(addr, depth+1)
+    def _bulk_write(self, addr, data):
+        ep_out, ep_in = self.bulk_endpoints
+        for offset, chunk_addr, chunk_length in self._chunks(addr, len(data)):
+            frame  = struct.pack("<BBHI", self.bulk_cmds["write"], 0, chunk_length, chunk_addr)
+            frame += struct.pack("<{}I".format(chunk_length), *data[offset:offset + chunk_length])
+            self.dev.write(ep_out, frame, self.timeout)
 
-    def write(self, addr, data):
-        data = data if isinstance(data, list) else [data]
-        length = len(data)
-        for i, value in enumerate(data):
-            self.usb_write(addr, value)
-            if self.debug:
-                print("write {:08x} @ {:08x}".format(value, addr + 4*i))
+    # EP0 transactions -----------------------------------------------------------------------------
 
-    def usb_write(self, addr, value, depth=0):
-        try:
-            value = self.dev.ctrl_transfer(bmRequestType=0x43, bRequest=0x00,
+    def usb_read(self, addr):
+        value = self.dev.ctrl_transfer(bmRequestType=0xc3,
+                    bRequest=0x00,
                     wValue=addr & 0xffff,
                     wIndex=(addr >> 16) & 0xffff,
-                    data_or_wLength=bytes([(value >> 0) & 0xff,
-                                           (value >> 8) & 0xff,
-                                           (value >> 16) & 0xff,
-                                           (value >> 24) & 0xff]
-                                          ), timeout=None)
-        except usb.core.USBError as e:
-            if e.errno == 13:
-                print("Access Denied. Maybe try using sudo?")
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_write(addr, value, depth+1)
+                    data_or_wLength=4)
+        # Note that sometimes, the value ends up as None when the device
+        # disconnects during a transaction: TypeError triggers a reconnection.
+        if value is None:
+            raise TypeError
+        return int.from_bytes(value, byteorder="little")
+
+    def usb_write(self, addr, value):
+        self.dev.ctrl_transfer(bmRequestType=0x43, bRequest=0x00,
+                wValue=addr & 0xffff,
+                wIndex=(addr >> 16) & 0xffff,
+                data_or_wLength=value.to_bytes(4, byteorder="little"), timeout=None)
+
+    def _ctrl_read(self, addr, length):
+        return [self.usb_read(addr + 4*i) for i in range(length)]
+
+    def _ctrl_write(self, addr, data):
+        for i, value in enumerate(data):
+            self.usb_write(addr + 4*i, value)
+
+    # Read/Write -----------------------------------------------------------------------------------
+
+    def read(self, addr, length=None):
+        length_int = 1 if length is None else length
+        if self.bulk_endpoints is not None:
+            data = self._retry(self._bulk_read, addr, length_int)
+        else:
+            data = self._retry(self._ctrl_read, addr, length_int)
+        if self.debug:
+            for i, value in enumerate(data):
+                print("read {:08x} @ {:08x}".format(value, addr + 4*i))
+        return data[0] if length is None else data
+
+    def write(self, addr, data):
+        data = data if isinstance(data, list) else [data]
+        if self.bulk_endpoints is not None:
+            self._retry(self._bulk_write, addr, data)
+        else:
+            self._retry(self._ctrl_write, addr, data)
+        if self.debug:
+            for i, value in enumerate(data):
+                print("write {:08x} @ {:08x}".format(value, addr + 4*i))
@@ -22,7 +22,13 @@ class CSRElements:
 
 
 class CSRRegister:
-    def __init__(self, readfn, writefn, name, addr, length, data_width, mode):
+    """Remote CSR register
+
+    With shadow, the last value written (or read) is cached and used as the current value for
+    the read-modify-write of fields, which then do not need a bus read (and also work on
+    write-only registers).
+    """
+    def __init__(self, readfn, writefn, name, addr, length, data_width, mode, shadow=False):
         self.readfn = readfn
         self.writefn = writefn
         self.name = name
@@ -30,19 +36,27 @@ class CSRRegister:
         self.length = length
         self.data_width = data_width
         self.mode = mode
+        self.fields = CSRElements({})
+        self.shadow = shadow
+        self.shadow_value = None
+
+    def decode(self, datas):
+        """Combine the data_width words of the register (MSB first) in a value"""
+        if isinstance(datas, int):
+            return datas
+        data = 0
+        for i in range(self.length):
+            data = data << self.data_width
+            data |= datas[i]
+        return data
 
     def read(self):
         if self.mode not in ["rw", "ro"]:
             raise KeyError(self.name + "register not readable")
-        datas = self.readfn(self.addr, length=self.length)
-        if isinstance(datas, int):
-            return datas
-        else:
-            data = 0
-            for i in range(self.length):
-                data = data << self.data_width
-                data |= datas[i]
-            return data
+        data = self.decode(self.readfn(self.addr, length=self.length))
+        if self.shadow and self.mode == "rw":
+            self.shadow_value = data
+        return data
 
     def write(self, value):
         if self.mode not in ["rw", "wo"]:
@@ -51,6 +65,53 @@ class CSRRegister:
         for i in range(self.length):
             datas.append((value >> ((self.length-1-i)*self.data_width)) & (2**self.data_width-1))
         self.writefn(self.addr, datas)
+        if self.shadow:
+            # pulse fields are not retained
+            for field in self.fields.d.values():
+                if field.pulse:
+                    value &= ~field.mask
+            self.shadow_value = value
+
+    def clear_shadow(self):
+        self.shadow_value = None
+
+    def current(self):
+        """Current value of the register, from the shadow when valid"""
+        if self.shadow_value is not None:
+            return self.shadow_value
+        if self.mode == "wo":
+            raise KeyError(self.name + " register not readable and no shadow value")
+        return self.read()
+
+
+class CSRRegisterField:
+    """Field of a remote CSR register, writes are read-modify-writes of the register"""
+    def __init__(self, register, name, offset, size, access):
+        self.register = register
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.access = access
+        self.pulse = (access == "pulse")
+        self.mask = (2**size - 1) << offset
+
+    def decode(self, value):
+        return (value & self.mask) >> self.offset
+
+    def read(self):
+        if self.access not in ["rw", "ro"]:
+            raise KeyError(self.register.name + "." + self.name + " field not readable")
+        return self.decode(self.register.read())
+
+    def write(self, value):
+        if self.access == "ro":
+            raise KeyError(self.register.name + "." + self.name + " field not writable")
+        current = self.register.current()
+        # do not re-trigger the other pulse fields
+        for field in self.register.fields.d.values():
+            if field.pulse:
+                current &= ~field.mask
+        self.register.write((current & ~self.mask) | ((value << self.offset) & self.mask))
 
 
 class CSRMemoryRegion:
@@ -60,7 +121,7 @@ class CSRMemoryRegion:
         self.type = type
 
 class CSRBuilder:
-    def __init__(self, comm, csr_csv, csr_data_width=None):
+    def __init__(self, comm, csr_csv, csr_data_width=None, shadow=False):
         self.items = self.get_csr_items(csr_csv)
         self.constants = self.build_constants()
 
@@ -76,8 +137,40 @@ class CSRBuilder:
 
         self.csr_data_width = csr_data_width
         self.bases = self.build_bases()
-        self.regs = self.build_registers(comm.read, comm.write)
+        self.regs = self.build_registers(comm.read, comm.write, shadow)
         self.mems = self.build_memories()
+        self.readfn = comm.read
+
+    def bank_snapshot(self, name):
+        """Read all the readable registers of a CSR bank in a single burst
+
+        Returns the register values and the field values (as <register>_<field>), without the
+        bank prefix. Shadows of the registers are updated.
+        """
+        if name not in self.bases.d:
+            raise KeyError("No such CSR bank " + name)
+        base = self.bases.d[name]
+        end  = min([b for b in self.bases.d.values() if b > base], default=None)
+        regs = [reg for reg in self.regs.d.values()
+            if reg.mode in ["rw", "ro"] and reg.addr >= base and (end is None or reg.addr < end)]
+        if not regs:
+            return CSRElements({})
+        start  = min(reg.addr for reg in regs)
+        length = (max(reg.addr + 4*reg.length for reg in regs) - start)//4
+        datas  = self.readfn(start, length=length)
+        datas  = [datas] if isinstance(datas, int) else datas
+        d = {}
+        for reg in regs:
+            offset = (reg.addr - start)//4
+            value  = reg.decode(datas[offset:offset + reg.length])
+            if reg.shadow and reg.mode == "rw":
+                reg.shadow_value = value
+            short_name = reg.name[len(name) + 1:] if reg.name.startswith(name + "_") else reg.name
+            d[short_name] = value
+            for field in reg.fields.d.values():
+                if field.access in ["rw", "ro"]:
+                    d[short_name + "_" + field.name] = field.decode(value)
+        return CSRElements(d)
 
     @staticmethod
     def get_csr_items(csr_csv):
@@ -91,14 +184,20 @@ class CSRBuilder:
                 d[name] = int(addr.replace("0x", ""), 16)
         return CSRElements(d)
 
-    def build_registers(self, readfn, writefn):
+    def build_registers(self, readfn, writefn, shadow=False):
         d = {}
         for item in self.items:
             group, name, addr, length, mode = item
             if group == "csr_register":
                 addr = int(addr.replace("0x", ""), 16)
                 length = int(length)
-                d[name] = CSRRegister(readfn, writefn, name, addr, length, self.csr_data_width, mode)
+                d[name] = CSRRegister(readfn, writefn, name, addr, length, self.csr_data_width, mode, shadow)
+        for item in self.items:
+            group, name, offset, size, access = item
+            if group == "csr_field":
+                reg_name, field_name = name.split(".")
+                reg = d[reg_name]
+                reg.fields.d[field_name] = CSRRegisterField(reg, field_name, int(offset), int(size), access)
         return CSRElements(d)
 
     def build_constants(self):
@@ -2,8 +2,10 @@
 # This file is Copyright (c) 2017 Tim Ansell <mithro@mithis.com>
 # License: BSD
 
+import sys
 import math
 import struct
+from array import array
 
 from litex.soc.interconnect.stream_packet import HeaderField, Header
 
@@ -354,26 +356,239 @@ class EtherbonePacket(Packet):
         return r
 
 
+# Fast codec ---------------------------------------------------------------------------------------
+
+# The classes above model packets as lists of bytes: convenient to build/inspect packets but slow on
+# large bursts. EtherboneFastPacket/EtherboneFastRecord are wire-compatible with them but parse and
+# build packets directly from/to bytes-like objects (bytes, bytearray, memoryview) with struct, the
+# write datas/read addresses being stored as array("I") (big-endian on the wire).
+
+etherbone_packet_header_struct = struct.Struct(">HBB4x")
+etherbone_record_header_struct = struct.Struct(">BBBB")
+etherbone_record_flags = {"bca": 0, "rca": 1, "rff": 2, "cyc": 4, "wca": 5, "wff": 6}
+
+_swap_words = sys.byteorder == "little"
+
+
+def unpack_words(buffer, offset, count):
+    words = array("I")
+    words.frombytes(buffer[offset:offset + 4*count])
+    if _swap_words:
+        words.byteswap()
+    return words
+
+
+def pack_words_into(buffer, offset, words):
+    words = array("I", words)
+    if _swap_words:
+        words.byteswap()
+    end = offset + 4*len(words)
+    buffer[offset:end] = memoryview(words).cast("B")
+    return end
+
+
+class EtherboneFastRecord:
+    def __init__(self, base_addr=0, wdatas=[], base_ret_addr=0, raddrs=[], byte_enable=0xf, **flags):
+        self.base_addr     = base_addr
+        self.wdatas        = wdatas if isinstance(wdatas, array) else array("I", wdatas)
+        self.base_ret_addr = base_ret_addr
+        self.raddrs        = raddrs if isinstance(raddrs, array) else array("I", raddrs)
+        self.byte_enable   = byte_enable
+        for k in etherbone_record_flags.keys():
+            setattr(self, k, flags.pop(k, 0))
+        if flags:
+            raise TypeError("Unknown record flags: {}".format(", ".join(flags.keys())))
+
+    @property
+    def wcount(self):
+        return len(self.wdatas)
+
+    @property
+    def rcount(self):
+        return len(self.raddrs)
+
+    def __len__(self):
+        # writes and reads are each preceded by a base address
+        wcount, rcount = len(self.wdatas), len(self.raddrs)
+        return etherbone_record_header_length + 4*(wcount + (wcount != 0) + rcount + (rcount != 0))
+
+    @classmethod
+    def decode_from(cls, buffer, offset=0):
+        buffer = memoryview(buffer)
+        flags, byte_enable, wcount, rcount = etherbone_record_header_struct.unpack_from(buffer, offset)
+        record = cls(byte_enable=byte_enable,
+            **{k: (flags >> bit) & 0x1 for k, bit in etherbone_record_flags.items()})
+        offset += etherbone_record_header_length
+        if wcount:
+            record.base_addr, = struct.unpack_from(">I", buffer, offset)
+            record.wdatas = unpack_words(buffer, offset + 4, wcount)
+            offset += 4*(wcount + 1)
+        if rcount:
+            record.base_ret_addr, = struct.unpack_from(">I", buffer, offset)
+            record.raddrs = unpack_words(buffer, offset + 4, rcount)
+        return record
+
+    def encode_into(self, buffer, offset=0):
+        wcount, rcount = len(self.wdatas), len(self.raddrs)
+        if wcount > 255 or rcount > 255:
+            raise ValueError("Etherbone records are limited to 255 writes/reads")
+        flags = 0
+        for k, bit in etherbone_record_flags.items():
+            flags |= (getattr(self, k) & 0x1) << bit
+        etherbone_record_header_struct.pack_into(buffer, offset, flags, self.byte_enable, wcount, rcount)
+        offset += etherbone_record_header_length
+        if wcount:
+            struct.pack_into(">I", buffer, offset, self.base_addr)
+            offset = pack_words_into(buffer, offset + 4, self.wdatas)
+        if rcount:
+            struct.pack_into(">I", buffer, offset, self.base_ret_addr)
+            offset = pack_words_into(buffer, offset + 4, self.raddrs)
+        return offset
+
+    def __repr__(self):
+        return "Record: writes {} @ 0x{:08x}, reads {} -> 0x{:08x}".format(
+            len(self.wdatas), self.base_addr, len(self.raddrs), self.base_ret_addr)
+
+
+class EtherboneFastPacket:
+    def __init__(self, records=None, nr=0, pr=0, pf=0):
+        self.records   = [] if records is None else records
+        self.magic     = etherbone_magic
+        self.version   = etherbone_version
+        self.nr        = nr
+        self.pr        = pr
+        self.pf        = pf
+        self.addr_size = 32//8
+        self.port_size = 32//8
+
+    def __len__(self):
+        return etherbone_packet_header_length + sum(len(record) for record in self.records)
+
+    @classmethod
+    def decode_from(cls, buffer, offset=0, length=None):
+        """Decode the packet at offset, records spanning up to offset + length (end of buffer by default)"""
+        buffer = memoryview(buffer)
+        end = len(buffer) if length is None else offset + length
+        magic, flags, sizes = etherbone_packet_header_struct.unpack_from(buffer, offset)
+        if magic != etherbone_magic:
+            raise ValueError("Invalid Etherbone magic: 0x{:04x}".format(magic))
+        packet = cls(nr=(flags >> 2) & 0x1, pr=(flags >> 1) & 0x1, pf=flags & 0x1)
+        packet.version   = flags >> 4
+        packet.addr_size = sizes >> 4
+        packet.port_size = sizes & 0xf
+        offset += etherbone_packet_header_length
+        while offset < end:
+            record = EtherboneFastRecord.decode_from(buffer, offset)
+            packet.records.append(record)
+            offset += len(record)
+        return packet
+
+    def encode_into(self, buffer, offset=0):
+        """Encode the packet at offset, returns the offset following the packet"""
+        flags = (self.version << 4) | (self.nr << 2) | (self.pr << 1) | self.pf
+        sizes = (self.addr_size << 4) | self.port_size
+        etherbone_packet_header_struct.pack_into(buffer, offset, self.magic, flags, sizes)
+        offset += etherbone_packet_header_length
+        for record in self.records:
+            offset = record.encode_into(buffer, offset)
+        return offset
+
+    def encode(self):
+        buffer = bytearray(len(self))
+        self.encode_into(buffer)
+        return buffer
+
+    def __repr__(self):
+        r = "Packet: nr {} pr {} pf {}\n".format(self.nr, self.pr, self.pf)
+        for record in self.records:
+            r += record.__repr__() + "\n"
+        return r
+
+
+def etherbone_ipc_record_size(header):
+    """Size of the record starting with header (record header)"""
+    wcount, rcount = header[2], header[3]
+    # writes and reads are each preceded by a base address
+    return etherbone_record_header_length + 4*(wcount + (wcount != 0) + rcount + (rcount != 0))
+
+
+def etherbone_ipc_packet_size(header):
+    """Size of the single record IPC packet starting with header (packet and record headers)
+
+    Replies sent over TCP carry a single record: their size is given by the record counts. Requests
+    can carry several records and are framed record by record (see EtherboneIPCStream).
+    """
+    return etherbone_packet_header_length + etherbone_ipc_record_size(
+        header[etherbone_packet_header_length:])
+
+
+class EtherboneIPCStream:
+    """Frame a stream of Etherbone packets carrying any number of records
+
+    The number of records of a packet is not given by its header: the stream is parsed as packet
+    headers (starting with the Etherbone magic) and records. Since records are independent, the
+    records of a packet are returned as soon as they are complete: a packet split across several
+    receptions is returned as several packets (sharing the same header flags). A record header
+    starting with the magic bytes would have an invalid byte enable (0x6f) and is not supported.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.packet = None # packet receiving the following records
+
+    def feed(self, data):
+        """Add received data, returns the list of packets with complete records"""
+        self.buffer += data
+        magic   = etherbone_magic.to_bytes(2, "big")
+        offset  = 0
+        packets = []
+        while True:
+            remaining = len(self.buffer) - offset
+            if self.buffer[offset:offset + 2] == magic:
+                if remaining < etherbone_packet_header_length:
+                    break
+                self.packet = EtherboneFastPacket.decode_from(self.buffer, offset,
+                    etherbone_packet_header_length)
+                packets.append(self.packet)
+                offset += etherbone_packet_header_length
+            elif remaining >= etherbone_record_header_length:
+                if self.packet is None:
+                    raise ValueError("Etherbone record without packet header")
+                size = etherbone_ipc_record_size(self.buffer[offset:offset + etherbone_record_header_length])
+                if remaining < size:
+                    break
+                if self.packet not in packets:
+                    # continuation of a packet already returned
+                    self.packet = EtherboneFastPacket(nr=self.packet.nr, pr=self.packet.pr, pf=self.packet.pf)
+                    packets.append(self.packet)
+                self.packet.records.append(EtherboneFastRecord.decode_from(self.buffer, offset))
+                offset += size
+            else:
+                break
+        del self.buffer[:offset]
+        return [packet for packet in packets if packet.records]
+
+
 class EtherboneIPC:
     def send_packet(self, socket, packet):
-        socket.sendall(bytes(packet))
+        if not isinstance(packet, (bytes, bytearray, memoryview)):
+            packet = bytes(packet)
+        socket.sendall(packet)
 
     def receive_packet(self, socket):
         header_length = etherbone_packet_header_length + etherbone_record_header_length
-        packet = bytes()
-        while len(packet) < header_length:
-            chunk = socket.recv(header_length - len(packet))
-            if len(chunk) == 0:
-                return 0
-            else:
-                packet += chunk
-        wcount, rcount = struct.unpack(">BB", packet[header_length-2:])
-        counts = wcount + rcount
-        packet_size = header_length + 4*(counts + 1)
-        while len(packet) < packet_size:
-            chunk = socket.recv(packet_size - len(packet))
-            if len(chunk) == 0:
-                return 0
-            else:
-                packet += chunk
+        header = bytearray(header_length)
+        if not self._receive_into(socket, memoryview(header)):
+            return 0
+        packet = bytearray(etherbone_ipc_packet_size(header))
+        packet[:header_length] = header
+        if not self._receive_into(socket, memoryview(packet)[header_length:]):
+            return 0
         return packet
+
+    def _receive_into(self, socket, view):
+        while len(view):
+            n = socket.recv_into(view)
+            if n == 0:
+                return False
+            view = view[n:]
+        return True
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+# Etherbone codec benchmark: encodes/decodes burst packets with the list based codec
+# (EtherbonePacket) and the struct/memoryview based one (EtherboneFastPacket) and reports the
+# throughput in words per second.
+#
+# Usage:
+#   ./litex-core/test/benchmark_etherbone.py
+#   ./litex-core/test/benchmark_etherbone.py --burst=64 --records=4 --duration=2
+
+import time
+import random
+import argparse
+
+from litex.tools.remote.etherbone import *
+
+# Codecs -------------------------------------------------------------------------------------------
+
+def legacy_encode(base_addr, wdatas_list, raddrs_list):
+    packet = EtherbonePacket()
+    for wdatas, raddrs in zip(wdatas_list, raddrs_list):
+        record = EtherboneRecord()
+        record.writes = EtherboneWrites(base_addr=base_addr, datas=wdatas)
+        record.reads  = EtherboneReads(addrs=raddrs)
+        packet.records.append(record)
+    packet.encode()
+    return bytes(packet)
+
+
+def legacy_decode(buffer):
+    packet = EtherbonePacket(buffer)
+    packet.decode()
+    return packet
+
+
+def fast_encode(base_addr, wdatas_list, raddrs_list):
+    packet = EtherboneFastPacket()
+    for wdatas, raddrs in zip(wdatas_list, raddrs_list):
+        packet.records.append(EtherboneFastRecord(base_addr=base_addr, wdatas=wdatas, raddrs=raddrs))
+    return packet.encode()
+
+
+def fast_decode(buffer):
+    return EtherboneFastPacket.decode_from(buffer)
+
+
+codecs = {
+    "legacy": (legacy_encode, legacy_decode),
+    "fast":   (fast_encode,   fast_decode),
+}
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def measure(function, duration):
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return iterations/elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etherbone codec benchmark")
+    parser.add_argument("--burst",    default=255, type=int,   help="Writes and reads per record (max 255)")
+    parser.add_argument("--records",  default=1,   type=int,   help="Records per packet")
+    parser.add_argument("--duration", default=1.0, type=float, help="Duration of each measure (s)")
+    args = parser.parse_args()
+
+    prng   = random.Random(42)
+    wdatas = [[prng.randrange(2**32) for i in range(args.burst)] for r in range(args.records)]
+    raddrs = [[4*i for i in range(args.burst)] for r in range(args.records)]
+    words  = 2*args.burst*args.records
+
+    print("{:8s} {:>16s} {:>16s}".format("codec", "encode words/s", "decode words/s"))
+    results = {}
+    for name, (encode, decode) in codecs.items():
+        buffer = encode(0x1000, wdatas, raddrs)
+        encode_rate = measure(lambda: encode(0x1000, wdatas, raddrs), args.duration)*words
+        decode_rate = measure(lambda: decode(buffer), args.duration)*words
+        results[name] = (encode_rate, decode_rate)
+        print("{:8s} {:>16.0f} {:>16.0f}".format(name, encode_rate, decode_rate))
+    print("speedup  {:>15.1f}x {:>15.1f}x".format(
+        results["fast"][0]/results["legacy"][0],
+        results["fast"][1]/results["legacy"][1]))
+
+
+if __name__ == "__main__":
+    main()
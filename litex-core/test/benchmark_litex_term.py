@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+# litex_term console throughput benchmark: streams data through a pseudo-terminal to the
+# LiteXTerm reader (and to the previous byte per byte reader) and reports the sustained
+# throughput in bytes per second.
+#
+# Usage:
+#   ./litex-core/test/benchmark_litex_term.py
+#   ./litex-core/test/benchmark_litex_term.py --size=16 --log=/tmp/console.log
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from unittest import mock
+
+import serial
+
+from litex.tools.litex_term import LiteXTerm
+
+# Harness ------------------------------------------------------------------------------------------
+
+class Sink:
+    """stdout stand-in counting the bytes written by the reader"""
+    def __init__(self, term, size, keep=False):
+        self.term     = term
+        self.size     = size
+        self.received = 0
+        self.data     = bytearray() if keep else None
+        self.buffer   = self
+        self.done     = threading.Event()
+
+    def write(self, data):
+        self.received += len(data)
+        if self.data is not None:
+            self.data += data
+        if self.received >= self.size:
+            self.term.reader_alive = False
+            self.done.set()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def legacy_reader(term):
+    # byte per byte reader, with a flush per byte and per byte pattern detection
+    prompt_detect_buffer = bytes(14)
+    while term.reader_alive:
+        c = term.port.read()
+        sys.stdout.buffer.write(c)
+        sys.stdout.flush()
+        prompt_detect_buffer = prompt_detect_buffer[1:] + c
+
+
+readers = {
+    "legacy": legacy_reader,
+    "bulk":   LiteXTerm.reader,
+}
+
+
+def new_term(**kwargs):
+    with mock.patch("litex.tools.litex_term.Console"):
+        with mock.patch("signal.signal"):
+            term = LiteXTerm(False, None, None, None, False, False, **kwargs)
+    return term
+
+
+def run_pty(term, reader, data, chunk=4096, keep=False):
+    """Stream data through a pty to the reader of term, returns (bytes/s, sink)"""
+    master, slave = os.openpty()
+    term.port = serial.Serial(os.ttyname(slave))
+    sink = Sink(term, len(data), keep)
+
+    def writer():
+        view = memoryview(data)
+        while len(view):
+            view = view[os.write(master, view[:chunk]):]
+
+    term.reader_alive = True
+    thread = threading.Thread(target=writer)
+    try:
+        with mock.patch("sys.stdout", sink):
+            start = time.perf_counter()
+            thread.start()
+            reader(term)
+            elapsed = time.perf_counter() - start
+    finally:
+        thread.join()
+        term.close()
+        os.close(master)
+        os.close(slave)
+    return len(data)/elapsed, sink
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="litex_term console throughput benchmark")
+    parser.add_argument("--size", default=4,    type=float, help="Data size (MB)")
+    parser.add_argument("--log",  default=None,             help="Log the console to a file")
+    args = parser.parse_args()
+
+    prng = random.Random(42)
+    line = lambda i: "[{:12.6f}] boot log line {} {}\n".format(i*1e-4, i, "x"*prng.randrange(40))
+    data = bytearray()
+    while len(data) < args.size*1e6:
+        data += line(len(data)).encode()
+
+    print("{:8s} {:>16s}".format("reader", "bytes/s"))
+    for name, reader in readers.items():
+        term = new_term(log=args.log if name == "bulk" else None)
+        rate, sink = run_pty(term, reader, bytes(data))
+        print("{:8s} {:>16.0f}".format(name, rate))
+
+
+if __name__ == "__main__":
+    main()
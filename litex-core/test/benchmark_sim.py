@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+# Simulator benchmark: runs existing unit test suites and wide datapath micro-benchmarks with the
+# different simulation engines (interpreted/compiled, full/event-driven comb propagation) and
+# reports simulated cycles per second and comb statements evaluated per cycle.
+#
+# Usage (from the repository root, with litex/litedram/liteeth in the PYTHONPATH):
+#   ./litex-core/test/benchmark_sim.py test.test_ecc
+#   ./litex-core/test/benchmark_sim.py --engines=compiled,compiled+event litedram/test/test_bist.py
+#   ./litex-core/test/benchmark_sim.py micro                  (all micro-benchmarks)
+#   ./litex-core/test/benchmark_sim.py cache512 converter256  (selected micro-benchmarks)
+
+import os
+import sys
+import time
+import argparse
+import unittest
+import random
+import importlib.util
+
+from migen import *
+
+from litex.gen.sim import core
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect import wishbone
+
+# Simulator wrapper --------------------------------------------------------------------------------
+
+class SimulatorStats:
+    def __init__(self):
+        self.cycles          = 0
+        self.comb_statements = 0
+        self.sync_skipped    = 0
+        self.elapsed         = 0.0 # setup (compilation) and run time
+
+
+engines = {
+    "interpreted":    dict(compiled=False, event_driven=False),
+    "event":          dict(compiled=False, event_driven=True),
+    "compiled":       dict(compiled=True,  event_driven=False),
+    "compiled+event": dict(compiled=True,  event_driven=True),
+}
+
+
+def instrument_simulator(engine, stats):
+    base = core.Simulator
+
+    class BenchmarkSimulator(base):
+        def __init__(self, *args, **kwargs):
+            for k, v in engines[engine].items():
+                kwargs.setdefault(k, v)
+            start = time.perf_counter()
+            base.__init__(self, *args, **kwargs)
+            stats.elapsed += time.perf_counter() - start
+
+        def run(self):
+            start = time.perf_counter()
+            try:
+                base.run(self)
+            finally:
+                stats.elapsed         += time.perf_counter() - start
+                stats.cycles          += self.cycles
+                stats.comb_statements += self.comb_statements
+                stats.sync_skipped    += self.sync_skipped
+
+    core.Simulator = BenchmarkSimulator
+    return base
+
+# Suites -------------------------------------------------------------------------------------------
+
+def load_suite(name):
+    loader = unittest.TestLoader()
+    if os.path.isfile(name):
+        directory = os.path.dirname(os.path.abspath(name))
+        # allow test modules relying on relative/sibling imports (common.py, ...)
+        sys.path.insert(0, os.path.dirname(directory))
+        sys.path.insert(0, directory)
+        # suites of different cores all live in a "test" package, forget the previous one
+        for module in [m for m in sys.modules if m == "test" or m.startswith("test.")]:
+            del sys.modules[module]
+        module_name = os.path.splitext(os.path.basename(name))[0]
+        spec   = importlib.util.spec_from_file_location(module_name, name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return loader.loadTestsFromModule(module)
+    return loader.loadTestsFromName(name)
+
+
+def run_suite(name, engine, verbosity):
+    stats = SimulatorStats()
+    base  = instrument_simulator(engine, stats)
+    try:
+        suite  = load_suite(name)
+        result = unittest.TextTestRunner(verbosity=verbosity, stream=sys.stderr).run(suite)
+    finally:
+        core.Simulator = base
+    return stats, result.wasSuccessful()
+
+# Micro-benchmarks (wide datapaths) ---------------------------------------------------------------
+
+class ConverterDUT(Module):
+    def __init__(self, nbits):
+        # nbits -> 32 -> nbits: both down and up conversions of a wide stream
+        self.submodules.down = stream.Converter(nbits, 32)
+        self.submodules.up   = stream.Converter(32, nbits)
+        self.comb += self.down.source.connect(self.up.sink)
+        self.sink   = self.down.sink
+        self.source = self.up.source
+
+
+def converter_generators(nbits, length=64):
+    dut   = ConverterDUT(nbits)
+    prng  = random.Random(42)
+    datas = [prng.randrange(2**nbits) for i in range(length)]
+    dut.errors = 0
+
+    def generator():
+        for data in datas:
+            yield dut.sink.valid.eq(1)
+            yield dut.sink.data.eq(data)
+            yield
+            while (yield dut.sink.ready) == 0:
+                yield
+        yield dut.sink.valid.eq(0)
+
+    def checker():
+        yield dut.source.ready.eq(1)
+        for data in datas:
+            yield
+            while (yield dut.source.valid) == 0:
+                yield
+            if (yield dut.source.data) != data:
+                dut.errors += 1
+
+    return dut, [generator(), checker()]
+
+
+class CacheDUT(Module):
+    def __init__(self, nbits, cachesize=64, sram_size=4096):
+        self.master = wishbone.Interface(32)
+        self.slave  = wishbone.Interface(nbits)
+        self.submodules.cache = wishbone.Cache(cachesize, self.master, self.slave)
+        self.submodules.sram  = wishbone.SRAM(sram_size, bus=self.slave)
+
+
+def cache_generators(nbits, length=64):
+    dut  = CacheDUT(nbits)
+    prng = random.Random(42)
+    # addresses spanning more than the cache size to exercise line refills/write-backs
+    adrs = [prng.randrange(1024) for i in range(length)]
+    ref  = dict()
+    dut.errors = 0
+
+    def generator():
+        for adr in adrs:
+            data = prng.randrange(2**32)
+            yield from dut.master.write(adr, data)
+            ref[adr] = data
+        for adr in adrs:
+            if (yield from dut.master.read(adr)) != ref[adr]:
+                dut.errors += 1
+
+    return dut, [generator()]
+
+
+micro_benchmarks = {}
+for nbits in [128, 256, 512]:
+    micro_benchmarks["converter{}".format(nbits)] = lambda nbits=nbits: converter_generators(nbits)
+    micro_benchmarks["cache{}".format(nbits)]     = lambda nbits=nbits: cache_generators(nbits)
+
+
+def run_micro(name, engine):
+    stats = SimulatorStats()
+    base  = instrument_simulator(engine, stats)
+    try:
+        dut, generators = micro_benchmarks[name]()
+        core.run_simulation(dut, generators)
+    finally:
+        core.Simulator = base
+    return stats, dut.errors == 0
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="LiteX Simulator benchmark")
+    parser.add_argument("suites", nargs="+",                              help="Test modules (dotted names or files), micro-benchmarks ({}) or micro (all micro-benchmarks)".format(", ".join(micro_benchmarks.keys())))
+    parser.add_argument("--engines", default=",".join(engines.keys()),   help="Engines to benchmark, comma separated ({})".format(", ".join(engines.keys())))
+    parser.add_argument("--verbosity", default=0, type=int,               help="unittest verbosity")
+    args = parser.parse_args()
+
+    print("{:40s} {:16s} {:>10s} {:>10s} {:>12s} {:>12s} {:>12s} {:>8s}".format(
+        "suite", "engine", "cycles", "time (s)", "cycles/s", "stmts/cycle", "sync skipped", "status"))
+    suites = []
+    for suite in args.suites:
+        suites += list(micro_benchmarks.keys()) if suite == "micro" else [suite]
+    for suite in suites:
+        for engine in args.engines.split(","):
+            if suite in micro_benchmarks:
+                stats, success = run_micro(suite, engine)
+            else:
+                stats, success = run_suite(suite, engine, args.verbosity)
+            print("{:40s} {:16s} {:>10d} {:>10.2f} {:>12.0f} {:>12.1f} {:>12d} {:>8s}".format(
+                suite[-40:], engine, stats.cycles, stats.elapsed,
+                stats.cycles/stats.elapsed if stats.elapsed else 0,
+                stats.comb_statements/stats.cycles if stats.cycles else 0,
+                stats.sync_skipped,
+                "ok" if success else "FAILED"), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,8 +25,9 @@ class Burst:
                 offset = i*2**(self.size)
                 r += [Beat(self.addr + offset)]
             elif self.type == BURST_WRAP:
-                offset = (i*2**(self.size))%((2**self.size)*(self.len + 1))
-                r += [Beat(self.addr + offset)]
+                wrap   = 2**(self.size)*(self.len + 1)
+                offset = (self.addr + i*2**(self.size))%wrap
+                r += [Beat(self.addr - self.addr%wrap + offset)]
             else:
                 r += [Beat(self.addr)]
         return r
@@ -99,6 +100,9 @@ class TestAXI(unittest.TestCase):
             bursts.append(Burst(prng.randrange(2**32), BURST_FIXED, prng.randrange(255), log2_int(32//8)))
             bursts.append(Burst(prng.randrange(2**32), BURST_INCR, prng.randrange(255), log2_int(32//8)))
         bursts.append(Burst(4, BURST_WRAP, 4-1, log2_int(2)))
+        for i in range(32):
+            bursts.append(Burst(prng.randrange(2**32) & ~0x3, BURST_WRAP,
+                prng.choice([2, 4, 8, 16]) - 1, log2_int(32//8)))
 
         # generate expected dut output (beats for reference)
         beats = []
@@ -358,5 +362,5 @@ class TestAXI(unittest.TestCase):
                     dut.errors += 1
 
         dut = DUT()
-        run_simulation(dut, [generator(dut)], vcd_name="toto.vcd")
+        run_simulation(dut, [generator(dut)])
         self.assertEqual(dut.errors, 0)
@@ -0,0 +1,297 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import os
+import random
+import tempfile
+import zlib
+import unittest
+from unittest import mock
+
+from litex.tools.litex_term import *
+
+
+def crc16_reference(data):
+    crc = 0
+    for d in data:
+        crc ^= d << 8
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+    return crc & 0xffff
+
+
+class SFLDevice:
+    """Model of the BIOS serialboot handler (legacy and windowed modes), used as serial port
+
+    Frames are processed as they are written. Frames in `corrupt` (receive order) fail the CRC
+    check, frames in `lost` are silently dropped: in both cases the rest of the write is
+    discarded (as the BIOS drains the frames in flight).
+    """
+    def __init__(self, windowed=True, corrupt=[], lost=[], features=sfl_feature_lz4 | sfl_feature_verify):
+        self.supports_windowed = windowed
+        self.supports_features = features
+        self.corrupt  = set(corrupt)
+        self.lost     = set(lost)
+        self.mem      = bytearray(0x10000)
+        self.rx       = bytearray()
+        self.tx       = bytearray()
+        self.timeout  = None
+        self.windowed = False
+        self.expected = 0
+        self.last_ack = sfl_ack_success
+        self.nak_sent = False
+        self.commands = []
+        self.received = 0
+        self.reads    = 0
+        self.booted   = None
+        self.verify_timeouts = []
+
+    # Serial port
+    def write(self, data):
+        if data == sfl_magic_ack:
+            return len(data)
+        self.rx += data
+        while self.process():
+            pass
+        return len(data)
+
+    def read(self, length=1):
+        self.reads += 1
+        data = bytes(self.tx[:length])
+        del self.tx[:length]
+        return data
+
+    # Handler
+    def execute(self, cmd, payload):
+        self.commands.append(cmd)
+        addr = int.from_bytes(payload[:4], "big")
+        if cmd in [sfl_cmd_load, sfl_cmd_load_no_crc]:
+            self.mem[addr:addr + len(payload) - 4] = payload[4:]
+        elif cmd == sfl_cmd_load_lz4:
+            # matches can reference the data of the previous blocks, in memory
+            data = lz4_decompress_blocks([(addr, payload[4:])], history=self.mem[:addr])
+            self.mem[addr:addr + len(data)] = data
+        elif cmd == sfl_cmd_verify:
+            self.verify_timeouts.append(self.timeout)
+            size = int.from_bytes(payload[4:8], "big")
+            crc  = int.from_bytes(payload[8:12], "big")
+            return sfl_ack_success if zlib.crc32(self.mem[addr:addr + size]) == crc else sfl_ack_error
+        elif cmd == sfl_cmd_jump:
+            self.booted = addr
+        return sfl_ack_success
+
+    def process(self):
+        header_length = 6 if self.windowed else 4
+        if len(self.rx) < header_length:
+            return False
+        if self.windowed:
+            length = int.from_bytes(self.rx[0:2], "big")
+        else:
+            length = self.rx[0]
+        if len(self.rx) < header_length + length:
+            return False
+        frame = bytes(self.rx[:header_length + length])
+        del self.rx[:header_length + length]
+        crc = int.from_bytes(frame[header_length - 4:header_length - 2] if self.windowed else frame[1:3], "big")
+        if self.received in self.corrupt:
+            crc ^= 1
+        self.received += 1
+        if self.received - 1 in self.lost:
+            self.rx.clear()
+            return False
+        cmd = frame[4:5] if self.windowed else frame[3:4]
+        payload = frame[header_length:]
+
+        if not self.windowed:
+            if crc != crc16(frame[3:]):
+                self.tx += sfl_ack_crcerror
+            elif cmd == sfl_cmd_config and self.supports_windowed:
+                self.features = payload[3] & self.supports_features
+                self.tx += sfl_ack_success
+                self.tx += bytes([min(payload[0], sfl_window_max)]) + payload[1:3] + bytes([self.features])
+                self.windowed = True
+            elif cmd == sfl_cmd_config:
+                self.tx += sfl_ack_unknown
+            else:
+                self.execute(cmd, payload)
+                self.tx += sfl_ack_success
+            return True
+
+        seq = frame[5]
+        if crc != crc16(frame[4:]):
+            self.rx.clear()
+            self.tx += sfl_ack_crcerror + bytes([self.expected])
+            self.nak_sent = True
+            return False
+        if seq != self.expected:
+            if (seq - self.expected) & 0xff < 128:
+                if not self.nak_sent:
+                    self.tx += sfl_ack_crcerror + bytes([self.expected])
+                self.nak_sent = True
+            else:
+                self.tx += self.last_ack + bytes([(self.expected - 1) & 0xff])
+            return True
+        self.nak_sent = False
+        self.expected = (self.expected + 1) & 0xff
+        self.last_ack = self.execute(cmd, payload)
+        self.tx += self.last_ack + bytes([seq])
+        return True
+
+
+class TestLiteXTerm(unittest.TestCase):
+    def setUp(self):
+        prng = random.Random(42)
+        # partly compressible data
+        self.data = bytes(prng.randrange(256) for i in range(10000))
+        self.data += b"".join(b"LiteX %d\n" % (i//16) for i in range(2000))[:10000]
+        self.image = tempfile.NamedTemporaryFile(suffix=".bin", delete=False)
+        self.image.write(self.data)
+        self.image.close()
+
+    def tearDown(self):
+        os.remove(self.image.name)
+
+    def boot(self, device, check=True, **kwargs):
+        with mock.patch("litex.tools.litex_term.Console"):
+            term = LiteXTerm(False, self.image.name, "0x00001000", None, False, False, **kwargs)
+        term.port = device
+        with mock.patch("sys.stdout"):
+            term.answer_magic()
+        if not check:
+            return term
+        self.assertEqual(bytes(device.mem[0x1000:0x1000 + len(self.data)]), self.data)
+        self.assertEqual(device.booted, 0x1000)
+        return term
+
+    def test_crc16(self):
+        prng = random.Random(0)
+        for n in [0, 1, 2, 255, 1024]:
+            data = bytes(prng.randrange(256) for i in range(n))
+            self.assertEqual(crc16(data), crc16_reference(data))
+
+    def test_legacy_device(self):
+        device = SFLDevice(windowed=False)
+        term   = self.boot(device)
+        self.assertFalse(term.windowed)
+
+    def test_legacy_mode(self):
+        device = SFLDevice()
+        term   = self.boot(device, window=1)
+        self.assertFalse(term.windowed)
+        self.assertGreater(device.reads, len(self.data)//sfl_payload_length)
+
+    def test_windowed(self):
+        device = SFLDevice()
+        term   = self.boot(device)
+        self.assertTrue(term.windowed)
+        self.assertEqual(term.sfl_payload_length, 1024)
+        # one read per ack, frames of 1020 bytes
+        self.assertLess(device.reads, len(self.data)//1000 + 8)
+
+    def test_windowed_crc_errors(self):
+        device = SFLDevice(corrupt=[2, 5, 6, 12])
+        term   = self.boot(device, window=4)
+        self.assertTrue(term.windowed)
+
+    @mock.patch("litex.tools.litex_term.sfl_window_timeout", 0.01)
+    def test_windowed_lost_frames(self):
+        device = SFLDevice(lost=[3, 8])
+        self.boot(device)
+
+    def test_lz4(self):
+        prng = random.Random(1)
+        datas = [
+            bytes(100000),
+            bytes(prng.randrange(256) for i in range(5000)),
+            bytes(prng.choice(b"ab") for i in range(20000)),
+        ]
+        for data in datas:
+            for block_size in [24, 1020]:
+                blocks = list(lz4_compress_blocks(data, block_size))
+                self.assertTrue(all(len(block) <= block_size for _, block in blocks))
+                self.assertEqual(lz4_decompress_blocks(blocks), data)
+        self.assertLess(sum(len(block) for _, block in lz4_compress_blocks(bytes(100000), 1020)), 500)
+
+    def test_windowed_compressed(self):
+        device = SFLDevice(corrupt=[4])
+        term   = self.boot(device, compress=True)
+        self.assertIn(sfl_cmd_load_lz4, device.commands)
+        self.assertNotIn(sfl_cmd_load, device.commands)
+        self.assertLess(term.sent_bytes, 0.8*len(self.data))
+
+    def test_windowed_features_not_supported(self):
+        device = SFLDevice(features=0)
+        term   = self.boot(device, compress=True, verify=True)
+        self.assertEqual(term.sfl_features, 0)
+        self.assertNotIn(sfl_cmd_load_lz4, device.commands)
+        self.assertNotIn(sfl_cmd_verify, device.commands)
+
+    def test_windowed_no_verify(self):
+        # verification is opt-in
+        device = SFLDevice()
+        self.boot(device)
+        self.assertNotIn(sfl_cmd_verify, device.commands)
+
+    def test_windowed_verify(self):
+        device = SFLDevice()
+        self.boot(device, verify=True)
+        self.assertEqual(device.commands.count(sfl_cmd_verify), 2)
+        # reply timeout scaled with the length of the region
+        self.assertEqual(device.verify_timeouts, 2*[sfl_window_timeout + len(self.data)/sfl_verify_rate])
+        # warm reboot: the image is already in RAM and not uploaded again
+        device.windowed = False
+        device.expected = 0
+        device.commands = []
+        self.boot(device, verify=True)
+        self.assertEqual(device.commands, [sfl_cmd_verify, sfl_cmd_jump])
+
+    def test_windowed_verify_error(self):
+        device = SFLDevice()
+        device.execute = lambda cmd, payload: sfl_ack_error if cmd == sfl_cmd_verify else sfl_ack_success
+        term = self.boot(device, check=False, verify=True)
+        self.assertIsNone(device.booted)
+
+
+class TestPatternMatcher(unittest.TestCase):
+    def test_chunks(self):
+        stream = b"xx" + sfl_prompt_req + b"y"*20 + sfl_magic_req + sfl_magic_req + b"z"
+        expected = []
+        for pattern in [sfl_prompt_req, sfl_magic_req]:
+            i = stream.find(pattern)
+            while i >= 0:
+                expected.append((i + len(pattern), pattern))
+                i = stream.find(pattern, i + 1)
+        expected.sort()
+        for chunk in [1, 3, 7, 14, 100]:
+            matcher = PatternMatcher([sfl_prompt_req, sfl_magic_req])
+            matches = []
+            for offset in range(0, len(stream), chunk):
+                for position, pattern in matcher.feed(stream[offset:offset + chunk]):
+                    matches.append((offset + position, pattern))
+            self.assertEqual(matches, expected)
+
+
+class TestConsole(unittest.TestCase):
+    def test_log(self):
+        with tempfile.TemporaryDirectory() as d:
+            log = TimestampedLog(os.path.join(d, "console.log"))
+            for chunk in [b"BIOS", b" built\nline 1\n", b"\n", b"line", b" 3\n"]:
+                log.write(chunk)
+            log.close()
+            lines = open(os.path.join(d, "console.log"), "rb").read().split(b"\n")
+        self.assertEqual([line[17:] for line in lines], [b"BIOS built", b"line 1", b"", b"line 3", b""])
+        self.assertTrue(all(line.startswith(b"[") for line in lines[:-1]))
+
+    def test_pty_reader(self):
+        from test.benchmark_litex_term import new_term, run_pty
+        prng = random.Random(0)
+        data = bytes(prng.randrange(256) for i in range(200000))
+        data = data[:100000] + sfl_magic_req + data[100000:]
+        term = new_term()
+        term.mem_regions = {"image.bin": "0x40000000"}
+        term.answer_magic = mock.Mock()
+        rate, sink = run_pty(term, LiteXTerm.reader, data, chunk=1000, keep=True)
+        self.assertEqual(bytes(sink.data), data)
+        term.answer_magic.assert_called_once_with()
+        # well above 12Mbaud (1.2MB/s)
+        self.assertGreater(rate, 2e6)
@@ -0,0 +1,32 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import os
+import json
+import unittest
+import tempfile
+
+from litex.soc.integration.common import get_mem_data, mem_data_to_bytes, mem_data_from_bytes
+
+
+class TestMemData(unittest.TestCase):
+    def test_get_mem_data(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "mem.bin")
+            with open(filename, "wb") as f:
+                f.write(bytes(range(1, 11)))
+            self.assertEqual(get_mem_data(filename, "little"), [0x04030201, 0x08070605, 0x00000a09])
+            self.assertEqual(get_mem_data(filename, "big"),    [0x01020304, 0x05060708, 0x090a0000])
+
+            regions = os.path.join(tmpdir, "regions.json")
+            with open(regions, "w") as f:
+                json.dump({filename: "0x00000008"}, f)
+            self.assertEqual(get_mem_data(regions, "little"), [0, 0, 0x04030201, 0x08070605, 0x00000a09])
+
+    def test_mem_data_bytes(self):
+        data = [0x04030201, 0x08070605, 0x0c0b0a09]
+        self.assertEqual(mem_data_to_bytes(data), bytes(range(1, 13)))
+        self.assertEqual(mem_data_from_bytes(mem_data_to_bytes(data)), data)
+        self.assertEqual(mem_data_from_bytes(bytes(range(1, 5)), 16), [0x0201, 0x0403])
+        self.assertEqual(mem_data_from_bytes(bytes(range(1, 13)), 64), [0x0807060504030201, 0x0c0b0a09])
+        self.assertEqual(mem_data_from_bytes(bytes(range(1, 13)), 128), [0x0c0b0a090807060504030201])
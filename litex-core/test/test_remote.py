@@ -0,0 +1,671 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import os
+import time
+import struct
+import socket
+import unittest
+import random
+import tempfile
+import threading
+from array import array
+from unittest import mock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from litex.soc.interconnect.csr import CSRStorage, CSRStatus, CSRField
+from litex.soc.integration.soc import SoCCSRRegion
+from litex.soc.integration.export import get_csr_csv
+from litex.tools.remote.etherbone import *
+from litex.tools.remote.csr_builder import CSRBuilder
+from litex.tools.litex_client import RemoteClient
+from litex.tools.litex_server import RemoteServer
+from litex.tools.remote.comm_pcie import CommPCIe
+from litex.tools.remote.comm_udp import CommUDP
+
+try:
+    import usb.core
+    from litex.tools.remote.comm_usb import CommUSB
+except ImportError:
+    usb = None
+
+
+class TestEtherboneCodec(unittest.TestCase):
+    def random_records(self, prng, n):
+        records = []
+        for i in range(n):
+            flags   = {k: prng.randrange(2) for k in etherbone_record_flags.keys()}
+            wdatas  = [prng.randrange(2**32) for j in range(prng.choice([0, 1, 17, 255]))]
+            raddrs  = [prng.randrange(2**32) for j in range(prng.choice([0, 1, 64, 255]))]
+            records.append(dict(flags=flags, byte_enable=prng.randrange(256),
+                base_addr=prng.randrange(2**32), wdatas=wdatas,
+                base_ret_addr=prng.randrange(2**32), raddrs=raddrs))
+        return records
+
+    def legacy_encode(self, records, pf=0):
+        packet = EtherbonePacket()
+        packet.pf = pf
+        for r in records:
+            record = EtherboneRecord()
+            for k, v in r["flags"].items():
+                setattr(record, k, v)
+            record.byte_enable = r["byte_enable"]
+            if r["wdatas"]:
+                record.writes = EtherboneWrites(base_addr=r["base_addr"], datas=r["wdatas"])
+            if r["raddrs"]:
+                record.reads = EtherboneReads(base_ret_addr=r["base_ret_addr"], addrs=r["raddrs"])
+            packet.records.append(record)
+        packet.encode()
+        return bytes(packet)
+
+    def fast_encode(self, records, pf=0):
+        packet = EtherboneFastPacket(pf=pf)
+        for r in records:
+            packet.records.append(EtherboneFastRecord(byte_enable=r["byte_enable"],
+                base_addr=r["base_addr"], wdatas=r["wdatas"],
+                base_ret_addr=r["base_ret_addr"], raddrs=r["raddrs"], **r["flags"]))
+        return packet
+
+    def test_wire_compatibility(self):
+        prng = random.Random(42)
+        for i in range(20):
+            records = self.random_records(prng, prng.randrange(1, 4))
+            legacy  = self.legacy_encode(records, pf=i % 2)
+            packet  = self.fast_encode(records, pf=i % 2)
+            self.assertEqual(len(packet), len(legacy))
+            self.assertEqual(bytes(packet.encode()), legacy)
+
+            # decode legacy bytes with the fast codec
+            decoded = EtherboneFastPacket.decode_from(legacy)
+            self.assertEqual(decoded.pf, i % 2)
+            self.assertEqual(len(decoded.records), len(records))
+            for r, record in zip(records, decoded.records):
+                self.assertEqual(record.wdatas.tolist(), r["wdatas"])
+                self.assertEqual(record.raddrs.tolist(), r["raddrs"])
+                self.assertEqual(record.byte_enable, r["byte_enable"])
+                for k, v in r["flags"].items():
+                    self.assertEqual(getattr(record, k), v)
+
+            # decode fast codec bytes with the legacy codec
+            legacy_packet = EtherbonePacket(packet.encode())
+            legacy_packet.decode()
+            for r, record in zip(records, legacy_packet.records):
+                if r["wdatas"]:
+                    self.assertEqual(record.writes.get_datas(), r["wdatas"])
+                if r["raddrs"]:
+                    self.assertEqual(record.reads.get_addrs(), r["raddrs"])
+
+    def test_encode_into_decode_from_offset(self):
+        packet = EtherboneFastPacket([EtherboneFastRecord(base_addr=0x1000, wdatas=range(16))])
+        buffer = bytearray(3 + 2*len(packet))
+        end    = packet.encode_into(memoryview(buffer), 3)
+        end    = packet.encode_into(buffer, end)
+        self.assertEqual(end, len(buffer))
+        decoded = EtherboneFastPacket.decode_from(buffer, 3 + len(packet), len(packet))
+        self.assertEqual(decoded.records[0].base_addr, 0x1000)
+        self.assertEqual(decoded.records[0].wdatas.tolist(), list(range(16)))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            EtherboneFastPacket([EtherboneFastRecord(wdatas=range(256))]).encode()
+        with self.assertRaises(ValueError):
+            EtherboneFastPacket.decode_from(bytes(12))
+
+
+class CommMemory:
+    """Comm stand-in backed by a dict (32-bit words, byte addresses)"""
+    def __init__(self, delay=0):
+        self.mem    = dict()
+        self.delay  = delay
+        self.log    = []
+        self.reads  = 0
+        self.writes = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self, addr, length=None):
+        self.reads += 1
+        self.log.append(addr)
+        time.sleep(self.delay)
+        datas = [self.mem.get(addr + 4*i, 0) for i in range(1 if length is None else length)]
+        return datas[0] if length is None else datas
+
+    def write(self, addr, datas):
+        self.writes += 1
+        datas = datas if isinstance(datas, list) else [datas]
+        for i, data in enumerate(datas):
+            self.mem[addr + 4*i] = data
+
+
+class RemoteTestCase(unittest.TestCase):
+    comm_delay = 0
+
+    def setUp(self):
+        self.comm   = CommMemory(self.comm_delay)
+        self.server = RemoteServer(self.comm, "localhost", 0)
+        self.server.open()
+        self.server.start()
+        self.client = self.new_client()
+
+    def new_client(self):
+        port   = self.server.socket.getsockname()[1]
+        client = RemoteClient(port=port, csr_csv=None, csr_data_width=32)
+        client.open()
+        return client
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+
+class TestRemoteBatch(RemoteTestCase):
+    def test_single(self):
+        self.client.write(0x100, [1, 2, 3])
+        self.assertEqual(self.client.read(0x100, 3), [1, 2, 3])
+        self.assertEqual(self.client.read(0x104), 2)
+
+    def test_batch(self):
+        with self.client.batch() as b:
+            b.write(0x1000, list(range(300)))
+            f0 = b.read(0x1000)
+            f1 = b.read(0x1000 + 4*299)
+            b.write(0x1000, 0xdeadbeef)
+            f2 = b.read(0x1000, 600)
+            futures = [b.read(0x2000 + 8*i) for i in range(100)]
+        self.assertEqual(f0.result(), 0)
+        self.assertEqual(f1.result(), 299)
+        self.assertEqual(f2.result(), [0xdeadbeef] + list(range(1, 300)) + [0]*300)
+        self.assertEqual([f.result() for f in futures], [0]*100)
+
+    def test_batch_coalesce(self):
+        for coalesce in [True, False]:
+            with self.client.batch(coalesce=coalesce, max_inflight=2) as b:
+                futures = [b.read(0x3000 + 4*i) for i in range(32)]
+                b.write(0x3000, 1)
+                b.write(0x3004, 2)
+            self.assertEqual([f.result() for f in futures], [0]*32)
+            self.assertEqual(self.client.read(0x3000, 2), [1, 2])
+            self.comm.mem.clear()
+
+    def test_server_closed(self):
+        # replies lost with the connection are reported instead of failing to decode
+        self.server.close()
+        with self.assertRaises(ConnectionError):
+            self.client.read(0x100)
+        with self.assertRaises(ConnectionError):
+            with self.client.batch() as b:
+                b.read(0x100)
+
+    def test_future_flush(self):
+        b = self.client.batch()
+        b.write(0x10, 42)
+        f = b.read(0x10)
+        self.assertFalse(f.done())
+        self.assertEqual(f.result(), 42)
+        self.assertTrue(f.done())
+
+
+class TestRemoteServer(RemoteTestCase):
+    def test_multiple_clients(self):
+        errors = []
+        def run(n):
+            client = self.new_client()
+            try:
+                base = 0x10000*(n + 1)
+                for i in range(20):
+                    with client.batch() as b:
+                        b.write(base, [n, i])
+                        f = b.read(base, 2)
+                    if f.result() != [n, i]:
+                        errors.append((n, i, f.result()))
+            finally:
+                client.close()
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.stats["packets"], 4*20)
+
+    def test_multiple_records(self):
+        # every record of a packet is executed, whatever the TCP segmentation
+        packet = EtherboneFastPacket([
+            EtherboneFastRecord(base_addr=0x100, wdatas=[1, 2, 3]),
+            EtherboneFastRecord(raddrs=[0x100, 0x108], base_ret_addr=0x10),
+            EtherboneFastRecord(base_addr=0x200, wdatas=[4], raddrs=[0x104, 0x200], base_ret_addr=0x20),
+        ]).encode()
+        data = packet + EtherboneFastPacket([EtherboneFastRecord(raddrs=[0x200], base_ret_addr=0x30)]).encode()
+        for i in range(0, len(data), 7):
+            self.client.send_packet(self.client.socket, data[i:i + 7])
+            time.sleep(0.001)
+        replies = []
+        for i in range(3):
+            record = EtherboneFastPacket.decode_from(self.client.receive_packet(self.client.socket)).records[0]
+            replies.append((record.base_addr, record.wdatas.tolist()))
+        self.assertEqual(replies, [(0x10, [1, 3]), (0x20, [2, 4]), (0x30, [4])])
+
+    def test_ipc_stream(self):
+        records = [EtherboneFastRecord(base_addr=4*i, wdatas=list(range(i + 1))) for i in range(4)]
+        data = EtherboneFastPacket(records[:3]).encode() + EtherboneFastPacket(records[3:]).encode()
+        for split in range(1, len(data)):
+            stream  = EtherboneIPCStream()
+            packets = stream.feed(data[:split]) + stream.feed(data[split:])
+            decoded = [(record.base_addr, record.wdatas.tolist()) for packet in packets for record in packet.records]
+            self.assertEqual(decoded, [(4*i, list(range(i + 1))) for i in range(4)])
+        record = bytearray(len(records[0]))
+        records[0].encode_into(record)
+        with self.assertRaises(ValueError):
+            EtherboneIPCStream().feed(record)
+
+    def test_comm_error(self):
+        # clients of a failed batch are disconnected instead of waiting for their replies
+        def read(addr, length=None):
+            raise IOError("comm error")
+        self.client.socket.settimeout(5)
+        with mock.patch.object(self.comm, "read", read), mock.patch("traceback.print_exc"):
+            with self.assertRaises(ConnectionError):
+                self.client.read(0x100)
+        other = self.new_client()
+        try:
+            other.write(0x100, 42)
+            self.assertEqual(other.read(0x100), 42)
+        finally:
+            other.close()
+
+    def test_batch_merges_clients(self):
+        # contiguous reads of different clients are executed as one comm burst
+        a, b = object(), object()
+        packets = []
+        for base in [0x100, 0x110]:
+            record = EtherboneFastRecord(raddrs=[base + 4*i for i in range(4)])
+            packets.append(EtherboneFastPacket([record]))
+        self.comm.mem.update({0x100 + 4*i: i for i in range(8)})
+        replies = self.server._execute([(a, packets[0]), (b, packets[1])])
+        self.assertEqual(self.comm.log, [0x100])
+        self.assertEqual([client for client, _ in replies], [a, b])
+        datas = [EtherboneFastPacket.decode_from(reply).records[0].wdatas.tolist() for _, reply in replies]
+        self.assertEqual(datas, [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+
+class TestRemoteServerFairness(RemoteTestCase):
+    comm_delay = 0.001
+
+    def test_fairness(self):
+        # a client flooding the server does not starve the others
+        packet = EtherboneFastPacket([EtherboneFastRecord(raddrs=[0x1000])]).encode()
+        self.client.send_packet(self.client.socket, packet*200)
+        time.sleep(0.01)
+        other = self.new_client()
+        try:
+            other.read(0x2000)
+        finally:
+            other.close()
+        for i in range(200):
+            self.client.receive_packet(self.client.socket)
+        self.assertEqual(len(self.comm.log), 201)
+        self.assertLess(self.comm.log.index(0x2000), 50)
+
+
+class TestCSRBuilder(unittest.TestCase):
+    def setUp(self):
+        ctrl = CSRStorage(fields=[
+            CSRField("enable", size=1),
+            CSRField("mode",   size=3, offset=4),
+            CSRField("start",  size=1, offset=8, pulse=True),
+        ], name="ctrl")
+        status = CSRStatus(fields=[
+            CSRField("ready", size=1),
+            CSRField("count", size=12, offset=16),
+        ], name="status")
+        value = CSRStorage(40, name="value")
+        regions = {
+            "sdram": SoCCSRRegion(0x800, 8, [ctrl, status, value]),
+            "uart":  SoCCSRRegion(0x1000, 8, [CSRStorage(8, name="rxtx")]),
+        }
+        self.csv = tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False)
+        self.csv.write(get_csr_csv(regions, {"CONFIG_CSR_DATA_WIDTH": 8}))
+        self.csv.close()
+        self.comm = CommMemory()
+
+    def tearDown(self):
+        os.remove(self.csv.name)
+
+    def test_fields(self):
+        csrs = CSRBuilder(self.comm, self.csv.name)
+        ctrl = csrs.regs.sdram_ctrl
+        self.assertEqual(sorted(ctrl.fields.d.keys()), ["enable", "mode", "start"])
+        ctrl.fields.mode.write(5)
+        ctrl.fields.enable.write(1)
+        self.assertEqual(ctrl.read(), 0x51)
+        self.assertEqual(ctrl.fields.mode.read(), 5)
+        # pulse fields are not re-triggered by the read-modify-write of the other fields
+        ctrl.fields.start.write(1)
+        self.comm.write(ctrl.addr, [0x01, 0x51])
+        ctrl.fields.enable.write(0)
+        self.assertEqual(ctrl.read(), 0x50)
+        with self.assertRaises(KeyError):
+            csrs.regs.sdram_status.fields.ready.write(1)
+
+    def test_shadow(self):
+        csrs = CSRBuilder(self.comm, self.csv.name, shadow=True)
+        ctrl = csrs.regs.sdram_ctrl
+        ctrl.write(0x10)
+        reads = self.comm.reads
+        ctrl.fields.enable.write(1)
+        ctrl.fields.mode.write(3)
+        self.assertEqual(self.comm.reads, reads)
+        self.assertEqual(ctrl.read(), 0x31)
+        ctrl.clear_shadow()
+        ctrl.fields.enable.write(0)
+        self.assertEqual(self.comm.reads, reads + 2)
+        self.assertEqual(ctrl.read(), 0x30)
+
+    def test_bank_snapshot(self):
+        csrs = CSRBuilder(self.comm, self.csv.name, shadow=True)
+        csrs.regs.sdram_ctrl.write(0x21)
+        csrs.regs.sdram_value.write(0x123456789a)
+        self.comm.write(csrs.regs.sdram_status.addr, [0x05, 0x00, 0x34, 0x01])
+        self.comm.log.clear()
+        snapshot = csrs.bank_snapshot("sdram")
+        self.assertEqual(self.comm.log, [0x800])
+        self.assertEqual(snapshot.ctrl, 0x21)
+        self.assertEqual(snapshot.ctrl_mode, 2)
+        self.assertEqual(snapshot.ctrl_enable, 1)
+        self.assertFalse(hasattr(snapshot, "ctrl_start"))
+        self.assertEqual(snapshot.status_ready, 1)
+        self.assertEqual(snapshot.status_count, 0x500)
+        self.assertEqual(snapshot.value, 0x123456789a)
+        self.assertEqual(csrs.regs.sdram_value.shadow_value, 0x123456789a)
+        with self.assertRaises(KeyError):
+            csrs.bank_snapshot("ddrphy")
+
+    def test_client(self):
+        comm   = CommMemory()
+        server = RemoteServer(comm, "localhost", 0)
+        server.open()
+        server.start()
+        try:
+            client = RemoteClient(port=server.socket.getsockname()[1], csr_csv=self.csv.name, csr_shadow=True)
+            client.open()
+            client.regs.sdram_ctrl.fields.mode.write(7)
+            self.assertEqual(client.bank_snapshot("sdram").ctrl_mode, 7)
+            # reads/writes larger than a record
+            client.write(0x10000, list(range(600)))
+            self.assertEqual(client.read(0x10000, 600), list(range(600)))
+            client.close()
+        finally:
+            server.close()
+
+
+class TestCommPCIe(unittest.TestCase):
+    # the sysfs BAR resource file is emulated with a regular file
+    def setUp(self):
+        fd, self.bar = tempfile.mkstemp()
+        os.write(fd, bytes(65536))
+        os.close(fd)
+        self.comm = CommPCIe(self.bar)
+        self.comm.open()
+
+    def tearDown(self):
+        self.comm.close()
+        os.remove(self.bar)
+
+    def test_read_write(self):
+        self.comm.write(0x100, 0x12345678)
+        self.assertEqual(self.comm.read(0x100), 0x12345678)
+        self.assertEqual(self.comm.read(0x100, 1, format="bytes"), bytes([0x78, 0x56, 0x34, 0x12]))
+        datas = list(range(1000))
+        self.comm.write(0x1000, datas)
+        self.assertEqual(self.comm.read(0x1000, 1000), datas)
+        self.assertEqual(self.comm.read(0x1000, 1000, format="array"), array("I", datas))
+        self.comm.write(0x2000, array("I", datas))
+        self.comm.write(0x3000, self.comm.read(0x2000, 1000, format="bytes"))
+        self.assertEqual(self.comm.read(0x3000, 1000), datas)
+        with self.assertRaises(ValueError):
+            self.comm.write(0x0, bytes(3))
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_numpy(self):
+        datas = np.arange(4096, dtype=np.uint32)
+        self.comm.write(0x4000, datas)
+        self.assertTrue((self.comm.read(0x4000, 4096, format="numpy") == datas).all())
+        self.comm.write(0x4000, datas[::2].astype(">u4"))
+        self.assertEqual(self.comm.read(0x4004), 2)
+        view = self.comm.view(0x8000, 1024)
+        view[:] = np.arange(256)
+        self.assertEqual(self.comm.read(0x8000 + 4*17), 17)
+        self.comm.write(0x8000, 0xdeadbeef)
+        self.assertEqual(view[0], 0xdeadbeef)
+        del view
+
+    def test_memoryview(self):
+        view = self.comm.view(0x0, 64, format="memoryview")
+        view[3] = 42
+        self.assertEqual(self.comm.read(0xc), 42)
+        view.release()
+
+
+class UDPBoardModel:
+    """Loopback stand-in for an Etherbone board, dropping packets (requests and replies) with the
+    given probability. Like the LiteEth Etherbone core, only the first record of a packet is
+    processed unless multi_records is set."""
+    def __init__(self, loss=0.0, seed=42, multi_records=False):
+        self.mem           = dict()
+        self.loss          = loss
+        self.prng          = random.Random(seed)
+        self.multi_records = multi_records
+        self.dropped       = 0
+        self.max_size      = 0
+        self.max_records   = 0
+        self.raddrs        = set()
+        self.socket        = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.port          = self.socket.getsockname()[1]
+        self.thread        = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def lost(self):
+        lost = self.prng.random() < self.loss
+        self.dropped += lost
+        return lost
+
+    def serve(self):
+        while True:
+            try:
+                datas, addr = self.socket.recvfrom(65536)
+            except OSError:
+                return
+            self.max_size = max(self.max_size, len(datas))
+            if self.lost():
+                continue
+            records = EtherboneFastPacket.decode_from(datas).records
+            self.max_records = max(self.max_records, len(records))
+            if not self.multi_records:
+                records = records[:1]
+            for record in records:
+                for i, data in enumerate(record.wdatas):
+                    self.mem[record.base_addr + 4*i] = data
+                self.raddrs.update(record.raddrs)
+                if record.rcount:
+                    # one reply per read record, base address = base return address
+                    reply = EtherboneFastRecord(base_addr=record.base_ret_addr,
+                        wdatas=[self.mem.get(addr, 0) for addr in record.raddrs])
+                    if not self.lost():
+                        self.socket.sendto(EtherboneFastPacket([reply]).encode(), addr)
+
+    def close(self):
+        self.socket.close()
+
+
+class TestCommUDP(unittest.TestCase):
+    def run_transfers(self, loss, multi_records=False, **kwargs):
+        board = UDPBoardModel(loss=loss, multi_records=multi_records)
+        comm  = CommUDP("127.0.0.1", board.port, local_port=0, timeout=0.02,
+            multi_records=multi_records, **kwargs)
+        comm.open()
+        try:
+            datas = list(range(1000, 3000))
+            comm.write(0x10000, datas)
+            self.assertEqual(comm.read(0x10000, 2000), datas)
+            comm.write(0x10004, 0xdeadbeef)
+            self.assertEqual(comm.read(0x10004), 0xdeadbeef)
+        finally:
+            comm.close()
+            board.close()
+        return comm.stats, board
+
+    def test_no_loss(self):
+        stats, board = self.run_transfers(loss=0.0)
+        self.assertEqual(stats.retries, 0)
+        self.assertEqual(stats.words, 4002)
+        self.assertGreater(stats.rtt, 0)
+        self.assertGreater(stats.words_per_second, 0)
+        # one record per packet, writes not read back
+        self.assertEqual(board.max_records, 1)
+        self.assertEqual(board.raddrs, set(range(0x10000, 0x10000 + 4*2000, 4)))
+
+    def test_multi_records(self):
+        stats, board = self.run_transfers(loss=0.0, multi_records=True, mtu=9000)
+        self.assertGreater(board.max_records, 1)
+
+    def test_loss(self):
+        # lost writes are only retransmitted when acknowledged
+        stats, board = self.run_transfers(loss=0.2, window=4, ack_writes=True, ack_addr=0x4)
+        self.assertGreater(board.dropped, 0)
+        self.assertGreater(stats.retries, 0)
+        self.assertIn(0x4, board.raddrs)
+
+    def test_ack_writes(self):
+        with self.assertRaises(ValueError):
+            CommUDP("127.0.0.1", ack_writes=True)
+        stats, board = self.run_transfers(loss=0.0, ack_writes=True, ack_addr=0x4)
+        # acknowledgements only read ack_addr, never the written addresses
+        self.assertEqual(board.raddrs - set(range(0x10000, 0x10000 + 4*2000, 4)), {0x4})
+
+    def test_mtu(self):
+        stats, board = self.run_transfers(loss=0.0, mtu=576)
+        self.assertLessEqual(board.max_size, 576 - 28)
+
+    def test_timeout(self):
+        board = UDPBoardModel(loss=1.0)
+        comm  = CommUDP("127.0.0.1", board.port, local_port=0, timeout=0.01, retries=2)
+        comm.open()
+        try:
+            with self.assertRaises(TimeoutError):
+                comm.read(0x0)
+        finally:
+            comm.close()
+            board.close()
+        self.assertEqual(comm.stats.retries, 2)
+
+
+class FakeUSBEndpoint:
+    def __init__(self, address, attributes=0x2):
+        self.bEndpointAddress = address
+        self.bmAttributes     = attributes
+
+
+class FakeUSBInterface(list):
+    def __init__(self, cls, subclass, endpoints):
+        list.__init__(self, endpoints)
+        self.bInterfaceClass    = cls
+        self.bInterfaceSubClass = subclass
+
+
+class FakeUSBDevice:
+    """pyusb device stand-in implementing the EP0 and bulk bridge protocols on a dict memory"""
+    def __init__(self, bulk=True):
+        self.mem       = dict()
+        self.transfers = 0
+        self.errors    = 0 # number of transfers to fail with an USBError
+        self.rx        = bytearray()
+        self.interfaces = [FakeUSBInterface(0x02, 0x00, [FakeUSBEndpoint(0x81, 0x3)])]
+        if bulk:
+            self.interfaces.append(FakeUSBInterface(0xff, 0x57, [FakeUSBEndpoint(0x02), FakeUSBEndpoint(0x82)]))
+
+    def _transfer(self):
+        self.transfers += 1
+        if self.errors:
+            self.errors -= 1
+            raise usb.core.USBError("fake error", errno=5)
+
+    def get_active_configuration(self):
+        return self.interfaces
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout=None):
+        self._transfer()
+        addr = (wIndex << 16) | wValue
+        if bmRequestType == 0xc3:
+            return array("B", self.mem.get(addr, 0).to_bytes(4, byteorder="little"))
+        self.mem[addr] = int.from_bytes(data_or_wLength, byteorder="little")
+        return 4
+
+    def write(self, endpoint, data, timeout=None):
+        self._transfer()
+        assert endpoint == 0x02
+        cmd, _, length, addr = struct.unpack_from("<BBHI", data)
+        if cmd == 0x01:
+            for i, value in enumerate(struct.unpack_from("<{}I".format(length), data, 8)):
+                self.mem[addr + 4*i] = value
+        else:
+            self.rx += struct.pack("<{}I".format(length), *[self.mem.get(addr + 4*i, 0) for i in range(length)])
+        return len(data)
+
+    def read(self, endpoint, length, timeout=None):
+        self._transfer()
+        assert endpoint == 0x82
+        length = min(length, 512*16) # short transfers
+        data, self.rx = self.rx[:length], self.rx[length:]
+        return array("B", data)
+
+
+@unittest.skipIf(usb is None, "pyusb not available")
+class TestCommUSB(unittest.TestCase):
+    def open(self, dev, **kwargs):
+        comm = CommUSB(vid=0x1209, pid=0x5bf0, **kwargs)
+        with mock.patch("usb.core.find", return_value=dev):
+            comm.open()
+        return comm
+
+    def check(self, comm):
+        datas = list(range(5000))
+        comm.write(0x1000, datas)
+        self.assertEqual(comm.read(0x1000, 5000), datas)
+        comm.write(0x10, 0x12345678)
+        self.assertEqual(comm.read(0x10), 0x12345678)
+
+    def test_bulk(self):
+        dev  = FakeUSBDevice(bulk=True)
+        comm = self.open(dev)
+        self.assertEqual(comm.bulk_endpoints, (0x02, 0x82))
+        self.check(comm)
+        # 1 write + (1 read command + 3 short IN transfers) + 1 write + 2 read transfers
+        self.assertEqual(dev.transfers, 8)
+
+    def test_ep0_fallback(self):
+        for dev, kwargs in [(FakeUSBDevice(bulk=False), {}), (FakeUSBDevice(bulk=True), {"bulk": False})]:
+            comm = self.open(dev, **kwargs)
+            self.assertIsNone(comm.bulk_endpoints)
+            self.check(comm)
+            self.assertEqual(dev.transfers, 2*5000 + 2)
+            self.assertEqual(dev.mem[0x1000 + 4*4999], 4999)
+
+    def test_reconnect(self):
+        dev  = FakeUSBDevice(bulk=True)
+        comm = self.open(dev)
+        dev.errors = 2
+        with mock.patch("usb.core.find", return_value=dev):
+            comm.write(0x0, [1, 2, 3])
+            self.assertEqual(comm.read(0x0, 3), [1, 2, 3])
+            dev.errors = comm.max_retries + 1
+            with self.assertRaises(usb.core.USBError):
+                comm.read(0x0)
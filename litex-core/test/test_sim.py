@@ -0,0 +1,295 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import os
+import re
+import gzip
+import unittest
+import random
+import tempfile
+from unittest import mock
+
+from migen import *
+from migen.genlib.fsm import FSM, NextState, NextValue
+
+from litex.gen.sim import *
+from litex.gen.sim.vcd import VCDWriter
+
+
+class SimDUT(Module):
+    def __init__(self):
+        self.a   = a   = Signal(8)
+        self.b   = b   = Signal((8, True))
+        self.sel = sel = Signal(2)
+
+        self.sum    = Signal(10)
+        self.signed = Signal((10, True))
+        self.cat    = Signal(24)
+        self.rep    = Signal(16)
+        self.mux    = Signal(8)
+        self.case   = Signal(8)
+        self.array  = Signal(8)
+        self.slice  = Signal(16)
+        self.split  = Signal(4)
+        self.count  = Signal(16)
+        self.state  = Signal(4)
+        self.dout   = Signal(16)
+
+        # # #
+
+        self.comb += [
+            self.sum.eq(a + b),
+            self.signed.eq(b - a),
+            self.cat.eq(Cat(a[4:], b, sel, a[:4])),
+            self.rep.eq(Replicate(a[2:6], 4)),
+            self.mux.eq(Mux(sel[0], a, b)),
+            Case(sel, {
+                0:         self.case.eq(a),
+                1:         self.case.eq(b[1:]),
+                "default": self.case.eq(0x55),
+            }),
+            Cat(self.split, self.slice[4:12]).eq(Cat(a, b)),
+            self.array.eq(Array([a, b, a ^ b, 0x12])[sel]),
+        ]
+        self.sync += [
+            self.count.eq(self.count + 1),
+            If(sel == 0,
+                self.slice[0:4].eq(a)
+            ).Elif(sel == 1,
+                self.slice[12:16].eq(b)
+            ).Else(
+                self.slice[12:16].eq(0)
+            )
+        ]
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        fsm.act("IDLE",
+            If(a[0], NextState("RUN"), NextValue(self.state, self.state + 1))
+        )
+        fsm.act("RUN",
+            If(b[0], NextState("IDLE"))
+        )
+
+        mem  = Memory(16, 8, init=[i*3 for i in range(8)])
+        port = mem.get_port(write_capable=True, we_granularity=8)
+        self.specials += mem, port
+        self.comb += [
+            port.adr.eq(a[:3]),
+            port.dat_w.eq(Cat(a, b)),
+            port.we.eq(Cat(sel[0], sel[1] & b[7])),
+            self.dout.eq(port.dat_r),
+        ]
+
+    def probes(self):
+        return [self.sum, self.signed, self.cat, self.rep, self.mux, self.case,
+            self.array, self.slice, self.split, self.count, self.state, self.dout]
+
+
+def stimulus(dut, trace, seed=42):
+    prng = random.Random(seed)
+    for i in range(256):
+        yield dut.a.eq(prng.randrange(2**8))
+        yield dut.b.eq(prng.randrange(-2**7, 2**7))
+        yield dut.sel.eq(prng.randrange(4))
+        yield
+        trace.append((yield [probe for probe in dut.probes()]))
+
+
+class TestSim(unittest.TestCase):
+    def run_engine(self, **kwargs):
+        dut   = SimDUT()
+        trace = []
+        with Simulator(dut, stimulus(dut, trace), **kwargs) as sim:
+            sim.run()
+        return trace, sim
+
+    def test_compiled_matches_interpreted(self):
+        interpreted, _ = self.run_engine(compiled=False)
+        compiled, _    = self.run_engine(compiled=True)
+        self.assertEqual(len(interpreted), 256)
+        self.assertEqual(interpreted, compiled)
+
+    def test_event_driven_matches_full_propagation(self):
+        for compiled in [False, True]:
+            full, full_sim   = self.run_engine(compiled=compiled, event_driven=False)
+            event, event_sim = self.run_engine(compiled=compiled, event_driven=True)
+            self.assertEqual(full, event)
+            self.assertEqual(full_sim.cycles, event_sim.cycles)
+            self.assertLess(event_sim.comb_statements_per_cycle(),
+                            full_sim.comb_statements_per_cycle())
+
+    def test_generator_write_to_comb_target(self):
+        def generator(dut):
+            yield dut.a.eq(3)
+            yield
+            yield dut.sum.eq(0)  # overridden by comb logic
+            yield
+            self.assertEqual((yield dut.sum), 3)
+        for compiled in [False, True]:
+            dut = SimDUT()
+            run_simulation(dut, generator(dut), compiled=compiled)
+
+    def test_wide_datapath(self):
+        class WideDUT(Module):
+            def __init__(self):
+                self.data = Signal(512)
+                self.rep  = Signal(512)
+                self.word = Signal(32)
+                self.sync += [
+                    self.data[480:512].eq(self.word),
+                    self.data[0:32].eq(self.data[480:512]),
+                    self.rep.eq(Replicate(self.word[0:8], 64)),
+                ]
+        def generator(dut):
+            yield dut.word.eq(0xdeadbeef)
+            for i in range(3):
+                yield
+            self.assertEqual((yield dut.data), (0xdeadbeef << 480) | 0xdeadbeef)
+            self.assertEqual((yield dut.rep), int("ef"*64, 16))
+            self.assertEqual((yield dut.data[480:496]), 0xbeef)
+        for compiled in [False, True]:
+            dut = WideDUT()
+            run_simulation(dut, generator(dut), compiled=compiled)
+
+    def test_compiled_signed(self):
+        def generator(dut):
+            yield dut.a.eq(200)
+            yield dut.b.eq(-100)
+            yield
+            yield
+            self.assertEqual((yield dut.signed), -300)
+            self.assertEqual((yield dut.sum), (200 - 100) & 0x3ff)
+        dut = SimDUT()
+        run_simulation(dut, generator(dut), compiled=True)
+
+
+class MultiDomainDUT(Module):
+    def __init__(self):
+        self.clock_domains.cd_fast = ClockDomain(reset_less=True)
+        self.clock_domains.cd_slow = ClockDomain(reset_less=True)
+        self.clock_domains.cd_idle = ClockDomain(reset_less=True)
+        self.enable = Signal()
+        self.fast   = Signal(8)
+        self.slow   = Signal(8)
+        self.idle   = Signal(8)
+        self.sample = Signal(8)
+
+        # # #
+
+        self.sync.fast += If(self.enable, self.fast.eq(self.fast + 1))
+        self.sync.slow += [
+            self.slow.eq(self.slow + 1),
+            self.sample.eq(self.fast),
+        ]
+        self.sync.idle += self.idle.eq(self.enable)
+
+
+class TestSimScheduling(unittest.TestCase):
+    clocks = {"sys": 10, "fast": 4, "slow": (14, 3), "idle": 26}
+
+    def test_hyperperiod_matches_heap(self):
+        from litex.gen.sim.core import TimeManager
+        schedule = TimeManager(self.clocks)
+        heap     = TimeManager(self.clocks, max_schedule=0)
+        self.assertIsNotNone(schedule.schedule)
+        self.assertIsNone(heap.schedule)
+        for i in range(2000):
+            self.assertEqual(schedule.tick(), heap.tick())
+
+    def run_dut(self, **kwargs):
+        dut   = MultiDomainDUT()
+        trace = []
+        def generator(dut):
+            for i in range(64):
+                yield dut.enable.eq((i//16) % 2)
+                yield
+                trace.append((yield [dut.fast, dut.slow, dut.idle, dut.sample]))
+        with Simulator(dut, generator(dut), clocks=self.clocks, **kwargs) as sim:
+            sim.run()
+        return trace, sim
+
+    def test_quiescent_domains(self):
+        for compiled in [False, True]:
+            reference, _ = self.run_dut(compiled=compiled, quiescent=False)
+            trace, sim   = self.run_dut(compiled=compiled, quiescent=True)
+            self.assertEqual(reference, trace)
+            self.assertGreater(sim.sync_skipped, 0)
+
+
+class TestVCD(unittest.TestCase):
+    def run_vcd(self, filename, **kwargs):
+        dut = MultiDomainDUT()
+        def generator(dut):
+            yield dut.enable.eq(1)
+            for i in range(16):
+                yield
+        run_simulation(dut, generator(dut), clocks=TestSimScheduling.clocks,
+            vcd_name=filename, **kwargs)
+
+    def parse(self, content):
+        names  = re.findall(r"\$var wire \d+ (\S+) (\S+) \$end", content)
+        times  = [int(t) for t in re.findall(r"^#(\d+)$", content, re.M)]
+        return dict((name, code) for code, name in names), times
+
+    def test_vcd(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "sim.vcd")
+            self.run_vcd(filename)
+            with open(filename) as f:
+                content = f.read()
+        codes, times = self.parse(content)
+        self.assertIn("fast", codes)
+        self.assertIn("slow", codes)
+        self.assertEqual(content.count("$enddefinitions"), 1)
+        self.assertEqual(times, sorted(set(times)))
+        self.assertIn("b1111 {}".format(codes["fast"]), content)
+
+    def test_fst_without_vcd2fst(self):
+        # a missing vcd2fst does not fail the simulation, the VCD is kept
+        class DUT(Module):
+            def __init__(self):
+                self.counter = Signal(4)
+                self.sync += self.counter.eq(self.counter + 1)
+        def generator():
+            for i in range(4):
+                yield
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "sim.fst")
+            with mock.patch("shutil.which", return_value=None):
+                with self.assertWarns(UserWarning):
+                    run_simulation(DUT(), generator(), vcd_name=filename)
+            self.assertEqual(os.listdir(d), ["sim.vcd"])
+
+    def test_vcd_filter_window_compression(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "sim.vcd.gz")
+            self.run_vcd(filename,
+                trace_filter = ["fast*", re.compile("^sl.w$")],
+                trace_start  = 20,
+                trace_end    = 40)
+            with gzip.open(filename, "rt") as f:
+                content = f.read()
+        codes, times = self.parse(content)
+        self.assertEqual(set(codes.keys()), {"fast", "slow", "fast_clk"})
+        self.assertGreaterEqual(min(times), 20)
+        self.assertLessEqual(max(times), 40)
+        self.assertIn("$dumpvars", content)
+
+    def test_vcd_window_skipped(self):
+        # nothing is dumped out of the window, even when a delay jumps past the whole window
+        for trace_start, trace_end, delays in [(0, 0, [5, 5]), (10, 20, [5, 30, 5])]:
+            with tempfile.TemporaryDirectory() as d:
+                filename = os.path.join(d, "sim.vcd")
+                signal   = Signal(4, name="signal")
+                writer   = VCDWriter(filename, trace_start=trace_start, trace_end=trace_end)
+                writer.init([signal])
+                for i, delay in enumerate(delays):
+                    writer.set(signal, i + 1)
+                    writer.delay(delay)
+                writer.close()
+                with open(filename) as f:
+                    content = f.read()
+            codes, times = self.parse(content)
+            self.assertEqual(times, [])
+            self.assertNotIn("$dumpvars", content)
@@ -0,0 +1,116 @@
+# This file is Copyright (c) 2020 LiteX developers
+# License: BSD
+
+import unittest
+import threading
+from collections import deque
+from unittest import mock
+
+from migen import *
+
+from litex.gen.sim import *
+
+from litex.soc.interconnect import wishbone
+from litex.soc.cores.uart import UARTInterface
+from litex.soc.interconnect.wishbonebridge import WishboneStreamingBridge
+from litex.tools.remote.comm_uart import CommUART
+
+
+class SimSerial:
+    """Serial port stand-in connecting a CommUART (host thread) to the simulated bridge"""
+    def __init__(self):
+        self.tx   = deque() # host -> bridge
+        self.rx   = deque() # bridge -> host
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def write(self, data):
+        with self.cond:
+            self.tx.extend(bytes(data))
+        return len(data)
+
+    def read(self, length):
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.rx) or self.closed, timeout=10) or self.closed:
+                raise TimeoutError
+            return bytes(self.rx.popleft() for i in range(min(length, len(self.rx))))
+
+    def inWaiting(self):
+        return len(self.rx)
+
+    def close(self):
+        pass
+
+
+class BridgeDUT(Module):
+    def __init__(self):
+        self.phy = UARTInterface()
+        self.submodules.bridge = WishboneStreamingBridge(self.phy, clk_freq=int(1e6))
+        self.submodules.sram   = wishbone.SRAM(4096, bus=self.bridge.wishbone)
+
+
+class TestWishboneStreamingBridge(unittest.TestCase):
+    def run_bridge(self, host, version, byte_period=2):
+        dut    = BridgeDUT()
+        port   = SimSerial()
+        done   = threading.Event()
+        errors = []
+
+        def host_thread():
+            try:
+                with mock.patch("serial.serial_for_url", return_value=port):
+                    comm = CommUART("sim://", version=version)
+                host(comm)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        def phy_generator():
+            # no backpressure on the phy source (as with the RS232 PHY), one byte per byte_period
+            cycles = 0
+            while not done.is_set():
+                # handshake of the current cycle
+                if (yield dut.phy.sink.valid) and (yield dut.phy.sink.ready):
+                    with port.cond:
+                        port.rx.append((yield dut.phy.sink.data))
+                        port.cond.notify_all()
+                # next cycle
+                with port.cond:
+                    data = port.tx.popleft() if cycles % byte_period == 0 and port.tx else None
+                yield dut.phy.source.valid.eq(data is not None)
+                yield dut.phy.source.data.eq(data or 0)
+                yield dut.phy.sink.ready.eq(cycles % byte_period == 0)
+                yield
+                cycles += 1
+
+        thread = threading.Thread(target=host_thread)
+        thread.start()
+        try:
+            run_simulation(dut, phy_generator(), compiled=True)
+        finally:
+            with port.cond:
+                port.closed = True
+                port.cond.notify_all()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_v1(self):
+        def host(comm):
+            datas = list(range(0x100, 0x100 + 20))
+            comm.write(0x40, datas)
+            self.assertEqual(comm.read(0x40, 20), datas)
+            self.assertEqual(comm.read(0x44), datas[1])
+        self.run_bridge(host, version=1)
+
+    def test_v2(self):
+        def host(comm):
+            datas = [(0x12345678*i) & 0xffffffff for i in range(300)]
+            comm.write(0x100, datas)
+            comm.write(0x100, 0xdeadbeef)
+            self.assertEqual(comm.read(0x100, 300), [0xdeadbeef] + datas[1:])
+            # pipelined reads: read commands sent ahead of the data of the previous read
+            comm.max_length = 16
+            self.assertEqual(comm.read(0x104, 64), datas[1:65])
+        self.run_bridge(host, version=2)